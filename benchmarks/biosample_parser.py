@@ -0,0 +1,109 @@
+"""Benchmark BioSample docsum parsing on a large synthetic docsum file.
+
+Compares the single pass `BioSampleParser.iterparse` against the previous
+approach of building a full tree per record and running one XPath query per
+harmonized attribute.
+
+    python benchmarks/biosample_parser.py --records 200000
+"""
+import os
+import time
+import tempfile
+import tracemalloc
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+import click
+
+from genbankqc.docsum import ATTRIBUTES, BioSampleParser
+
+
+def write_docsum(path, records, attributes_per_record=12):
+    """Write a synthetic eSummaryResult with `records` BioSample records."""
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8" ?>\n')
+        f.write('<eSummaryResult><DocumentSummarySet status="OK">\n')
+        for i in range(records):
+            acc = "SAMN{:08d}".format(i)
+            attributes = "".join(
+                '<Attribute attribute_name="{0}" harmonized_name="{0}">'
+                "value {1}</Attribute>".format(name, i)
+                for name in ATTRIBUTES[:attributes_per_record]
+            )
+            biosample = (
+                '<BioSample access="public" accession="{0}"><Ids>'
+                '<Id db="BioSample" is_primary="1">{0}</Id>'
+                '<Id db="SRA">SRS{1:07d}</Id></Ids>'
+                "<Attributes>{2}</Attributes></BioSample>".format(acc, i, attributes)
+            )
+            f.write(
+                '<DocumentSummary uid="{}"><Title>Sample {}</Title>'
+                "<SampleData>{}</SampleData></DocumentSummary>\n".format(
+                    i, i, escape(biosample)
+                )
+            )
+        f.write("</DocumentSummarySet></eSummaryResult>\n")
+
+
+def parse_xpath(path):
+    """The per-attribute XPath approach this parser replaces."""
+    names = ["BioSample", "SRA"] + ATTRIBUTES
+    tree = ET.parse(path)
+    rows = []
+    for doc in tree.iter("DocumentSummary"):
+        record = ET.fromstring(doc.find("SampleData").text)
+        data = {}
+        for name in ("SRA", "BioSample"):
+            e = record.find('Ids/Id/[@db="{}"]'.format(name))
+            if e is not None:
+                data[name] = e.text
+        for name in names:
+            e = record.find('Attributes/Attribute/[@harmonized_name="{}"]'.format(name))
+            if e is not None:
+                data[name] = e.text
+        rows.append(data)
+    return len(rows)
+
+
+def parse_single_pass(path):
+    return BioSampleParser().parse(path)
+
+
+def measure(f, path):
+    start = time.perf_counter()
+    count = f(path)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    f(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+@click.command()
+@click.option("--records", "-n", default=100000, help="Number of synthetic records")
+@click.option("--path", type=click.Path(), help="Reuse or keep the docsum file here")
+def main(records, path):
+    tmp = None
+    if path is None:
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, "docsum.xml")
+    if not os.path.isfile(path):
+        write_docsum(path, records)
+    size = os.path.getsize(path) / 1024 ** 2
+    click.echo("{}: {:.1f} MiB".format(path, size))
+    for name, f in [("xpath", parse_xpath), ("iterparse", parse_single_pass)]:
+        count, elapsed, peak = measure(f, path)
+        click.echo(
+            "{:>10}: {:>8} records {:>8.2f} s {:>10.0f} records/s "
+            "{:>8.1f} MiB peak".format(
+                name, count, elapsed, count / elapsed, peak / 1024 ** 2
+            )
+        )
+    if tmp is not None:
+        os.remove(path)
+        os.rmdir(tmp)
+
+
+if __name__ == "__main__":
+    main()
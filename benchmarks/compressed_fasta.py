@@ -0,0 +1,93 @@
+"""Compare reading plain, gzip and bgzip FASTAs.
+
+Writes one synthetic genome in each format to --path (put it on the network
+storage you want to measure) and reports the bytes on disk and the time to
+read every contig with `fasta.open_fasta`, with 1 to --threads inflate threads
+for bgzip. Drop the page cache between runs for cold-cache numbers.
+
+--bandwidth models storage that is slower than decompression: the estimated
+time of a format is the larger of its read time at that bandwidth and its
+measured decode time, since reading and inflating overlap.
+
+    python benchmarks/compressed_fasta.py --path /mnt/nfs/tmp --bandwidth 100
+"""
+
+import os
+import sys
+import gzip
+import time
+import shutil
+import tempfile
+
+import click
+from Bio import bgzf
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import SyntheticSpecies  # noqa: E402
+
+from genbankqc.fasta import open_fasta  # noqa: E402
+
+
+def write_formats(path, genome_size, contigs):
+    synthetic = SyntheticSpecies(genome_size=genome_size, contigs=contigs)
+    plain = os.path.join(path, "genome.fasta")
+    synthetic.write_fasta(plain, synthetic.genome())
+    with open(plain, "rb") as f:
+        data = f.read()
+    paths = {"plain": plain}
+    paths["gzip"] = os.path.join(path, "genome.fasta.gz")
+    with gzip.open(paths["gzip"], "wb", compresslevel=6) as f:
+        f.write(data)
+    paths["bgzip"] = os.path.join(path, "genome.bgzip.fasta.gz")
+    with bgzf.BgzfWriter(paths["bgzip"], "wb") as f:
+        f.write(data)
+    return paths
+
+
+def read_time(path, threads, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with open_fasta(path, threads=threads) as f:
+            for _ in iter(lambda: f.read(1 << 20), ""):
+                pass
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+@click.command()
+@click.option("--path", type=click.Path(file_okay=False), help="Directory to test")
+@click.option("--genome-size", "-s", default=5000000, help="Bases in the genome")
+@click.option("--contigs", "-c", default=100, help="Contigs in the genome")
+@click.option("--threads", "-t", default=4, help="Maximum inflate threads")
+@click.option("--repeat", "-r", default=3, help="Best of this many reads")
+@click.option(
+    "--bandwidth", "-b", type=float, multiple=True, help="Storage bandwidth in MB/s"
+)
+def main(path, genome_size, contigs, threads, repeat, bandwidth):
+    tmp = tempfile.mkdtemp(dir=path)
+    try:
+        paths = write_formats(tmp, genome_size, contigs)
+        header = "{:<10} {:>7} {:>10} {:>8} {:>10}".format(
+            "format", "threads", "size (MB)", "time (s)", "MB/s (raw)"
+        )
+        header += "".join(" {:>10}".format("@{:g}MB/s".format(i)) for i in bandwidth)
+        click.echo(header)
+        raw = os.path.getsize(paths["plain"]) / 1e6
+        runs = [("plain", 1), ("gzip", 1)]
+        runs += [("bgzip", i) for i in sorted({1, 2, threads}) if i <= threads]
+        for name, n in runs:
+            size = os.path.getsize(paths[name]) / 1e6
+            elapsed = read_time(paths[name], n, repeat)
+            row = "{:<10} {:>7} {:>10.1f} {:>8.3f} {:>10.0f}".format(
+                name, n, size, elapsed, raw / elapsed
+            )
+            for mbps in bandwidth:
+                row += " {:>10.3f}".format(max(size / mbps, elapsed))
+            click.echo(row)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
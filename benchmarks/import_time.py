@@ -0,0 +1,51 @@
+"""Benchmark CLI startup and report the slowest imports.
+
+    python benchmarks/import_time.py /path/to/genbank
+"""
+import sys
+import time
+import subprocess
+
+import click
+
+COMMANDS = [["--help"], ["info"], ["genome", "--help"], ["species", "--help"]]
+
+
+def wall_time(cmd, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def slowest_imports(module, top):
+    """Parse `python -X importtime` output into (cumulative seconds, module)."""
+    cmd = [sys.executable, "-X", "importtime", "-c", "import {}".format(module)]
+    stderr = subprocess.run(cmd, stderr=subprocess.PIPE, check=True).stderr
+    imports = []
+    for line in stderr.decode().splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        imports.append((int(cumulative) / 1e6, name.rstrip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+@click.command()
+@click.argument("path", type=click.Path(exists=True, file_okay=False))
+@click.option("--repeat", "-r", default=5, help="Best of this many runs")
+@click.option("--top", default=15, help="Number of slowest imports to show")
+def main(path, repeat, top):
+    baseline = wall_time([sys.executable, "-c", "pass"], repeat)
+    click.echo("{:<24} {:>8.3f} s".format("python -c pass", baseline))
+    for command in COMMANDS:
+        args = command + [path] if command == ["info"] else command
+        elapsed = wall_time([sys.executable, "-m", "genbankqc"] + args, repeat)
+        click.echo("{:<24} {:>8.3f} s".format("genbankqc " + " ".join(command), elapsed))
+    click.echo("\nSlowest imports for genbankqc.__main__ (cumulative):")
+    for seconds, name in slowest_imports("genbankqc.__main__", top):
+        click.echo("{:>8.3f} s {}".format(seconds, name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Time every stage of the QC pipeline on synthetic data.
+
+Each run appends one JSON record to the output file with the parameters, the
+commit and the wall time, CPU time and memory of every stage, so that runs can
+be compared across commits:
+
+    python benchmarks/pipeline.py run --genomes 200 -o bench.jsonl
+    python benchmarks/pipeline.py compare bench.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import SyntheticSpecies, write_mirror  # noqa: E402
+
+from genbankqc.profiling import peak_rss_mb, reset_peak_rss  # noqa: E402
+
+SPECIES_STAGES = [
+    "mash_sketch",
+    "mash_paste",
+    "mash_dist",
+    "get_stats",
+    "filter",
+    "get_tree",
+    "color_tree",
+    "link_genomes",
+]
+
+
+def git_commit():
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout
+        return output.decode().strip() or None
+    except OSError:
+        return None
+
+
+def max_rss_children_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+def measure(f):
+    """Run `f` and return its wall time, CPU time (including child processes such
+    as mash and pool workers), peak Python heap and high-water RSS marks.
+
+    The RSS mark of this process is reset first so that it's the peak of `f`
+    alone, or None where it can't be reset. The mark of child processes can't
+    be reset, so it's only given if a child run by `f` raised it."""
+    times = os.times()
+    reset = reset_peak_rss()
+    children = max_rss_children_mb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    error = None
+    try:
+        f()
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    end = os.times()
+    end_children = max_rss_children_mb()
+    return {
+        "wall": wall,
+        "cpu": (end.user + end.system) - (times.user + times.system),
+        "cpu_children": (end.children_user + end.children_system)
+        - (times.children_user + times.children_system),
+        "python_peak_mb": peak / 1024**2,
+        "max_rss_mb": peak_rss_mb() if reset else None,
+        "max_rss_children_mb": end_children if end_children > children else None,
+        "error": error,
+    }
+
+
+def bench_species(path):
+    from genbankqc import Species
+
+    species = Species(path)
+    results = {"init": measure(lambda: Species(path))}
+    for stage in SPECIES_STAGES:
+        results[stage] = measure(getattr(species, stage))
+        status = results[stage]["error"] or "{:.2f} s".format(results[stage]["wall"])
+        click.echo("{:>14}: {}".format(stage, status), err=True)
+    return results
+
+
+def bench_genbank(root):
+    from genbankqc import Genbank
+    from genbankqc.metadata import AssemblySummary
+
+    genbank = Genbank(root)
+    summary = AssemblySummary(genbank.paths.metadata, update=False)
+    return {
+        "info": measure(genbank.info),
+        "prune": measure(lambda: genbank.prune(summary)),
+    }
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option("--genomes", "-n", default=50, help="Genomes per species")
+@click.option("--genome-size", "-s", default=500000, help="Bases per genome")
+@click.option("--contigs", "-c", default=20, help="Contigs per genome")
+@click.option("--n-content", default=0.0001, help="Fraction of N bases")
+@click.option("--outliers", default=0.1, help="Fraction of outlier genomes")
+@click.option("--species", default=3, help="Species in the synthetic mirror")
+@click.option("--output", "-o", default="benchmarks.jsonl", help="Append results here")
+@click.option("--keep", type=click.Path(), help="Keep synthetic data in this directory")
+def run(genomes, genome_size, contigs, n_content, outliers, species, output, keep):
+    """Generate synthetic data and benchmark every pipeline stage."""
+    params = dict(
+        genomes=genomes,
+        genome_size=genome_size,
+        contigs=contigs,
+        n_content=n_content,
+        outliers=outliers,
+    )
+    tmp = keep or tempfile.mkdtemp()
+    species_path = os.path.join(tmp, "species", "Synthetic_species")
+    click.echo("Generating {} genomes in {}".format(genomes, species_path), err=True)
+    SyntheticSpecies(**params).write(species_path)
+    mirror = os.path.join(tmp, "mirror")
+    write_mirror(mirror, species=species, **params)
+    record = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "params": dict(params, species=species),
+        "species": bench_species(species_path),
+        "genbank": bench_genbank(mirror),
+    }
+    with open(output, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    click.echo("Appended results to {}".format(output), err=True)
+    if keep is None:
+        shutil.rmtree(tmp)
+
+
+@cli.command()
+@click.argument("output", type=click.Path(exists=True, dir_okay=False))
+@click.option("--metric", default="wall", help="Metric to compare")
+def compare(output, metric):
+    """Compare the last two runs in OUTPUT stage by stage."""
+    with open(output) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if len(records) < 2:
+        raise click.ClickException("Need at least two runs to compare")
+    before, after = records[-2:]
+    click.echo(
+        "{:>22} {:>10} {:>10} {:>8}".format(
+            metric, before["commit"], after["commit"], "ratio"
+        )
+    )
+    for group in ["species", "genbank"]:
+        for stage, result in after[group].items():
+            old = before[group].get(stage, {}).get(metric)
+            new = result.get(metric)
+            if old is None or new is None:
+                continue
+            ratio = new / old if old else float("nan")
+            click.echo(
+                "{:>22} {:>10.3f} {:>10.3f} {:>8.2f}".format(
+                    "{}.{}".format(group, stage), old, new, ratio
+                )
+            )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,125 @@
+"""Generate synthetic species directories and GenBank mirrors for benchmarks.
+
+Genomes of a species are mutated copies of one random reference. A fraction of
+them are outliers with a different reference (distance), many more contigs or a
+truncated/duplicated assembly (size), so that every filter has work to do.
+"""
+
+import os
+import random
+
+import attr
+import numpy as np
+import pandas as pd
+
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+OUTLIER_KINDS = ["distance", "contigs", "assembly_size"]
+
+
+@attr.s
+class SyntheticSpecies(object):
+    """Parameters of a synthetic species.
+
+    :param genomes: Number of genomes
+    :param genome_size: Approximate assembly size in bases
+    :param contigs: Number of contigs per (non-outlier) genome
+    :param n_content: Fraction of bases replaced by N
+    :param outliers: Fraction of genomes that are outliers
+    :param mutation_rate: Fraction of bases that differ from the reference
+    """
+
+    genomes = attr.ib(default=50)
+    genome_size = attr.ib(default=500000)
+    contigs = attr.ib(default=20)
+    n_content = attr.ib(default=0.0001)
+    outliers = attr.ib(default=0.1)
+    mutation_rate = attr.ib(default=0.01)
+    seed = attr.ib(default=0)
+
+    def __attrs_post_init__(self):
+        self.rng = np.random.RandomState(self.seed)
+        self.reference = self.random_sequence(self.genome_size)
+
+    def random_sequence(self, size):
+        return BASES[self.rng.randint(0, 4, size)]
+
+    def mutate(self, seq, rate):
+        seq = seq.copy()
+        sites = self.rng.random_sample(len(seq)) < rate
+        seq[sites] = BASES[self.rng.randint(0, 4, sites.sum())]
+        return seq
+
+    def genome(self, kind=None):
+        """Return a list of contig sequences (bytes) for one genome."""
+        contigs = self.contigs
+        seq = self.mutate(self.reference, self.mutation_rate)
+        if kind == "distance":
+            seq = self.mutate(self.reference, 0.25)
+        elif kind == "contigs":
+            contigs = self.contigs * 20
+        elif kind == "assembly_size":
+            seq = np.concatenate([seq, seq[: len(seq) // 2]])
+        unknowns = self.rng.random_sample(len(seq)) < self.n_content
+        seq[unknowns] = ord("N")
+        breaks = np.sort(self.rng.choice(np.arange(1, len(seq)), contigs - 1, False))
+        return [i.tobytes() for i in np.split(seq, breaks)]
+
+    def write_fasta(self, path, contigs):
+        with open(path, "wb") as f:
+            for i, contig in enumerate(contigs):
+                f.write(b">contig_%d\n" % i)
+                for start in range(0, len(contig), 80):
+                    f.write(contig[start : start + 80] + b"\n")
+
+    def write(self, path, name="Synthetic_species", first_accession=0):
+        """Write all genomes into the species directory `path`.
+
+        :returns: List of assembly accessions
+        """
+        os.makedirs(path, exist_ok=True)
+        n_outliers = int(round(self.genomes * self.outliers))
+        kinds = [OUTLIER_KINDS[i % 3] for i in range(n_outliers)]
+        kinds += [None] * (self.genomes - n_outliers)
+        random.Random(self.seed).shuffle(kinds)
+        accessions = []
+        for i, kind in enumerate(kinds):
+            accession = "GCA_{:09d}.1".format(first_accession + i)
+            fasta = "{}_{}_{}.fasta".format(accession, name, i)
+            self.write_fasta(os.path.join(path, fasta), self.genome(kind))
+            accessions.append(accession)
+        return accessions
+
+
+def write_mirror(root, species=3, old_versions=0.1, **kwargs):
+    """Write a synthetic GenBank mirror with `species` species directories and a
+    matching metadata/assembly_summary.txt.
+
+    A fraction `old_versions` of genomes also get a superseded version (.1) next to
+    their latest version (.2), for `Genbank.prune` to remove.
+    """
+    rows = []
+    for i in range(species):
+        name = "Synthetic_species{}".format(i)
+        path = os.path.join(root, name)
+        synthetic = SyntheticSpecies(seed=i, **kwargs)
+        accessions = synthetic.write(path, name, first_accession=i * 10**6)
+        for j, accession in enumerate(accessions):
+            if j < len(accessions) * old_versions:
+                latest = accession.replace(".1", ".2")
+                fasta = "{}_{}_{}.fasta".format(latest, name, j)
+                synthetic.write_fasta(os.path.join(path, fasta), synthetic.genome())
+                accession = latest
+            rows.append(
+                {
+                    "# assembly_accession": accession,
+                    "biosample": "SAMN{:08d}".format(len(rows)),
+                    "species_taxid": i,
+                    "organism_name": name.replace("_", " "),
+                    "version_status": "latest",
+                }
+            )
+    metadata = os.path.join(root, "metadata")
+    os.makedirs(metadata, exist_ok=True)
+    summary = pd.DataFrame(rows).set_index("# assembly_accession")
+    summary.to_csv(os.path.join(metadata, "assembly_summary.txt"), sep="\t")
+    return summary
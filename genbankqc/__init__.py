@@ -1,16 +1,41 @@
 import os
+import sys
+import importlib
+from types import ModuleType
 
-from . import config
-from .metadata import Metadata
-from .metadata import BioSample
-from .metadata import AssemblySummary
-from .species import Species
-from .genbank import Genbank
-from .genome import Genome
+# Public classes and the submodule that defines them. Submodules pull in pandas,
+# ete3, Biopython and pathos, so they are only imported when first accessed.
+_classes = {
+    "Genome": "genome",
+    "Species": "species",
+    "Genbank": "genbank",
+    "BioSample": "metadata",
+    "AssemblySummary": "metadata",
+    "Metadata": "metadata",
+}
 
 __all__ = ["Genome", "Species", "Genbank", "BioSample", "AssemblySummary", "Metadata"]
 
 
+class _LazyModule(ModuleType):
+    def __getattr__(self, name):
+        try:
+            module = _classes[name]
+        except KeyError:
+            raise AttributeError(
+                "module '{}' has no attribute '{}'".format(self.__name__, name)
+            )
+        value = getattr(importlib.import_module("." + module, self.__name__), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(_classes))
+
+
+sys.modules[__name__].__class__ = _LazyModule
+
+
 # Suppress error output with:
 # wget -P ~/path/to/env/genbankqc/lib/fonts/ https://github.com/openwebos/qt/tree/master/lib/fonts
 os.environ["QT_QPA_PLATFORM"] = "offscreen"
@@ -1,11 +1,19 @@
 import os
-import re
 import click
 import logbook
+from pathlib import Path
 
+# Only import lightweight modules here so that --help and info start quickly.
+# Commands import what they need from genbankqc themselves.
 from genbankqc import Genbank
-from genbankqc import Genome
-from genbankqc import Species
+
+
+def read_assembly_summary(metadata_dir):
+    """Read assembly_summary.txt from `metadata_dir` if it exists."""
+    from genbankqc.metadata import AssemblySummary
+
+    if (Path(metadata_dir) / "assembly_summary.txt").is_file():
+        return AssemblySummary(metadata_dir, update=False).df
 
 
 class CLIGroup(click.Group):
@@ -22,7 +30,14 @@ class CLIGroup(click.Group):
 @click.group(invoke_without_command=True, no_args_is_help=True, cls=CLIGroup)
 @click.pass_context
 @click.argument("path", type=click.Path(), required=False)
-def cli(ctx, path):
+@click.option(
+    "--profile",
+    type=float,
+    help="Dump cProfile stats for QC stages slower than this many seconds",
+)
+@click.option("--memory", type=float, default=4.0, help="Memory budget in GiB")
+@click.option("--hours", type=float, help="Time budget in hours for MASH distances")
+def cli(ctx, path, profile, memory, hours):
     """Assess the integrity of your genomes through automated analysis of
     species-based statistics and metadata.
     """
@@ -33,14 +48,22 @@ def cli(ctx, path):
         )
         handler.push_application()
         genbank = Genbank(path)
-        genbank.qc()
+        genbank.qc(profile=profile, memory=memory, hours=hours)
 
 
 @cli.command()
 @click.argument("path", type=click.Path())
 @click.argument("email")
 @click.option("--update/--no-update", " /-U", default=True, help="Update metadata")
-def metadata(path, email, update):
+@click.option(
+    "--ttl", type=int, default=30, help="Days until cached metadata records expire"
+)
+@click.option(
+    "--api-key",
+    envvar="NCBI_API_KEY",
+    help="NCBI API key, allows 10 instead of 3 requests per second",
+)
+def metadata(path, email, update, ttl, api_key):
     """Download assembly_summary.txt and BioSample metadata."""
     logbook.set_datetime_format("local")
     handler = logbook.TimedRotatingFileHandler(
@@ -48,8 +71,9 @@ def metadata(path, email, update):
     )
     handler.push_application()
     genbank = Genbank(path)
-    metadata = genbank.metadata(email=email, update=update)
+    metadata = genbank.metadata(email=email, update=update, ttl=ttl, api_key=api_key)
     genbank.species_metadata(metadata)
+    click.echo(metadata.cache.report())
 
 
 @cli.command()
@@ -84,23 +108,111 @@ def metadata(path, email, update):
 )
 @click.option("--all", type=float, help="Acceptable deviations for all metrics")
 @click.option("--metadata", is_flag=True, help="Get metadata for genome at PATH")
-def species(path, unknowns, contigs, assembly_size, distance, all, metadata):
+@click.option(
+    "--profile",
+    type=float,
+    help="Dump cProfile stats for QC stages slower than this many seconds",
+)
+@click.option("--memory", type=float, default=4.0, help="Memory budget in GiB")
+@click.option("--hours", type=float, help="Time budget in hours for MASH distances")
+@click.option(
+    "--tree-rebuild",
+    type=float,
+    default=0.1,
+    help="Fraction of added or removed genomes above which the tree is rebuilt "
+    "instead of updated, 0 to always rebuild",
+)
+def species(
+    path,
+    unknowns,
+    contigs,
+    assembly_size,
+    distance,
+    all,
+    metadata,
+    profile,
+    memory,
+    hours,
+    tree_rebuild,
+):
     """Run commands on a single species"""
+    from genbankqc import events
+    from genbankqc.species import Species
+
     kwargs = {
         "max_unknowns": unknowns,
         "contigs": contigs,
         "assembly_size": assembly_size,
         "mash": distance,
+        "profile": profile,
+        "memory": memory,
+        "hours": hours,
+        "tree_rebuild": tree_rebuild,
     }
     logbook.set_datetime_format("local")
     handler = logbook.TimedRotatingFileHandler(
         os.path.join(path, ".logs", "qc.log"), backup_count=10
     )
     handler.push_application()
+    events.EventHandler(os.path.join(path, ".logs")).push_application()
+    metadata_dir = Path(path).absolute().parent / "metadata"
+    if metadata:
+        kwargs["assembly_summary"] = read_assembly_summary(metadata_dir)
+    if metadata_dir.is_dir():
+        kwargs["results"] = metadata_dir / "qc_results.db"
     species = Species(path, **kwargs)
     species.qc()
     if metadata:
-        species.metadata()
+        species.get_metadata()
+
+
+@cli.command("filter")
+@click.argument("path", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "--unknowns",
+    "-n",
+    type=int,
+    default=200,
+    help="Maximum number of unknown bases (not A, T, C, G)",
+)
+@click.option(
+    "--contigs",
+    "-c",
+    type=float,
+    default=3.0,
+    help="Acceptable deviations from median number of contigs",
+)
+@click.option(
+    "--assembly_size",
+    "-s",
+    type=float,
+    default=3.0,
+    help="Acceptable deviations from median assembly size",
+)
+@click.option(
+    "--distance",
+    "-d",
+    type=float,
+    default=3.0,
+    help="Acceptable deviations from median MASH distances",
+)
+@click.option("--species", multiple=True, help="Only filter this species directory")
+def filter_(path, unknowns, contigs, assembly_size, distance, species):
+    """Filter every species of the GenBank mirror at PATH from existing stats."""
+    logbook.set_datetime_format("local")
+    handler = logbook.TimedRotatingFileHandler(
+        os.path.join(path, ".logs", "qc.log"), backup_count=10
+    )
+    handler.push_application()
+    genbank = Genbank(path)
+    filtered = genbank.filter(
+        only=set(species) or None,
+        max_unknowns=unknowns,
+        contigs=contigs,
+        assembly_size=assembly_size,
+        mash=distance,
+    )
+    click.echo("Filtered {} species".format(len(filtered)))
 
 
 @cli.command()
@@ -108,10 +220,64 @@ def species(path, unknowns, contigs, assembly_size, distance, all, metadata):
 @click.option("--metadata", is_flag=True, help="Get metadata for genome at PATH")
 def genome(path, metadata):
     """ Get information about a single genome."""
+    from genbankqc.genome import Genome
 
-    genome = Genome(path)
     if metadata:
-        click.echo(genome.metadata)
+        summary = read_assembly_summary(Path(path).absolute().parents[1] / "metadata")
+        genome = Genome(path, summary)
+        genome.get_metadata()
+        click.echo(dict(genome.metadata))
+    else:
+        genome = Genome(path)
+
+
+@cli.command()
+@click.argument("path", type=click.Path())
+@click.option(
+    "--species",
+    "-s",
+    multiple=True,
+    help="Only fetch this species directory, e.g. Buchnera_aphidicola",
+)
+@click.option("--workers", "-w", default=8, help="Number of concurrent downloads")
+@click.option(
+    "--update/--no-update",
+    " /-U",
+    default=True,
+    help="Refresh assembly_summary.txt first",
+)
+@click.option("--qc", is_flag=True, help="Run QC for each species once it's fetched")
+@click.option(
+    "--taxonomy",
+    is_flag=True,
+    help="Name species directories after the NCBI taxonomy of their taxid",
+)
+@click.option("--memory", type=float, default=4.0, help="Memory budget in GiB")
+@click.option("--hours", type=float, help="Time budget in hours for MASH distances")
+def fetch(path, species, workers, update, qc, taxonomy, memory, hours):
+    """Download the latest genomes into species directories under PATH."""
+    from genbankqc.metadata import AssemblySummary
+
+    logbook.set_datetime_format("local")
+    handler = logbook.TimedRotatingFileHandler(
+        os.path.join(path, ".logs", "fetch.log"), backup_count=10
+    )
+    handler.push_application()
+    genbank = Genbank(path)
+    taxonomy = genbank.taxonomy() if taxonomy else None
+    assembly_summary = AssemblySummary(
+        genbank.paths.metadata, update=update, taxonomy=taxonomy
+    )
+    directories = genbank.fetch(
+        assembly_summary,
+        species=set(species) or None,
+        workers=workers,
+        qc=qc,
+        memory=memory,
+        hours=hours,
+        taxonomy=taxonomy,
+    )
+    click.echo("Fetched {} species".format(len(directories)))
 
 
 @cli.command()
@@ -125,42 +291,86 @@ def info(path):
 
 
 @cli.command()
-@click.pass_obj
-@click.argument("path", type=click.Path(exists=True, dir_okay=False))
-def log_stats(ctx, path):
+@click.argument("path", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "--query",
+    "-q",
+    type=click.Path(exists=True),
+    multiple=True,
+    help="Genome, sketch or species directory to find the nearest species of",
+)
+@click.option("--flag", is_flag=True, help="Write mislabeled genomes to metadata/")
+@click.option("--representatives", "-r", default=3, help="Genomes indexed per species")
+def index(path, query, flag, representatives):
+    """Update the nearest species index of the GenBank mirror at PATH."""
+    from genbankqc.index import SketchIndex
+
+    sketch_index = SketchIndex(path, representatives=representatives)
+    changes = sketch_index.update()
+    click.echo(", ".join(f"{len(v)} {k}" for k, v in changes.items()))
+    for item in query:
+        if os.path.isdir(item):
+            click.echo(sketch_index.query_species(item).to_string())
+        else:
+            for species, score in sketch_index.query(item):
+                click.echo(f"{score:>8.3f} {species}")
+    if flag:
+        mislabeled = sketch_index.mislabeled()
+        mislabeled.to_csv(os.path.join(path, "metadata", "mislabeled.csv"))
+        click.echo(f"{len(mislabeled)} genomes are closer to another species")
+
+
+@cli.command()
+@click.argument("path", type=click.Path(exists=True, file_okay=False))
+@click.argument("genomes", nargs=-1)
+@click.option("--label", "-l", help="Only show results of this QC label")
+@click.option("--species", "-s", help="Show results of every genome of a species")
+@click.option(
+    "--rebuild", is_flag=True, help="Import results from the QC files of every species"
+)
+def results(path, genomes, label, species, rebuild):
+    """Query the QC results of the GenBank mirror at PATH.
+
+    Shows the results of GENOMES, given by accession or name, or the number of
+    genomes that passed and failed on each criterion across all species.
     """
-    Summarize basic stats for a given log file.
+    from genbankqc.results import ResultsDB
+
+    genbank = Genbank(path)
+    db = ResultsDB(genbank.paths.metadata / "qc_results.db")
+    if rebuild:
+        imported = sum(db.import_species(i) for i in genbank.species_directories)
+        click.echo(f"Imported {imported} species results")
+    rows = [row for genome in genomes for row in db.lookup(genome, label)]
+    if species:
+        rows += db.species(species, label)
+    columns = ["genome", "species", "label", "status", "criterion"]
+    for row in rows:
+        click.echo("\t".join(str(row[i] or "") for i in columns))
+    if species:
+        for row in db.thresholds(species, label):
+            click.echo(
+                "{label}\t{criterion}\tallowed {allowed}\ttolerance {tolerance}\t"
+                "filtered {filtered}".format(**row)
+            )
+    if not genomes and not species:
+        click.echo(db.report(label))
+    db.close()
+
+
+@cli.command()
+@click.argument("path", type=click.Path(exists=True, file_okay=False))
+@click.option("--top", default=10, help="Number of slowest species to show")
+def log_stats(path, top):
+    """Summarize the event logs of a GenBank mirror or species at PATH.
+
+    Reads current and rotated logs of PATH and all of its species directories.
     """
-    log_file = os.path.join(ctx.genbank.path, ".logs", path)
-    not_enough_genomes = [0, "Not enough genomes"]
-    completed_metadata_command = [0, "Completed metadata command"]
-    already_complete = [0, "Already complete"]
-    tree_already_complete = [0, "Tree already complete"]
-    generated_stats = [0, "Generated stats"]
-    qc_completed = [0, "qc command completed"]
-    stats = [
-        log_file,
-        not_enough_genomes,
-        completed_metadata_command,
-        already_complete,
-        tree_already_complete,
-        generated_stats,
-        qc_completed,
-    ]
-    with open(log_file) as f:
-        for line in f:
-            if re.search(not_enough_genomes[1], line):
-                not_enough_genomes[0] += 1
-            elif re.search(completed_metadata_command[1], line):
-                completed_metadata_command[0] += 1
-            elif re.search(already_complete[1], line):
-                already_complete[0] += 1
-            elif re.search(tree_already_complete[1], line):
-                tree_already_complete[0] += 1
-            elif re.search(generated_stats[1], line):
-                generated_stats[0] += 1
-            elif re.search(qc_completed[1], line):
-                qc_completed[0] += 1
-    for i in stats:
-        click.echo(i[1])
-        click.echo(i[0])
+    from genbankqc import events
+
+    summary = events.Summary.from_files(events.event_files(path))
+    click.echo(summary.report(top))
+
+
+if __name__ == "__main__":
+    cli()
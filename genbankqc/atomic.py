@@ -0,0 +1,51 @@
+"""Crash safe file writes."""
+import os
+import tempfile
+import contextlib
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode="w", **kwargs):
+    """Open a temporary file next to `path` for writing and rename it to `path`
+    once the block exits without an exception. Readers either see the old file
+    or the complete new one, never a truncated file.
+
+    :param path: Final path of the file
+    :param mode: "w" or "wb"
+    """
+    path = os.fspath(path)
+    dir_, name = os.path.split(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".{}.".format(name), suffix=".tmp", dir=dir_)
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """Yield a temporary path next to `path` and rename it to `path` once the
+    block exits without an exception, for writers that take a path instead of
+    a file object. The temporary path keeps the extension of `path` for writers
+    that pick the format by extension.
+
+    :param path: Final path of the file
+    """
+    path = os.fspath(path)
+    dir_, name = os.path.split(os.path.abspath(path))
+    suffix = ".tmp" + os.path.splitext(name)[1]
+    fd, tmp = tempfile.mkstemp(prefix=".{}.".format(name), suffix=suffix, dir=dir_)
+    os.close(fd)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
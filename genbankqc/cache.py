@@ -0,0 +1,388 @@
+"""Persistent caches of parsed metadata records and per-genome artifacts."""
+import os
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+from collections import Counter
+
+import attr
+from logbook import Logger
+
+DAY = 24 * 60 * 60
+
+# SQLite's default limit on host parameters in a single statement is 999
+_MAX_VARIABLES = 900
+
+
+@attr.s
+class MetadataCache(object):
+    """SQLite key-value store of parsed metadata records.
+
+    Every table maps an accession to a JSON encoded record along with the time it
+    was fetched and when it expires. Expired records are treated as missing so
+    that only they are refreshed. Use it as a context manager to close the
+    connection, or `open_metadata_cache` to share one per process.
+
+    :param path: Path to the SQLite file
+    :param ttl: Default time to live in seconds for new records
+    """
+
+    path = attr.ib(converter=Path)
+    ttl = attr.ib(default=30 * DAY)
+    tables = ("biosample", "sra")
+    log = Logger("MetadataCache")
+
+    def __attrs_post_init__(self):
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(self.path.as_posix(), check_same_thread=False)
+        with self.db:
+            for table in self.tables:
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS {} ("
+                    "accession TEXT PRIMARY KEY, "
+                    "record TEXT NOT NULL, "
+                    "fetched_at REAL NOT NULL, "
+                    "expires_at REAL NOT NULL)".format(table)
+                )
+        self.hits = Counter()
+        self.misses = Counter()
+        self.expired = Counter()
+
+    def __contains__(self, key):
+        table, accession = key
+        return bool(self.get_many(table, [accession], count=False))
+
+    def get_many(self, table, accessions, now=None, count=True):
+        """Return a dict of accession -> record for unexpired `accessions`."""
+        assert table in self.tables
+        now = time.time() if now is None else now
+        accessions = list(dict.fromkeys(accessions))
+        found = {}
+        expired = 0
+        query = "SELECT accession, record, expires_at FROM {} WHERE accession IN ({})"
+        with self._lock:
+            for start in range(0, len(accessions), _MAX_VARIABLES):
+                chunk = accessions[start : start + _MAX_VARIABLES]
+                rows = self.db.execute(
+                    query.format(table, ",".join("?" * len(chunk))), chunk
+                )
+                for accession, record, expires_at in rows:
+                    if expires_at < now:
+                        expired += 1
+                        continue
+                    found[accession] = json.loads(record)
+        if count:
+            self.hits[table] += len(found)
+            self.misses[table] += len(accessions) - len(found)
+            self.expired[table] += expired
+        return found
+
+    def put_many(self, table, records, ttl=None, now=None):
+        """Store `records`, a dict of accession -> JSON serializable record."""
+        assert table in self.tables
+        now = time.time() if now is None else now
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        rows = (
+            (accession, json.dumps(record), now, expires_at)
+            for accession, record in records.items()
+        )
+        with self._lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)".format(table), rows
+            )
+
+    def purge(self, now=None):
+        """Delete expired records from every table."""
+        now = time.time() if now is None else now
+        with self._lock, self.db:
+            for table in self.tables:
+                self.db.execute(
+                    "DELETE FROM {} WHERE expires_at < ?".format(table), (now,)
+                )
+
+    def close(self):
+        self.db.close()
+        key = (os.getpid(), str(self.path))
+        if _open_metadata_caches.get(key) is self:
+            del _open_metadata_caches[key]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def stats(self):
+        return {
+            table: {
+                "hits": self.hits[table],
+                "misses": self.misses[table],
+                "expired": self.expired[table],
+            }
+            for table in self.tables
+        }
+
+    def report(self):
+        """Log and return cache hit/miss statistics for this run."""
+        lines = []
+        for table, stats in self.stats.items():
+            lookups = stats["hits"] + stats["misses"]
+            rate = stats["hits"] / lookups if lookups else 0
+            lines.append(
+                "{} cache: {} hits, {} misses ({} expired), {:.1%} hit rate".format(
+                    table, stats["hits"], stats["misses"], stats["expired"], rate
+                )
+            )
+        report = "\n".join(lines)
+        for line in lines:
+            self.log.info(line)
+        return report
+
+
+@attr.s
+class ArtifactCache(object):
+    """Content addressed store of genome sketches and stats shared by every
+    species of a GenBank mirror.
+
+    Artifacts are keyed by the SHA-1 of the FASTA file, so a genome that is
+    moved to another species or re-versioned with the same sequence is only
+    sketched once. Sketches are hard linked into species directories. The
+    least recently used artifacts are evicted when the cache exceeds `max_size`.
+
+    Sketches are made from a link named after the digest, so mash records the
+    digest as the sketch name. `distance.BlockedDistance` names rows by genome.
+
+    :param root: Cache directory, usually .cache in the GenBank mirror
+    :param max_size: Maximum size of all artifacts in bytes
+    """
+
+    root = attr.ib(converter=Path)
+    max_size = attr.ib(default=50 * 1024 ** 3)
+    kinds = ("sketch", "stats")
+    log = Logger("ArtifactCache")
+
+    def __attrs_post_init__(self):
+        (self.root / "sketches").mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect((self.root / "artifacts.db").as_posix(), timeout=60)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, "
+                "size INTEGER NOT NULL, "
+                "mtime INTEGER NOT NULL, "
+                "digest TEXT NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                "digest TEXT NOT NULL, "
+                "kind TEXT NOT NULL, "
+                "value TEXT, "
+                "size INTEGER NOT NULL, "
+                "used_at REAL NOT NULL, "
+                "PRIMARY KEY (digest, kind))"
+            )
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def digest(self, path):
+        """SHA-1 of the file at `path`, remembered until its size or mtime change."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.db.execute(
+            "SELECT digest FROM files WHERE path = ? AND size = ? AND mtime = ?",
+            (path, stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        if row is not None:
+            return row[0]
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(chunk)
+        digest = sha1.hexdigest()
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, digest),
+            )
+        return digest
+
+    def sketch_path(self, digest):
+        return self.root / "sketches" / digest[:2] / "{}.msh".format(digest)
+
+    def _get(self, digest, kind):
+        row = self.db.execute(
+            "SELECT value FROM artifacts WHERE digest = ? AND kind = ?", (digest, kind)
+        ).fetchone()
+        if row is None or (kind == "sketch" and not self.sketch_path(digest).exists()):
+            self.misses[kind] += 1
+            return None
+        self.hits[kind] += 1
+        with self.db:
+            self.db.execute(
+                "UPDATE artifacts SET used_at = ? WHERE digest = ? AND kind = ?",
+                (time.time(), digest, kind),
+            )
+        return row
+
+    def _put(self, digest, kind, value, size):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)",
+                (digest, kind, value, size, time.time()),
+            )
+
+    def sketch(self, path, dst):
+        """Hard link the sketch of the FASTA at `path` to `dst`, running mash
+        sketch first if the cache doesn't have it.
+
+        :returns: "hit", "miss", or "failed" if mash didn't write a sketch
+        """
+        statuses, failures = self.sketch_many({path: dst})
+        if path in failures:
+            self.log.error(f"Failed to sketch {path}: {failures[path]}")
+        return statuses[path]
+
+    def sketch_many(self, outputs, sketcher=None):
+        """Link cached sketches of the FASTAs in the dict `outputs` to their
+        sketch files and sketch the others with `sketcher`, adding them to the
+        cache. Identical FASTAs are only sketched once.
+
+        :param sketcher: A `sketch.Sketcher`, by default one with a mash process
+        per CPU
+        :returns: Dicts of the status of each FASTA, like `sketch`, and of error
+        messages of the failed ones
+        """
+        from genbankqc.fasta import split_name
+        from genbankqc.sketch import Sketcher
+
+        statuses, failures, pending = {}, {}, {}
+        for path, dst in outputs.items():
+            digest = self.digest(path)
+            if digest in pending:
+                pending[digest].append(path)
+            elif self._get(digest, "sketch") is None:
+                pending[digest] = [path]
+            else:
+                statuses[path] = "hit"
+                self.link(self.sketch_path(digest), dst)
+        if not pending:
+            return statuses, failures
+        with tempfile.TemporaryDirectory(dir=self.root.as_posix()) as tmp:
+            # Sketch through links named by digest, so that a shared sketch
+            # doesn't carry the name of one genome
+            links = {}
+            for digest, paths in pending.items():
+                ext = split_name(os.path.basename(paths[0]))[1] or ""
+                link = os.path.join(tmp, digest + ext)
+                os.symlink(os.path.abspath(paths[0]), link)
+                links[link] = digest
+            outs = {link: link + ".msh" for link in links}
+            errors = (sketcher or Sketcher()).sketch_each(outs)
+            for link, digest in links.items():
+                if link in errors:
+                    for path in pending[digest]:
+                        statuses[path] = "failed"
+                        failures[path] = errors[link]
+                    continue
+                sketch = self.sketch_path(digest)
+                sketch.parent.mkdir(exist_ok=True)
+                os.replace(outs[link], sketch.as_posix())
+                self._put(digest, "sketch", None, sketch.stat().st_size)
+                for path in pending[digest]:
+                    statuses[path] = "miss"
+                    self.link(sketch, outputs[path])
+        return statuses, failures
+
+    def get_stats(self, path):
+        """Cached stats of the FASTA at `path` as a dict, or None."""
+        row = self._get(self.digest(path), "stats")
+        if row is not None:
+            return json.loads(row[0])
+
+    def put_stats(self, path, stats):
+        value = json.dumps(stats)
+        self._put(self.digest(path), "stats", value, len(value))
+
+    @staticmethod
+    def link(src, dst):
+        """Hard link `src` to `dst`, or copy it across file systems."""
+        try:
+            os.link(str(src), str(dst))
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(str(src), str(dst))
+
+    def evict(self):
+        """Delete the least recently used artifacts beyond `max_size`."""
+        total = self.db.execute("SELECT SUM(size) FROM artifacts").fetchone()[0] or 0
+        if total <= self.max_size:
+            return 0
+        rows = self.db.execute(
+            "SELECT digest, kind, size FROM artifacts ORDER BY used_at"
+        ).fetchall()
+        evicted = []
+        for digest, kind, size in rows:
+            if total <= self.max_size:
+                break
+            if kind == "sketch":
+                try:
+                    self.sketch_path(digest).unlink()
+                except FileNotFoundError:
+                    pass
+            evicted.append((digest, kind))
+            total -= size
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM artifacts WHERE digest = ? AND kind = ?", evicted
+            )
+        self.log.info(f"Evicted {len(evicted)} artifacts")
+        return len(evicted)
+
+    def close(self):
+        self.db.close()
+
+    def report(self):
+        """Log and return hit rates of lookups made by this process."""
+        lines = []
+        for kind in self.kinds:
+            hits, misses = self.hits[kind], self.misses[kind]
+            rate = hits / (hits + misses) if hits + misses else 0
+            lines.append(
+                "{} cache: {} hits, {} misses, {:.1%} hit rate".format(
+                    kind, hits, misses, rate
+                )
+            )
+        for line in lines:
+            self.log.info(line)
+        return "\n".join(lines)
+
+
+_open_caches = {}
+_open_metadata_caches = {}
+
+
+def open_artifact_cache(root):
+    """Return one `ArtifactCache` for `root` per process, or None if `root` is
+    None. Pool workers use this instead of sharing the parent's connection."""
+    if root is None:
+        return None
+    key = (os.getpid(), str(root))
+    if key not in _open_caches:
+        _open_caches[key] = ArtifactCache(root)
+    return _open_caches[key]
+
+
+def open_metadata_cache(path):
+    """Return one `MetadataCache` at `path` per process, so that every client of
+    a GenBank mirror shares its connection. It stays open until it's closed."""
+    key = (os.getpid(), str(path))
+    if key not in _open_metadata_caches:
+        _open_metadata_caches[key] = MetadataCache(path)
+    return _open_metadata_caches[key]
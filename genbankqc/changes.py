@@ -0,0 +1,216 @@
+"""Changes between consecutive assembly summaries.
+
+Every refresh of assembly_summary.txt that downloads a new summary appends the
+`ChangeSet` between the previous and the new summary to a `ChangeLog`. Steps
+like pruning, QC and metadata ask the log for the changes they haven't seen yet
+to find the species directories those changes affect, by the accessions of the
+genomes in them.
+"""
+import json
+import time
+from pathlib import Path
+
+import attr
+
+from genbankqc.atomic import atomic_write
+
+ADDED = "added"
+REPLACED = "replaced"
+SUPPRESSED = "suppressed"
+
+
+def species_directory(organism_name):
+    """Name of the species directory of `organism_name`, e.g. Buchnera_aphidicola."""
+    return "_".join(str(organism_name).split()[:2])
+
+
+def species_directories(summary, taxonomy=None):
+    """Species directory names of every assembly in `summary`.
+
+    :param taxonomy: A `taxonomy.Taxonomy` to name directories after the species
+    of their species_taxid. Assemblies without one are named after their
+    organism name.
+    """
+    import pandas as pd
+
+    directories = summary.organism_name.map(species_directory)
+    directories = directories.to_numpy(dtype=object, copy=True)
+    if taxonomy is not None:
+        by_taxid = taxonomy.species_directories(summary.species_taxid.values)
+        known = pd.notnull(by_taxid)
+        directories[known] = by_taxid[known]
+    return directories
+
+
+def _latest(summary, taxonomy=None):
+    """Latest assemblies of `summary` indexed by accession without version."""
+    import pandas as pd
+
+    if "version_status" in summary.columns:
+        summary = summary[summary.version_status == "latest"]
+    accessions = summary.index.to_series()
+    latest = pd.DataFrame(
+        {
+            "accession": accessions.values,
+            "species_taxid": summary.species_taxid.values,
+            "species": species_directories(summary, taxonomy),
+        },
+        index=accessions.str.rsplit(".", n=1).str[0].values,
+    )
+    return latest[~latest.index.duplicated(keep="last")]
+
+
+def diff(old, new, taxonomy=None):
+    """`ChangeSet` between the `old` and `new` assembly summary DataFrames.
+
+    Assemblies are added if their accession is new, replaced if the latest
+    version changed and suppressed if they are no longer in the latest
+    assemblies of `new`.
+
+    :param taxonomy: See `species_directories`
+    """
+    old, new = _latest(old, taxonomy), _latest(new, taxonomy)
+    added = new.index.difference(old.index)
+    suppressed = old.index.difference(new.index)
+    common = old.index.intersection(new.index)
+    changed = old.accession[common].values != new.accession[common].values
+    replaced = common[changed]
+    records = []
+    for change, rows, previous in [
+        (ADDED, new.loc[added], None),
+        (REPLACED, new.loc[replaced], old.accession[replaced].values),
+        (SUPPRESSED, old.loc[suppressed], None),
+    ]:
+        for i, (accession, taxid, species) in enumerate(rows.itertuples(index=False)):
+            records.append(
+                {
+                    "change": change,
+                    "accession": accession,
+                    "previous": None if previous is None else previous[i],
+                    "species_taxid": int(taxid),
+                    "species": species,
+                }
+            )
+    return ChangeSet(records)
+
+
+@attr.s
+class ChangeSet(object):
+    """Added, replaced and suppressed assemblies.
+
+    :param records: Dicts with the `change`, `accession`, `previous` accession
+    of replaced assemblies, `species_taxid` and `species` directory name
+    """
+
+    records = attr.ib(default=attr.Factory(list))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __add__(self, other):
+        return ChangeSet(self.records + other.records)
+
+    def accessions(self, change):
+        """Accessions with `change`, e.g. `ADDED`."""
+        return [i["accession"] for i in self.records if i["change"] == change]
+
+    @property
+    def stale(self):
+        """Accessions whose files are outdated: the previous versions of replaced
+        assemblies and suppressed assemblies."""
+        stale = set(self.accessions(SUPPRESSED))
+        stale.update(i["previous"] for i in self.records if i["change"] == REPLACED)
+        return stale
+
+    @property
+    def species(self):
+        """Names of species directories with any change."""
+        return {i["species"] for i in self.records}
+
+    def by_species(self):
+        """Dict of species directory name -> change -> list of accessions."""
+        by_species = {}
+        for record in self.records:
+            changes = by_species.setdefault(record["species"], {})
+            changes.setdefault(record["change"], []).append(record["accession"])
+        return by_species
+
+    def by_taxid(self):
+        """Dict of species taxid -> change -> list of accessions."""
+        by_taxid = {}
+        for record in self.records:
+            changes = by_taxid.setdefault(record["species_taxid"], {})
+            changes.setdefault(record["change"], []).append(record["accession"])
+        return by_taxid
+
+    def summary(self):
+        return "{} added, {} replaced, {} suppressed in {} species".format(
+            len(self.accessions(ADDED)),
+            len(self.accessions(REPLACED)),
+            len(self.accessions(SUPPRESSED)),
+            len(self.species),
+        )
+
+
+@attr.s
+class ChangeLog(object):
+    """JSON lines log of the change sets of every refresh.
+
+    Each consumer, e.g. "prune" or "qc", has a mark of the entries it has
+    processed, kept in a JSON file next to the log.
+
+    :param path: Path to the log, usually metadata/assembly_changes.jsonl
+    """
+
+    path = attr.ib(converter=Path)
+
+    def __attrs_post_init__(self):
+        self.marks_path = self.path.with_suffix(".marks.json")
+
+    def entries(self):
+        if not self.path.is_file():
+            return []
+        with self.path.open() as f:
+            return [json.loads(line) for line in f if line.endswith("\n")]
+
+    def append(self, changes):
+        """Append `changes`, or None if a summary was downloaded without a
+        previous one to compare it to, which means everything changed."""
+        entry = {
+            "time": time.time(),
+            "records": None if changes is None else changes.records,
+        }
+        with self.path.open("a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def marks(self):
+        if not self.marks_path.is_file():
+            return {}
+        with self.marks_path.open() as f:
+            return json.load(f)
+
+    def pending(self, consumer):
+        """Merged changes that `consumer` hasn't processed yet.
+
+        :returns: (changes, mark). `changes` is a `ChangeSet`, or None if
+        `consumer` has to process everything because it never consumed the log or
+        a summary was downloaded without a previous one since. Pass `mark` to
+        `consume` once the changes are processed.
+        """
+        entries = self.entries()
+        start = self.marks().get(consumer)
+        if start is None:
+            return None, len(entries)
+        changes = ChangeSet()
+        for entry in entries[start:]:
+            if entry["records"] is None:
+                return None, len(entries)
+            changes += ChangeSet(entry["records"])
+        return changes, len(entries)
+
+    def consume(self, consumer, mark):
+        """Mark the entries up to `mark` as processed by `consumer`."""
+        marks = self.marks()
+        marks[consumer] = mark
+        with atomic_write(self.marks_path) as f:
+            json.dump(marks, f)
@@ -0,0 +1,76 @@
+"""A journal of completed QC stages.
+
+Stage outputs are written with `atomic.atomic_write`, so a killed run leaves
+either the old file or the new one but never a truncated one. `Journal`
+records every completed stage with a fingerprint of its inputs, which lets
+`Species.qc` resume from the first stage that didn't complete with the same
+inputs.
+"""
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+
+import attr
+
+
+def fingerprint(*inputs):
+    """SHA-1 of `inputs`. Paths of existing files count with their size and
+    mtime, anything else by its string value."""
+    sha1 = hashlib.sha1()
+    for item in inputs:
+        if isinstance(item, (str, Path)) and os.path.isfile(str(item)):
+            stat = os.stat(str(item))
+            item = "{} {} {}".format(item, stat.st_size, stat.st_mtime_ns)
+        sha1.update("{}\n".format(item).encode())
+    return sha1.hexdigest()
+
+
+@attr.s
+class Journal(object):
+    """Append-only JSON lines journal of completed stages.
+
+    :param path: Path to the journal, e.g. qc/journal.jsonl in a species
+    """
+
+    path = attr.ib(converter=Path)
+
+    def records(self):
+        """Latest record of every stage."""
+        records = {}
+        if not self.path.is_file():
+            return records
+        with self.path.open() as f:
+            for line in f:
+                # A crash may leave the last line incomplete
+                if not line.endswith("\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record["stage"]] = record
+        return records
+
+    def done(self, stage, fingerprint):
+        """Whether `stage` completed with inputs matching `fingerprint` and its
+        outputs still exist."""
+        record = self.records().get(stage)
+        return (
+            record is not None
+            and record["fingerprint"] == fingerprint
+            and all(os.path.exists(i) for i in record["outputs"])
+        )
+
+    def record(self, stage, fingerprint, outputs=()):
+        record = {
+            "stage": stage,
+            "fingerprint": fingerprint,
+            "outputs": [str(i) for i in outputs],
+            "time": time.time(),
+        }
+        with self.path.open("a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
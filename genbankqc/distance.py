@@ -0,0 +1,400 @@
+"""All-vs-all MASH distances in blocks with bounded memory.
+
+Genomes are split into blocks small enough that every worker can hold one
+block-by-block tile in the memory budget. Only block pairs of the upper
+triangle are computed, each with one `mash dist` call, and written to both
+triangles of a float32 matrix on disk. Finished pairs are journaled, so an
+interrupted run resumes with the remaining pairs.
+"""
+
+import io
+import os
+import json
+import math
+import shutil
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import attr
+import numpy as np
+from logbook import Logger
+
+from genbankqc.sketch import paste, write_list
+
+# Bytes per cell of a tile while mash output is parsed, with some headroom
+TILE_BYTES_PER_CELL = 32
+# Bytes per cell of dmx.csv when the whole matrix is written as text
+CSV_BYTES_PER_CELL = 48
+
+
+def row_means(matrix, memory):
+    """Mean of every row of `matrix`, summed over row chunks that fit in
+    `memory` so that a memory mapped matrix is never loaded at once."""
+    n, columns = matrix.shape
+    rows = max(1, int(memory // max(columns * 8, 1)))
+    sums = np.zeros(n)
+    for start in range(0, n, rows):
+        sums[start : start + rows] = matrix[start : start + rows].sum(
+            axis=1, dtype=np.float64
+        )
+    return sums / max(columns, 1)
+
+
+def workers_for(cpus=None):
+    """Number of mash dist processes run at once."""
+    return max(1, min(4, cpus or os.cpu_count() or 1))
+
+
+def block_size(n, memory, workers):
+    """Largest block of genomes whose tiles fit in `memory` with `workers`."""
+    cells = memory / (workers * TILE_BYTES_PER_CELL)
+    return max(1, min(n, int(math.sqrt(cells))))
+
+
+@attr.s
+class BlockedDistance(object):
+    """Distances between all sketches in `sketches`.
+
+    :param sketches: Paths to one mash sketch per genome
+    :param names: Genome names in the same order as `sketches`
+    :param path: Working directory for the matrix, block sketches and journal
+    :param memory: Memory budget in bytes
+    :param workers: Number of mash dist processes run at once
+    """
+
+    sketches = attr.ib(converter=lambda x: [str(i) for i in x])
+    names = attr.ib(converter=list)
+    path = attr.ib(converter=Path)
+    memory = attr.ib(default=4 * 1024 ** 3)
+    workers = attr.ib(default=None)
+    log = Logger("BlockedDistance")
+
+    def __attrs_post_init__(self):
+        cpus = os.cpu_count() or 1
+        self.workers = self.workers or workers_for(cpus)
+        self.threads = max(1, cpus // self.workers)
+        self.n = len(self.names)
+        self.block_size = block_size(self.n, self.memory, self.workers)
+        self.blocks = [
+            (start, min(start + self.block_size, self.n))
+            for start in range(0, self.n, self.block_size)
+        ]
+        self.matrix_path = self.path / "dmx.npy"
+        self.journal_path = self.path / "done.txt"
+        self.manifest_path = self.path / "manifest.json"
+
+    @property
+    def pairs(self):
+        """Block pairs of the upper triangle, including the diagonal."""
+        n = len(self.blocks)
+        return [(i, j) for i in range(n) for j in range(i, n)]
+
+    @property
+    def manifest(self):
+        return {"names": self.names, "block_size": self.block_size}
+
+    def done(self):
+        """Block pairs finished by previous runs with the same genomes."""
+        if not self.matrix_path.is_file() or not self.journal_path.is_file():
+            return set()
+        try:
+            with self.manifest_path.open() as f:
+                if json.load(f) != self.manifest:
+                    return set()
+        except (OSError, ValueError):
+            return set()
+        done = set()
+        with self.journal_path.open() as f:
+            for line in f:
+                # A crash may leave the last line incomplete
+                fields = line.split()
+                if len(fields) == 2 and line.endswith("\n"):
+                    done.add((int(fields[0]), int(fields[1])))
+        return done
+
+    def prepare(self):
+        """Open the matrix for writing and return it with the finished pairs."""
+        from numpy.lib.format import open_memmap
+
+        done = self.done()
+        if done:
+            self.log.info(f"Resuming with {len(done)} of {len(self.pairs)} blocks done")
+            return open_memmap(str(self.matrix_path), mode="r+"), done
+        if self.path.exists():
+            shutil.rmtree(str(self.path))
+        self.path.mkdir(parents=True)
+        matrix = open_memmap(
+            str(self.matrix_path), mode="w+", dtype=np.float32, shape=(self.n, self.n)
+        )
+        with self.manifest_path.open("w") as f:
+            json.dump(self.manifest, f)
+        self.journal_path.touch()
+        return matrix, done
+
+    def block_list(self, i):
+        path = self.path / "block_{}.txt".format(i)
+        if not path.is_file():
+            start, stop = self.blocks[i]
+            with path.open("w") as f:
+                f.write("\n".join(self.sketches[start:stop]) + "\n")
+        return path
+
+    def reference(self, i):
+        """Paste the sketches of block `i` into one reference sketch."""
+        path = self.path / "block_{}.msh".format(i)
+        if not path.is_file():
+            prefix = self.path / "block_{}.tmp".format(i)
+            cmd = ["mash", "paste", "-l", str(prefix), str(self.block_list(i))]
+            subprocess.run(cmd, stderr=subprocess.DEVNULL, check=True)
+            os.replace(str(prefix) + ".msh", str(path))
+        return path
+
+    def tile(self, i, j):
+        """Distances between block `j` (rows) and block `i` (columns)."""
+        import pandas as pd
+
+        cmd = [
+            "mash",
+            "dist",
+            "-t",
+            "-p",
+            str(self.threads),
+            "-l",
+            str(self.reference(i)),
+            str(self.block_list(j)),
+        ]
+        output = subprocess.run(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+        ).stdout
+        tile = pd.read_csv(io.BytesIO(output), sep="\t", index_col=0).values
+        shape = (
+            self.blocks[j][1] - self.blocks[j][0],
+            self.blocks[i][1] - self.blocks[i][0],
+        )
+        if tile.shape != shape:
+            raise ValueError(f"Expected {shape} distances for blocks {i}, {j}")
+        return tile.astype(np.float32)
+
+    def run(self):
+        """Compute all remaining block pairs and return the matrix."""
+        matrix, done = self.prepare()
+        todo = [pair for pair in self.pairs if pair not in done]
+        # Paste reference blocks first so that workers don't paste the same one
+        for i in sorted({i for i, _ in todo}):
+            self.reference(i)
+        with ThreadPoolExecutor(self.workers) as executor:
+            futures = {executor.submit(self.tile, i, j): (i, j) for i, j in todo}
+            for future in as_completed(futures):
+                i, j = futures[future]
+                tile = future.result()
+                (a, b), (c, d) = self.blocks[i], self.blocks[j]
+                matrix[c:d, a:b] = tile
+                matrix[a:b, c:d] = tile.T
+                matrix.flush()
+                with self.journal_path.open("a") as f:
+                    f.write("{} {}\n".format(i, j))
+        self.log.info(f"Computed {len(todo)} of {len(self.pairs)} blocks")
+        return matrix
+
+    def row_means(self, matrix):
+        """Mean distance of every genome, see `row_means`."""
+        return row_means(matrix, self.memory)
+
+    def fits_csv(self):
+        """Whether the whole matrix can be loaded as text within the budget."""
+        return self.n * self.n * CSV_BYTES_PER_CELL <= self.memory
+
+    @classmethod
+    def load(cls, path):
+        """Return (names, read-only matrix) of a complete run in `path`, or None."""
+        path = Path(path)
+        try:
+            with (path / "manifest.json").open() as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        names = manifest["names"]
+        blocks = range(0, len(names), manifest["block_size"])
+        with (path / "done.txt").open() as f:
+            done = sum(1 for line in f if line.strip())
+        if done < len(blocks) * (len(blocks) + 1) // 2:
+            return None
+        return names, np.load(str(path / "dmx.npy"), mmap_mode="r")
+
+
+@attr.s
+class SampledDistance(object):
+    """Distances from every sketch to a random sample of the sketches.
+
+    The mean distance to the sample estimates the mean distance to all
+    genomes with n * `sample` comparisons instead of n * n. Genomes are
+    queried in row blocks that fit in the memory budget and written to a
+    float32 matrix on disk. Finished row blocks are journaled like the block
+    pairs of `BlockedDistance`. The distances between sampled genomes are
+    enough for a tree of the sample.
+
+    :param sample: Number of sampled genomes
+    :param seed: Seed of the sample, so that reruns sample the same genomes
+    """
+
+    sketches = attr.ib(converter=lambda x: [str(i) for i in x])
+    names = attr.ib(converter=list)
+    path = attr.ib(converter=Path)
+    sample = attr.ib(default=1000)
+    memory = attr.ib(default=4 * 1024 ** 3)
+    workers = attr.ib(default=None)
+    seed = attr.ib(default=0)
+    log = Logger("SampledDistance")
+
+    def __attrs_post_init__(self):
+        cpus = os.cpu_count() or 1
+        self.workers = self.workers or workers_for(cpus)
+        self.threads = max(1, cpus // self.workers)
+        self.n = len(self.names)
+        self.sample = min(self.sample, self.n)
+        rng = np.random.RandomState(self.seed)
+        self.sampled = np.sort(rng.choice(self.n, self.sample, replace=False))
+        cells = self.memory / (self.workers * TILE_BYTES_PER_CELL)
+        self.rows = max(1, min(self.n, int(cells // max(self.sample, 1))))
+        self.blocks = [
+            (start, min(start + self.rows, self.n))
+            for start in range(0, self.n, self.rows)
+        ]
+        self.matrix_path = self.path / "sample.npy"
+        self.journal_path = self.path / "done.txt"
+        self.manifest_path = self.path / "manifest.json"
+
+    @property
+    def manifest(self):
+        return {
+            "names": self.names,
+            "sampled": self.sampled.tolist(),
+            "rows": self.rows,
+        }
+
+    def done(self):
+        """Starts of the row blocks finished by previous runs with the same
+        genomes and sample."""
+        if not self.matrix_path.is_file() or not self.journal_path.is_file():
+            return set()
+        try:
+            with self.manifest_path.open() as f:
+                if json.load(f) != self.manifest:
+                    return set()
+        except (OSError, ValueError):
+            return set()
+        with self.journal_path.open() as f:
+            # A crash may leave the last line incomplete
+            return {int(i) for i in f if i.strip() and i.endswith("\n")}
+
+    def prepare(self):
+        """Open the matrix for writing and return it with the finished blocks."""
+        from numpy.lib.format import open_memmap
+
+        done = self.done()
+        if done:
+            self.log.info(
+                f"Resuming with {len(done)} of {len(self.blocks)} blocks done"
+            )
+            return open_memmap(str(self.matrix_path), mode="r+"), done
+        if self.path.exists():
+            shutil.rmtree(str(self.path))
+        self.path.mkdir(parents=True)
+        matrix = open_memmap(
+            str(self.matrix_path),
+            mode="w+",
+            dtype=np.float32,
+            shape=(self.n, self.sample),
+        )
+        with self.manifest_path.open("w") as f:
+            json.dump(self.manifest, f)
+        self.journal_path.touch()
+        return matrix, done
+
+    def reference(self):
+        """Paste the sketches of the sampled genomes into one reference sketch."""
+        path = self.path / "sample.msh"
+        if path.is_file():
+            return path
+        error = paste([self.sketches[i] for i in self.sampled], path)
+        if error is not None:
+            raise RuntimeError(f"mash paste failed: {error}")
+        return path
+
+    def tile(self, reference, start, stop):
+        """Distances between genomes `start` to `stop` (rows) and the sample."""
+        import pandas as pd
+
+        list_ = write_list(
+            self.sketches[start:stop], self.path / "rows_{}.txt".format(start)
+        )
+        cmd = [
+            "mash",
+            "dist",
+            "-t",
+            "-p",
+            str(self.threads),
+            "-l",
+            str(reference),
+            list_,
+        ]
+        output = subprocess.run(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+        ).stdout
+        tile = pd.read_csv(io.BytesIO(output), sep="\t", index_col=0).values
+        if tile.shape != (stop - start, self.sample):
+            raise ValueError(f"Expected {self.sample} distances for rows {start}")
+        return tile.astype(np.float32)
+
+    def run(self):
+        """Compute the remaining distances to the sample and return the matrix."""
+        matrix, done = self.prepare()
+        todo = [block for block in self.blocks if block[0] not in done]
+        reference = self.reference()
+        with ThreadPoolExecutor(self.workers) as executor:
+            futures = {
+                executor.submit(self.tile, reference, start, stop): start
+                for start, stop in todo
+            }
+            for future in as_completed(futures):
+                start = futures[future]
+                tile = future.result()
+                matrix[start : start + len(tile)] = tile
+                matrix.flush()
+                with self.journal_path.open("a") as f:
+                    f.write("{}\n".format(start))
+        self.log.info(
+            f"Computed distances to {self.sample} of {self.n} genomes, "
+            f"{len(todo)} of {len(self.blocks)} blocks"
+        )
+        return matrix
+
+    def row_means(self, matrix):
+        """Estimated mean distance of every genome, see `row_means`."""
+        return row_means(matrix, self.memory)
+
+    @staticmethod
+    def sample_matrix(matrix, sampled):
+        """Distances between the sampled genomes."""
+        return np.asarray(matrix[sampled])
+
+    @classmethod
+    def load(cls, path):
+        """Return (names, sampled rows, read-only matrix) of a complete run in
+        `path`, or None."""
+        path = Path(path)
+        try:
+            with (path / "manifest.json").open() as f:
+                manifest = json.load(f)
+            with (path / "done.txt").open() as f:
+                done = sum(1 for line in f if line.strip())
+        except (OSError, ValueError):
+            return None
+        # Runs without a journal are never complete
+        if "rows" not in manifest:
+            return None
+        if done < len(range(0, len(manifest["names"]), manifest["rows"])):
+            return None
+        matrix = np.load(str(path / "sample.npy"), mmap_mode="r")
+        return manifest["names"], np.array(manifest["sampled"]), matrix
@@ -0,0 +1,217 @@
+"""Single pass parsers for NCBI Entrez document summaries (docsum XML)."""
+import xml.etree.ElementTree as ET
+
+# BioSample attributes we are interested in, identified by their harmonized_name
+ATTRIBUTES = [
+    "geo_loc_name",
+    "collection_date",
+    "strain",
+    "isolation_source",
+    "host",
+    "collected_by",
+    "sample_type",
+    "sample_name",
+    "host_disease",
+    "isolate",
+    "host_health_state",
+    "serovar",
+    "env_biome",
+    "env_feature",
+    "ref_biomaterial",
+    "env_material",
+    "isol_growth_condt",
+    "num_replicons",
+    "sub_species",
+    "host_age",
+    "genotype",
+    "host_sex",
+    "serotype",
+    "host_disease_outcome",
+]
+
+
+def _expand(elem):
+    """Return `elem` with its nested XML as child elements.
+
+    E-utilities returns nested XML such as <SampleData>, <ExpXml> and <Runs> as
+    escaped text, whereas EDirect's `efetch -format docsum` expands it.
+    """
+    if len(elem) or not (elem.text and elem.text.strip()):
+        return elem
+    return ET.fromstring("<{0}>{1}</{0}>".format(elem.tag, elem.text))
+
+
+def _sample_data(doc):
+    """Return the <BioSample> element of a <DocumentSummary>."""
+    sample_data = doc.find("SampleData")
+    if sample_data is None:
+        return doc if doc.tag == "BioSample" else None
+    return _expand(sample_data).find("BioSample")
+
+
+def _iterdocs(source):
+    """Yield each outermost <DocumentSummary> in `source` (a path or file
+    object), clearing it and removing it from its parent afterwards. Its parent
+    is usually <DocumentSummarySet>, which the parser keeps appending to."""
+    context = ET.iterparse(source, events=("start", "end"))
+    parents = []
+    depth = 0
+    for event, elem in context:
+        if event == "start":
+            parents.append(elem)
+            depth += elem.tag == "DocumentSummary"
+            continue
+        parents.pop()
+        if elem.tag != "DocumentSummary":
+            continue
+        depth -= 1
+        if depth:
+            continue
+        yield elem
+        elem.clear()
+        if parents:
+            parents[-1].remove(elem)
+
+
+class BioSampleParser:
+    """Parse BioSample docsums into columns.
+
+    Every <Attribute> of a record is visited once and dispatched by its
+    harmonized_name through a dict lookup into a preallocated row, which is
+    then appended to one list per column.
+    """
+
+    def __init__(self, attributes=ATTRIBUTES, missing=None):
+        self.columns = ["BioSample", "SRA"] + [
+            i for i in attributes if i not in ("BioSample", "SRA")
+        ]
+        self.missing = missing
+        self._ids = {"BioSample": 0, "SRA": 1}
+        self._slots = {name: i for i, name in enumerate(self.columns)}
+        self.data = [[] for _ in self.columns]
+        self.errors = 0
+
+    def __len__(self):
+        return len(self.data[0])
+
+    def parse_biosample(self, biosample):
+        """Parse one <BioSample> element into a row, i.e. a list ordered by
+        `self.columns`."""
+        row = [self.missing] * len(self.columns)
+        ids = biosample.find("Ids")
+        if ids is not None:
+            for id_ in ids:
+                slot = self._ids.get(id_.get("db"))
+                if slot is not None and row[slot] is self.missing:
+                    row[slot] = id_.text
+        if row[0] is self.missing:
+            row[0] = biosample.get("accession", self.missing)
+        attributes = biosample.find("Attributes")
+        if attributes is not None:
+            slots = self._slots
+            for attribute in attributes:
+                slot = slots.get(attribute.get("harmonized_name"))
+                if slot is not None and slot > 1:
+                    row[slot] = attribute.text
+        return row
+
+    def append(self, row):
+        for column, value in zip(self.data, row):
+            column.append(value)
+
+    def parse_document(self, doc):
+        """Parse a <DocumentSummary> (or bare <BioSample>) element and append
+        its row. Return the row or None if the record could not be parsed."""
+        try:
+            biosample = _sample_data(doc)
+        except ET.ParseError:
+            biosample = None
+        if biosample is None:
+            self.errors += 1
+            return None
+        row = self.parse_biosample(biosample)
+        self.append(row)
+        return row
+
+    def parse_string(self, xml):
+        """Parse a complete docsum document held in memory."""
+        root = ET.fromstring(xml)
+        if root.tag in ("DocumentSummary", "BioSample"):
+            return [self.parse_document(root)]
+        return [self.parse_document(doc) for doc in root.iter("DocumentSummary")]
+
+    def iterparse(self, source):
+        """Stream records from `source` (a path or file object).
+
+        Elements are cleared as soon as they have been parsed so that memory
+        use stays flat regardless of the size of the docsum file.
+        """
+        for doc in _iterdocs(source):
+            row = self.parse_document(doc)
+            if row is not None:
+                yield row
+
+    def parse(self, source):
+        """Consume `source` with `iterparse` and return the number of rows."""
+        for _ in self.iterparse(source):
+            pass
+        return len(self)
+
+    def records(self):
+        """Generator of dicts, one per parsed record."""
+        for row in zip(*self.data):
+            yield dict(zip(self.columns, row))
+
+    def to_frame(self):
+        import pandas as pd
+
+        df = pd.DataFrame(dict(zip(self.columns, self.data)), columns=self.columns)
+        return df.set_index("BioSample")
+
+
+class SRARunsParser:
+    """Collect run accessions per BioSample from SRA docsums."""
+
+    def __init__(self):
+        self.runs = {}
+        self.errors = 0
+
+    def __len__(self):
+        return len(self.runs)
+
+    def parse_document(self, doc):
+        """Parse one SRA <DocumentSummary> and merge its runs into `self.runs`.
+        Return a (biosample, runs) tuple or None if the record is malformed."""
+        exp_xml = doc.find("ExpXml")
+        runs = doc.find("Runs")
+        try:
+            biosample = _expand(exp_xml).findtext("Biosample")
+            runs = [] if runs is None else _expand(runs).iter("Run")
+            runs = [run.get("acc") for run in runs if run.get("acc")]
+        except (TypeError, ET.ParseError):
+            biosample = None
+        if not biosample:
+            self.errors += 1
+            return None
+        existing = self.runs.setdefault(biosample, [])
+        existing.extend(run for run in runs if run not in existing)
+        return biosample, runs
+
+    def parse_string(self, xml):
+        root = ET.fromstring(xml)
+        if root.tag == "DocumentSummary":
+            return [self.parse_document(root)]
+        return [self.parse_document(doc) for doc in root.iter("DocumentSummary")]
+
+    def iterparse(self, source):
+        """Stream (biosample, runs) tuples from `source`.
+        See `BioSampleParser.iterparse`."""
+        for doc in _iterdocs(source):
+            record = self.parse_document(doc)
+            if record is not None:
+                yield record
+
+    def parse(self, source):
+        for _ in self.iterparse(source):
+            pass
+        return len(self)
@@ -0,0 +1,213 @@
+"""Batched access to NCBI's E-utilities for BioSample and SRA metadata."""
+import io
+import urllib.parse
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+import attr
+from logbook import Logger
+
+from genbankqc import docsum, ncbi
+
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+
+
+class EntrezError(Exception):
+    """E-utilities returned an error instead of results."""
+
+
+def chunked(items, size):
+    """Split `items` into lists of at most `size` items."""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def fetch_runs(client, sra_ids):
+    """Stream and parse the SRA docsums for `sra_ids`.
+
+    :returns: A `docsum.SRARunsParser` holding runs per BioSample and the number
+    of malformed records in `errors`
+    """
+    parser = docsum.SRARunsParser()
+    for page in client.docsums("sra", " OR ".join(sra_ids)):
+        parser.parse(io.BytesIO(page))
+    return parser
+
+
+@attr.s
+class Client(object):
+    """Minimal E-utilities client that POSTs every request.
+
+    :param session: An `ncbi.Session` to send requests with, by default a new
+    one with `email`, `api_key` and `timeout`. Share one session between
+    clients to share its connections.
+    """
+
+    email = attr.ib(default=None)
+    base_url = attr.ib(default=EUTILS_URL)
+    api_key = attr.ib(default=None)
+    timeout = attr.ib(default=60)
+    page_size = attr.ib(default=10000)
+    session = attr.ib(default=None)
+    log = Logger("Entrez")
+
+    def __attrs_post_init__(self):
+        if self.session is None:
+            self.session = ncbi.Session(
+                api_key=self.api_key, email=self.email, timeout=self.timeout
+            )
+
+    def post(self, util, **params):
+        """POST `params` to `util` (e.g. "esearch") and return the response body."""
+        url = urllib.parse.urljoin(self.base_url, util + ".fcgi")
+        return self.session.post(url, **params)
+
+    def esearch(self, db, term):
+        """Store the results of `term` on the history server.
+
+        :returns: (WebEnv, query_key, count)
+        """
+        xml = self.post("esearch", db=db, term=term, usehistory="y", retmax=0)
+        root = ET.fromstring(xml)
+        error = root.findtext("ERROR")
+        if error:
+            raise EntrezError(error)
+        return (
+            root.findtext("WebEnv"),
+            root.findtext("QueryKey"),
+            int(root.findtext("Count")),
+        )
+
+    def docsums(self, db, term):
+        """Generator of docsum XML pages (bytes) for all records matching `term`."""
+        web_env, query_key, count = self.esearch(db, term)
+        for start in range(0, count, self.page_size):
+            yield self.post(
+                "esummary",
+                db=db,
+                WebEnv=web_env,
+                query_key=query_key,
+                retstart=start,
+                retmax=self.page_size,
+            )
+
+
+@attr.s
+class MetadataClient(object):
+    """Fetch BioSample and SRA metadata for many genomes in a few batched requests.
+
+    Records that are already known, either from earlier calls, a local metadata
+    table loaded with `load` or an unexpired entry in `cache`, are never requested
+    again. Records loaded with `load` don't expire.
+
+    :param cache: An optional `cache.MetadataCache` to read through
+    """
+
+    client = attr.ib(default=attr.Factory(Client))
+    chunk_size = attr.ib(default=500)
+    cache = attr.ib(default=None)
+    workers = attr.ib(default=3)
+    log = Logger("MetadataClient")
+
+    @classmethod
+    def for_mirror(cls, root, **kwargs):
+        """Return a client reading through the metadata cache of the GenBank
+        mirror at `root`, if it has a metadata directory.
+
+        The mirror's metadata.csv isn't loaded, its records would never expire.
+        Clients of the same mirror share one cache connection.
+        """
+        from genbankqc.cache import open_metadata_cache
+
+        metadata_dir = Path(root) / "metadata"
+        if metadata_dir.is_dir():
+            cache = open_metadata_cache(metadata_dir / "cache.sqlite")
+            kwargs.setdefault("cache", cache)
+        return cls(**kwargs)
+
+    def __attrs_post_init__(self):
+        self.records = {}
+        self.runs = {}
+
+    def load(self, path):
+        """Seed known records from a joined metadata.csv written by `Metadata`."""
+        import pandas as pd
+
+        df = pd.read_csv(path, index_col=0, dtype=str)
+        df = df[~df.index.duplicated()]
+        columns = [i for i in df.columns if i in docsum.ATTRIBUTES or i == "SRA"]
+        for biosample, row in df[columns].iterrows():
+            record = {k: v for k, v in row.items() if isinstance(v, str)}
+            record.setdefault("SRA", None)
+            self.records[biosample] = dict(record, BioSample=biosample)
+        if "runs" in df.columns:
+            for biosample, runs in df["runs"].dropna().items():
+                self.runs[biosample] = runs.split(",")
+
+    def biosamples(self, accessions):
+        """Return a dict of BioSample accession -> record for `accessions`."""
+        accessions = set(accessions) - {"missing", None}
+        missing = sorted(accessions - set(self.records))
+        if missing and self.cache is not None:
+            self.records.update(self.cache.get_many("biosample", missing))
+            missing = [i for i in missing if i not in self.records]
+        if missing:
+            parser = docsum.BioSampleParser()
+            for chunk in chunked(missing, self.chunk_size):
+                term = " OR ".join("{}[accn]".format(i) for i in chunk)
+                for page in self.client.docsums("biosample", term):
+                    parser.parse(io.BytesIO(page))
+            if parser.errors:
+                self.log.error(f"{parser.errors} BioSample records without sample data")
+            fetched = {i["BioSample"]: i for i in parser.records()}
+            self.records.update(fetched)
+            if self.cache is not None:
+                self.cache.put_many("biosample", fetched)
+            self.log.info(f"Fetched {len(parser)} of {len(missing)} BioSample records")
+        return {i: self.records[i] for i in accessions if i in self.records}
+
+    def sra_runs(self, sra_ids):
+        """Return a dict of BioSample accession -> list of SRA run accessions.
+
+        :param sra_ids: dict of BioSample accession -> SRA sample accession
+        """
+        missing = [i for i in sra_ids if i not in self.runs]
+        if missing and self.cache is not None:
+            self.runs.update(self.cache.get_many("sra", missing))
+            missing = [i for i in missing if i not in self.runs]
+        query = sorted({sra_ids[i] for i in missing} - {"missing", None})
+        if query:
+            errors = 0
+            chunks = chunked(query, self.chunk_size)
+            with ThreadPoolExecutor(self.workers) as executor:
+                for parser in executor.map(partial(fetch_runs, self.client), chunks):
+                    errors += parser.errors
+                    for biosample, runs in parser.runs.items():
+                        existing = self.runs.setdefault(biosample, [])
+                        existing.extend(i for i in runs if i not in existing)
+            if errors:
+                self.log.error(f"{errors} malformed SRA records")
+        # Remember BioSamples without runs so they aren't requested again
+        fetched = {i: self.runs.setdefault(i, []) for i in missing}
+        if fetched and self.cache is not None:
+            self.cache.put_many("sra", fetched)
+        return {i: self.runs[i] for i in sra_ids}
+
+    def fill(self, genomes):
+        """Fill in `Genome.metadata` for every genome in `genomes`."""
+        genomes = list(genomes)
+        ids = [genome.metadata["biosample_id"] for genome in genomes]
+        records = self.biosamples(ids)
+        runs = self.sra_runs({i: records[i]["SRA"] for i in records})
+        for genome, biosample in zip(genomes, ids):
+            record = dict(records.get(biosample, {}))
+            if not record:
+                genome.log.error(f"No BioSample record for {genome.accession_id}")
+                continue
+            genome.metadata["sra_id"] = record.pop("SRA") or "missing"
+            genome.metadata.update((k, v) for k, v in record.items() if v is not None)
+            genome.metadata["srr_accessions"] = ",".join(runs.get(biosample, []))
+        return genomes
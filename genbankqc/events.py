@@ -0,0 +1,154 @@
+"""Structured events written as JSON lines next to the human readable logs.
+
+An event is a logbook record with an "event" name in its `extra` dict. It goes
+to the normal log handlers like any other record, and `EventHandler` also
+writes it to `.logs/events.jsonl`, which `Summary` aggregates.
+"""
+import json
+import math
+import heapq
+from pathlib import Path
+from collections import Counter, defaultdict
+
+import attr
+import logbook
+
+EVENTS = [
+    "species_started",
+    "species_skipped",
+    "species_complete",
+    "species_failed",
+    "stage",
+    "genome_failed",
+]
+
+
+def emit(logger, event, message, level=logbook.INFO, exc_info=None, **fields):
+    """Log `message` with `logger` and tag it as `event` with `fields`."""
+    fields["event"] = event
+    logger.log(level, message, extra=fields, exc_info=exc_info)
+
+
+def is_event(record, handler):
+    return "event" in record.extra
+
+
+class EventHandler(logbook.TimedRotatingFileHandler):
+    """Write events to `logs_dir`/events.jsonl, rotated daily like qc.log."""
+
+    def __init__(self, logs_dir, backup_count=10, **kwargs):
+        super(EventHandler, self).__init__(
+            str(Path(logs_dir, "events.jsonl")),
+            backup_count=backup_count,
+            filter=is_event,
+            bubble=True,
+            **kwargs
+        )
+
+    def format(self, record):
+        data = {
+            "time": record.time.isoformat(),
+            "level": record.level_name,
+            "channel": record.channel,
+        }
+        data.update(record.extra)
+        return json.dumps(data, default=str)
+
+
+def event_files(path):
+    """Current and rotated event logs of `path` and of its species directories."""
+    path = Path(path)
+    for logs in [path / ".logs"] + sorted(path.glob("*/.logs")):
+        for file_ in sorted(logs.glob("events*.jsonl")):
+            yield file_
+
+
+def percentile(values, q):
+    """Nearest rank percentile of sorted `values`."""
+    rank = max(int(math.ceil(q / 100 * len(values))), 1)
+    return values[rank - 1]
+
+
+@attr.s
+class Summary(object):
+    """Aggregate events in one pass over any number of event logs."""
+
+    counts = attr.ib(default=attr.Factory(Counter))
+    reasons = attr.ib(default=attr.Factory(Counter))
+    stages = attr.ib(default=attr.Factory(lambda: defaultdict(list)))
+    species = attr.ib(default=attr.Factory(dict))
+    malformed = attr.ib(default=0)
+
+    @classmethod
+    def from_files(cls, paths):
+        summary = cls()
+        for path in paths:
+            with open(path) as f:
+                for line in f:
+                    summary.add_line(line)
+        return summary
+
+    def add_line(self, line):
+        try:
+            self.add(json.loads(line))
+        except (ValueError, TypeError, KeyError):
+            self.malformed += 1
+
+    def add(self, event):
+        name = event["event"]
+        self.counts[name] += 1
+        if name == "species_skipped":
+            self.reasons[event.get("reason")] += 1
+        elif name == "stage" and event.get("wall") is not None:
+            self.stages[event["stage"]].append(event["wall"])
+        elif name == "species_complete" and event.get("wall") is not None:
+            # Keep the slowest run of each species
+            previous = self.species.get(event["species"], (0, None))
+            current = (event["wall"], event.get("genomes"))
+            self.species[event["species"]] = max(previous, current, key=lambda i: i[0])
+
+    def percentiles(self, qs=(50, 90, 99)):
+        """Map each stage to its run count, percentiles and maximum wall time."""
+        table = {}
+        for stage, walls in self.stages.items():
+            walls = sorted(walls)
+            row = {"n": len(walls)}
+            for q in qs:
+                row["p{}".format(q)] = percentile(walls, q)
+            row["max"] = walls[-1]
+            table[stage] = row
+        return table
+
+    def slowest(self, n=10):
+        """List of (species, wall time, genomes) for the `n` slowest species."""
+        items = heapq.nlargest(n, self.species.items(), key=lambda i: i[1][0])
+        return [(name, wall, genomes) for name, (wall, genomes) in items]
+
+    def report(self, top=10):
+        lines = ["Events:"]
+        for name in EVENTS:
+            lines.append(f"{self.counts[name]:>8} {name}")
+        for reason, count in sorted(self.reasons.items(), key=str):
+            lines.append(f"{count:>8}   skipped, {reason}")
+        if self.malformed:
+            lines.append(f"{self.malformed:>8} malformed lines")
+        percentiles = self.percentiles()
+        if percentiles:
+            lines.append("")
+            lines.append("Stage wall time (s):")
+            header = ["stage", "n", "p50", "p90", "p99", "max"]
+            lines.append("{:<14}{:>8}{:>10}{:>10}{:>10}{:>10}".format(*header))
+            for stage, row in sorted(percentiles.items()):
+                values = [row[i] for i in header[2:]]
+                lines.append(
+                    "{:<14}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}".format(
+                        stage, row["n"], *values
+                    )
+                )
+        slowest = self.slowest(top)
+        if slowest:
+            lines.append("")
+            lines.append("Slowest species:")
+            for name, wall, genomes in slowest:
+                lines.append(f"{wall:>10.2f} s {genomes!s:>8} genomes  {name}")
+        return "\n".join(lines)
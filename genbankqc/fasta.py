@@ -0,0 +1,133 @@
+"""Open plain, gzip and bgzip compressed FASTA files.
+
+BGZF files (as written by `bgzip`) are a series of independent gzip blocks of
+at most 64 KiB, so they are inflated in parallel threads. zlib releases the GIL
+while it inflates, so this scales with the number of cores.
+"""
+import io
+import os
+import gzip
+import zlib
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+EXTENSIONS = [".fasta", ".fna"]
+COMPRESSED = [".gz"]
+SUFFIXES = [ext + i for ext in EXTENSIONS for i in [""] + COMPRESSED]
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+
+
+def split_name(filename):
+    """Split `filename` into the genome name and its FASTA extension, e.g.
+    ("GCA_000000000.1_Name", ".fna.gz"). The extension is None if `filename`
+    isn't a FASTA."""
+    for suffix in SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[: -len(suffix)], suffix
+    return filename, None
+
+
+def is_fasta(filename):
+    return split_name(filename)[1] is not None
+
+
+def is_bgzf(path):
+    """Check for the gzip FEXTRA flag and the BGZF "BC" subfield."""
+    with open(path, "rb") as f:
+        header = f.read(16)
+    return header[:4] == BGZF_MAGIC and header[12:14] == b"BC"
+
+
+def bgzf_blocks(f):
+    """Generate the compressed data of each block in BGZF file object `f`,
+    including the CRC32 and size trailer."""
+    while True:
+        header = f.read(12)
+        if not header:
+            return
+        if len(header) < 12 or header[:4] != BGZF_MAGIC:
+            raise ValueError("Invalid BGZF block header")
+        (xlen,) = struct.unpack("<H", header[10:12])
+        extra = f.read(xlen)
+        bsize = None
+        i = 0
+        while i + 4 <= len(extra):
+            (slen,) = struct.unpack("<H", extra[i + 2 : i + 4])
+            if extra[i : i + 2] == b"BC":
+                (bsize,) = struct.unpack("<H", extra[i + 4 : i + 6])
+            i += 4 + slen
+        if bsize is None:
+            raise ValueError("BGZF block without block size")
+        block = f.read(bsize + 1 - 12 - xlen)
+        if len(block) < 8:
+            raise ValueError("Truncated BGZF block")
+        yield block
+
+
+def inflate(block):
+    data = zlib.decompress(block[:-8], -15)
+    crc, size = struct.unpack("<II", block[-8:])
+    if size != len(data) or crc != zlib.crc32(data):
+        raise ValueError("BGZF block failed CRC check")
+    return data
+
+
+def bgzf_chunks(f, threads):
+    """Generate the inflated blocks of BGZF file object `f` in order, keeping at
+    most a few blocks per thread in flight."""
+    with ThreadPoolExecutor(threads) as executor:
+        pending = deque()
+        for block in bgzf_blocks(f):
+            pending.append(executor.submit(inflate, block))
+            if len(pending) >= threads * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class BgzfReader(io.RawIOBase):
+    """Read-only binary stream of a BGZF file inflated in `threads` threads."""
+
+    def __init__(self, path, threads=None):
+        self.raw = open(path, "rb")
+        self.chunks = bgzf_chunks(self.raw, threads or default_threads())
+        self.buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer:
+            try:
+                self.buffer = memoryview(next(self.chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.chunks.close()
+            self.raw.close()
+        super(BgzfReader, self).close()
+
+
+def default_threads():
+    return min(4, os.cpu_count() or 1)
+
+
+def open_fasta(path, threads=None):
+    """Open the FASTA at `path` in text mode, decompressing gzip and bgzip files.
+
+    :param threads: Threads for inflating bgzip files. Defaults to at most four.
+    """
+    path = os.fspath(path)
+    if not path.endswith(tuple(COMPRESSED)):
+        return open(path)
+    if is_bgzf(path):
+        reader = io.BufferedReader(BgzfReader(path, threads), 1 << 16)
+        return io.TextIOWrapper(reader)
+    return gzip.open(path, "rt")
@@ -0,0 +1,191 @@
+"""Download latest assembly versions into species directories.
+
+`Fetcher` downloads the genomic FASTA of every latest assembly in an assembly
+summary into <root>/<Genus_species>/, the layout `Genbank.species_directories`
+expects. Downloads run on a bounded thread pool and go to a .part file next to
+their destination. An interrupted download resumes from the .part file with a
+range request. Every file is checked against the md5checksums.txt of its
+assembly before it's renamed into place, so files in species directories are
+always complete. `Fetcher.species` yields every species directory as soon as
+all of its genomes are downloaded, which lets QC run while other species are
+still downloading.
+"""
+import os
+import hashlib
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import attr
+from logbook import Logger
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_fixed
+
+from genbankqc.changes import species_directories
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class ChecksumError(Exception):
+    """A downloaded file doesn't match its MD5 checksum."""
+
+
+def https(url):
+    """NCBI's FTP server serves the same paths over HTTPS."""
+    if url.startswith("ftp://ftp.ncbi.nlm.nih.gov/"):
+        return "https://" + url[len("ftp://") :]
+    return url
+
+
+def md5sum(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+@attr.s
+class Assembly(object):
+    """Genomic FASTA of one assembly in an assembly summary."""
+
+    accession = attr.ib()
+    species = attr.ib()
+    ftp_path = attr.ib(converter=https)
+
+    @property
+    def filename(self):
+        return "{}_genomic.fna.gz".format(self.ftp_path.rstrip("/").rsplit("/", 1)[1])
+
+    @property
+    def url(self):
+        return "{}/{}".format(self.ftp_path.rstrip("/"), self.filename)
+
+    @property
+    def checksums_url(self):
+        return "{}/md5checksums.txt".format(self.ftp_path.rstrip("/"))
+
+
+def assemblies(summary, species=None, taxonomy=None):
+    """Generator of `Assembly` for the latest assemblies of `summary`.
+
+    :param summary: An assembly summary DataFrame indexed by accession
+    :param species: Names of species directories to include, all by default
+    :param taxonomy: See `changes.species_directories`
+    """
+    if "version_status" in summary.columns:
+        summary = summary[summary.version_status == "latest"]
+    summary = summary[summary.ftp_path.notnull() & (summary.ftp_path != "na")]
+    names = species_directories(summary, taxonomy)
+    for accession, name, ftp_path in zip(summary.index, names, summary.ftp_path):
+        if species is None or name in species:
+            yield Assembly(accession, name, ftp_path)
+
+
+@attr.s
+class Fetcher(object):
+    """Download genomes concurrently into the species directories of `root`.
+
+    :param root: Root of the GenBank mirror
+    :param workers: Number of concurrent downloads
+    :param timeout: Seconds to wait for a server to respond
+    """
+
+    root = attr.ib(converter=Path)
+    workers = attr.ib(default=8)
+    timeout = attr.ib(default=60)
+    log = Logger("Fetcher")
+
+    def __attrs_post_init__(self):
+        self.downloaded = 0
+        self.failed = []
+        self.lock = threading.Lock()
+
+    def path(self, assembly):
+        return self.root / assembly.species / assembly.filename
+
+    def checksum(self, assembly):
+        """MD5 checksum of the FASTA of `assembly` from its md5checksums.txt."""
+        with urllib.request.urlopen(
+            assembly.checksums_url, timeout=self.timeout
+        ) as response:
+            for line in response.read().decode().splitlines():
+                md5, _, name = line.strip().partition(" ")
+                if os.path.basename(name.strip()) == assembly.filename:
+                    return md5
+        raise ChecksumError(f"No checksum for {assembly.filename}")
+
+    def _download(self, url, part):
+        """Download `url` to `part`, continuing a partial download."""
+        request = urllib.request.Request(url)
+        offset = part.stat().st_size if part.exists() else 0
+        if offset:
+            request.add_header("Range", "bytes={}-".format(offset))
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            # The partial download is already complete
+            if e.code == 416:
+                return
+            raise
+        with response:
+            # Servers that don't support ranges send the whole file
+            mode = "ab" if getattr(response, "status", None) == 206 else "wb"
+            with open(part, mode) as f:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                    f.write(chunk)
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_fixed(2),
+        retry=retry_if_exception_type((OSError, ChecksumError)),
+        reraise=True,
+    )
+    def fetch(self, assembly):
+        """Download the FASTA of `assembly` unless it's already there.
+
+        :returns: Path to the FASTA
+        """
+        path = self.path(assembly)
+        if path.is_file():
+            return path
+        path.parent.mkdir(exist_ok=True)
+        part = path.with_name(path.name + ".part")
+        expected = self.checksum(assembly)
+        self._download(assembly.url, part)
+        if md5sum(part) != expected:
+            part.unlink()
+            raise ChecksumError(f"Checksum mismatch for {assembly.filename}")
+        os.replace(str(part), str(path))
+        with self.lock:
+            self.downloaded += 1
+        return path
+
+    def species(self, assemblies):
+        """Download `assemblies` and yield the directory of every species once
+        all of its genomes are downloaded or failed."""
+        remaining = {}
+        for assembly in assemblies:
+            remaining.setdefault(assembly.species, []).append(assembly)
+        with ThreadPoolExecutor(self.workers) as executor:
+            futures = {
+                executor.submit(self.fetch, assembly): assembly
+                for species in remaining.values()
+                for assembly in species
+            }
+            left = {name: len(species) for name, species in remaining.items()}
+            for future in as_completed(futures):
+                assembly = futures[future]
+                try:
+                    future.result()
+                except Exception:
+                    self.log.exception(f"Failed to download {assembly.accession}")
+                    self.failed.append(assembly.accession)
+                left[assembly.species] -= 1
+                if not left[assembly.species]:
+                    yield self.root / assembly.species
+
+    def run(self, assemblies):
+        """Download `assemblies` and return the species directories."""
+        return list(self.species(assemblies))
@@ -0,0 +1,227 @@
+"""Filter the genomes of every species of a mirror at once.
+
+`Species.filter` needs a `Species`, which reads the distance matrix, the tree
+and every genome of its directory, only to apply four thresholds to stats.csv.
+`MirrorFilter` instead reads the stats of all species into one table with a
+species column and applies the same criteria to every species at once, with
+medians and mean absolute deviations computed per species by grouped
+operations. The failed reports, summaries and thresholds it writes are the ones
+`Species.filter` writes for the same tolerances.
+"""
+import os
+import pickle
+from pathlib import Path
+
+import attr
+import numpy as np
+import pandas as pd
+from logbook import Logger
+
+from genbankqc.atomic import atomic_write
+
+CRITERIA = ["unknowns", "contigs", "assembly_size", "distance"]
+
+# Species with this many genomes left or fewer aren't filtered on a criterion
+MIN_PASSED = 5
+
+
+def summary(name, allowed, tolerance, filtered):
+    """Text of qc_summary.txt.
+
+    :param filtered: Dict of criteria to the number of genomes they filtered
+    """
+    titles = ["Unknown Bases", "Contigs", "Assembly Size", "MASH"]
+    summary = [name]
+    for title, criteria in zip(titles, CRITERIA):
+        summary += [
+            title,
+            "Allowed: {}".format(allowed[criteria]),
+            "Tolerance: {}".format(tolerance[criteria]),
+            "Filtered: {}".format(filtered[criteria]),
+            "\n",
+        ]
+    return "\n".join(summary)
+
+
+def _median_mad(values, mask, codes, n):
+    """Median of `values` where `mask` in each of `n` groups and the mean
+    absolute deviation from it."""
+    masked = pd.Series(np.where(mask, values, np.nan))
+    median = masked.groupby(codes).median().reindex(range(n)).values
+    deviation = (masked - median[codes]).abs()
+    mad = deviation.groupby(codes).mean().reindex(range(n)).values
+    return median, mad
+
+
+def filter_stats(stats, tolerance):
+    """Apply the criteria of `Species.filter` to the stats of many species.
+
+    :param stats: Stats of every genome with a species column
+    :param tolerance: Dict of criteria to tolerances, like `Species.tolerance`
+    :returns: (criteria, passed, allowed, order). `criteria` is an array of
+    the criterion every genome failed, None if it didn't fail one, `passed` a
+    mask of genomes that passed, `allowed` a DataFrame of the allowed values of
+    every species and criterion, "" for criteria a species isn't filtered on,
+    and `order` sorts genomes by species and failed genomes in the order of
+    `Species.write_failed_report`
+    """
+    codes, species = pd.factorize(stats["species"], sort=True)
+    n = len(species)
+    criteria = np.full(len(stats), None, dtype=object)
+    allowed = pd.DataFrame("", index=species, columns=CRITERIA, dtype=object)
+
+    def active(passed):
+        return np.bincount(codes, weights=passed, minlength=n) > MIN_PASSED
+
+    unknowns = stats["unknowns"].values
+    failed = unknowns > tolerance["unknowns"]
+    criteria[failed] = "unknowns"
+    passed = ~failed
+    allowed["unknowns"] = pd.Series(tolerance["unknowns"], index=species, dtype=object)
+
+    # Only genomes with more than 10 contigs count towards the median and
+    # fail, those with fewer always pass
+    filtered = active(passed)
+    rows = filtered[codes]
+    contigs = stats["contigs"].values.astype(float)
+    eligible = passed & rows & (contigs > 10)
+    median, mad = _median_mad(contigs, eligible, codes, n)
+    dev_ref = mad * tolerance["contigs"]
+    deviation = np.abs(contigs - median[codes])
+    with np.errstate(invalid="ignore"):
+        criteria[eligible & (deviation > dev_ref[codes])] = "contigs"
+        kept = eligible & (deviation <= dev_ref[codes])
+    kept |= passed & rows & (contigs <= 10)
+    passed = np.where(rows, kept, passed)
+    allowed.loc[filtered, "contigs"] = list((median + dev_ref)[filtered])
+    # Species.filter_contigs reorders genomes with few contigs to the end
+    reordered = rows & (contigs <= 10)
+
+    filtered = active(passed)
+    rows = filtered[codes]
+    size = stats["assembly_size"].values.astype(float)
+    median, mad = _median_mad(size, passed & rows, codes, n)
+    dev_ref = mad * tolerance["assembly_size"]
+    deviation = np.abs(size - median[codes])
+    with np.errstate(invalid="ignore"):
+        criteria[passed & rows & (deviation > dev_ref[codes])] = "assembly_size"
+        passed = np.where(rows, passed & (deviation <= dev_ref[codes]), passed)
+    allowed.loc[filtered, "assembly_size"] = [
+        "-".join(str(int(x)) for x in bounds)
+        for bounds in zip((median - dev_ref)[filtered], (median + dev_ref)[filtered])
+    ]
+
+    filtered = active(passed)
+    rows = filtered[codes]
+    distance = stats["distance"].values.astype(float)
+    median, mad = _median_mad(distance, passed & rows, codes, n)
+    upper = median + mad * tolerance["distance"]
+    with np.errstate(invalid="ignore"):
+        criteria[passed & rows & (distance > upper[codes])] = "distance"
+        passed = np.where(rows, passed & (distance <= upper[codes]), passed)
+    allowed.loc[filtered, "distance"] = ["{:.4f}".format(i) for i in upper[filtered]]
+
+    # Order failed genomes like Species.write_failed_report
+    rank = np.array([CRITERIA.index(i) if i else 0 for i in criteria])
+    order = np.lexsort((np.arange(len(stats)), reordered & (rank > 1), rank, codes))
+    return criteria, passed, allowed, order
+
+
+@attr.s
+class MirrorFilter(object):
+    """Filter every species of a GenBank mirror from its stats.csv.
+
+    Tolerances are those of `Species`.
+
+    :param results: Path to a `results.ResultsDB` to record results in
+    """
+
+    max_unknowns = attr.ib(default=200)
+    contigs = attr.ib(default=3.0)
+    assembly_size = attr.ib(default=3.0)
+    mash = attr.ib(default=3.0)
+    results = attr.ib(default=None)
+    log = Logger("MirrorFilter")
+
+    @property
+    def tolerance(self):
+        values = [self.max_unknowns, self.contigs, self.assembly_size, self.mash]
+        return dict(zip(CRITERIA, values))
+
+    @property
+    def label(self):
+        return "-".join(map(str, self.tolerance.values()))
+
+    def load(self, directories):
+        """Stats of every genome of the species `directories` that have them,
+        with a species column of the directory name."""
+        frames = []
+        for dir_ in directories:
+            path = Path(dir_, "qc", "stats.csv")
+            if path.is_file():
+                stats = pd.read_csv(path, index_col=0)
+                frames.append(stats.assign(species=Path(dir_).name))
+        if not frames:
+            return pd.DataFrame(columns=CRITERIA + ["species"])
+        return pd.concat(frames)
+
+    def run(self, directories):
+        """Filter the species `directories` and write the allowed values,
+        failed report and summary of every species to qc/<label>/ like
+        `Species.filter`.
+
+        :returns: Names of the filtered species
+        """
+        stats = self.load(directories)
+        if stats.empty:
+            return []
+        criteria, passed, allowed, order = filter_stats(stats, self.tolerance)
+        roots = {Path(i).name: Path(i) for i in directories}
+        db = None
+        if self.results is not None:
+            from genbankqc.results import ResultsDB
+
+            db = ResultsDB(self.results)
+        species = stats["species"].values[order]
+        bounds = np.flatnonzero(np.r_[True, species[1:] != species[:-1]])
+        try:
+            for start, end in zip(bounds, np.r_[bounds[1:], len(order)]):
+                rows = order[start:end]
+                self.write(
+                    roots[species[start]],
+                    stats.iloc[rows].drop(columns="species"),
+                    criteria[rows],
+                    allowed.loc[species[start]].to_dict(),
+                    db,
+                )
+        finally:
+            if db is not None:
+                db.close()
+        filtered = sorted(set(species))
+        self.log.info(
+            f"Filtered {len(filtered)} species, "
+            f"{int(passed.sum())} of {len(stats)} genomes passed"
+        )
+        return filtered
+
+    def write(self, dir_, stats, criteria, allowed, db=None):
+        """Write the filter results of the species in `dir_`."""
+        results_dir = os.path.join(dir_, "qc", self.label)
+        os.makedirs(results_dir, exist_ok=True)
+        failed = pd.notnull(criteria)
+        report = pd.DataFrame(index=list(stats.index[failed]), columns=["criteria"])
+        report["criteria"] = criteria[failed]
+        filtered = {i: int(np.sum(criteria == i)) for i in CRITERIA}
+        with atomic_write(os.path.join(results_dir, "allowed.p"), "wb") as p:
+            pickle.dump(allowed, p)
+        with atomic_write(os.path.join(results_dir, "qc_summary.txt")) as f:
+            f.write(summary(dir_.name, allowed, self.tolerance, filtered))
+        with atomic_write(os.path.join(results_dir, "failed.csv")) as f:
+            report.to_csv(f)
+        if db is not None:
+            thresholds = {
+                i: (allowed[i], self.tolerance[i], filtered[i]) for i in CRITERIA
+            }
+            db.put_species(
+                dir_.name, self.label, stats, report.criteria.to_dict(), thresholds
+            )
@@ -5,9 +5,9 @@ from collections import defaultdict
 import attr
 import logbook
 
-from genbankqc import config, Species, Metadata, AssemblySummary
+from genbankqc import changes, config, events, fasta, logs
 
-taxdump_url = "ftp://ftp.ncbi.nih.gov/pub/taxonomy/taxdump.tar.gz"
+taxdump_url = "https://ftp.ncbi.nlm.nih.gov/pub/taxonomy/taxdump.tar.gz"
 
 
 @attr.s
@@ -16,11 +16,15 @@ class Genbank(object):
     root = attr.ib(default=Path(), converter=Path)
 
     def __attrs_post_init__(self):
-        self.paths = config.Paths(root=self.root, subdirs=["metadata", ".logs"])
+        self.paths = config.Paths(
+            root=self.root, subdirs=["metadata", ".logs", ".cache"]
+        )
+        self.changelog = changes.ChangeLog(
+            self.paths.metadata / "assembly_changes.jsonl"
+        )
 
     def info(self):
-        patterns = [
-            "*/*.fasta",
+        patterns = ["*/*" + i for i in fasta.SUFFIXES] + [
             "*/*/GCA*.msh",
             "*/*/GCA*.csv",
             "*/*/dmx.csv",
@@ -44,62 +48,284 @@ class Genbank(object):
                 info.append(f"Empty:  {empty:>8}")
         return "\n".join(info)
 
+    @staticmethod
+    def is_species_directory(dir_):
+        """Whether `dir_` is a directory with at least ten FASTAs."""
+        if not dir_.is_dir():
+            return False
+        return sum(fasta.is_fasta(i.name) for i in dir_.iterdir()) >= 10
+
     @property
     def species_directories(self):
         """Generator of `Path` objects for directories under `self.root`.
         Only species with more than ten FASTAs are included."""
         for item in self.root.iterdir():
-            if not item.is_dir():
-                continue
-            dir_ = item.absolute()
-            if len(list(dir_.glob("*fasta"))) < 10:
-                continue
-            yield dir_
+            if self.is_species_directory(item):
+                yield item.absolute()
+
+    def species(self, assembly_summary=None, only=None, first=(), **kwargs):
+        """Generator of Species objects for directories returned by `species_directories`.
+        Additional keyword arguments are passed on to `Species`.
+
+        :param only: Names of the species directories to include, all by default
+        :param first: Names of species directories to yield before the others
+        """
+        from genbankqc.species import Species
+
+        directories = [
+            i for i in self.species_directories if only is None or i.name in only
+        ]
+        directories.sort(key=lambda i: i.name not in first)
+        for dir_ in directories:
+            yield Species(dir_, assembly_summary=assembly_summary, **kwargs)
+
+    def qc(self, profile=None, memory=4.0, hours=None):
+        """Prune old assembly versions and run QC for every species.
 
-    def species(self, assembly_summary=None):
-        """Generator of Species objects for directories returned by `species_directories`."""
-        for dir_ in self.species_directories:
-            yield Species(dir_, assembly_summary=assembly_summary)
+        Species with assembly changes since the last QC run first. Every species
+        directory is still visited, stages that are done are skipped by the
+        stage journal of the species, see `Species.run_stages`.
 
-    def qc(self):
+        :param profile: Dump cProfile stats for QC stages slower than this many seconds
+        :param memory: Memory budget in GiB of every species
+        :param hours: Time budget in hours for MASH distances of every species
+        """
         self.prune()
-        for species in self.species():
-            logbook.set_datetime_format("local")
-            handler = logbook.TimedRotatingFileHandler(
-                Path(species.path, ".logs", "qc.log"), backup_count=10
-            )
-            handler.push_application()
+        changes, mark = self.changelog.pending("qc")
+        first = set()
+        if changes:
+            first = changes.species
+            self.log.info(f"Assembly changes since the last QC: {changes.summary()}")
+        logbook.set_datetime_format("local")
+        failed = 0
+        with events.EventHandler(self.paths.logs).applicationbound():
+            for species in self.species(
+                first=first,
+                profile=profile,
+                cache=self.paths.cache,
+                results=self.paths.metadata / "qc_results.db",
+                memory=memory,
+                hours=hours,
+            ):
+                failed += not self.qc_species(species)
+        # Keep the changes pending so failed species are retried next time
+        if failed:
+            self.log.error(f"QC failed for {failed} species, changes stay pending")
+        else:
+            self.changelog.consume("qc", mark)
+
+    def filter(self, only=None, **tolerances):
+        """Filter every species from its stats.csv at once, without loading the
+        species, see `filtering.MirrorFilter`. Species without stats are skipped.
+
+        :param only: Names of the species directories to filter, all by default
+        :param tolerances: `max_unknowns`, `contigs`, `assembly_size` and `mash`
+        like `Species`
+        :returns: Names of the filtered species
+        """
+        from genbankqc.filtering import MirrorFilter
+
+        directories = [
+            i for i in self.species_directories if only is None or i.name in only
+        ]
+        mirror_filter = MirrorFilter(
+            results=self.paths.metadata / "qc_results.db", **tolerances
+        )
+        return mirror_filter.run(directories)
+
+    def taxonomy(self, update=False):
+        """Load the NCBI taxonomy from metadata/taxdump.tar.gz, downloading it
+        from `taxdump_url` first if it's missing or `update` is set.
+
+        :returns: A `taxonomy.Taxonomy`
+        """
+        from genbankqc.taxonomy import Taxonomy, download
+
+        path = self.paths.metadata / "taxdump.tar.gz"
+        if update or not path.is_file():
+            download(taxdump_url, path)
+            self.log.info(f"Downloaded {taxdump_url}")
+        return Taxonomy.load(path)
+
+    def qc_species(self, species):
+        """Run QC for `species`, logging to its own log and reporting failures
+        as species_failed events. Records of its worker processes are routed to
+        its log too, see `logs.route`.
+
+        :returns: Whether QC succeeded
+        """
+        handler = logbook.TimedRotatingFileHandler(
+            Path(species.path, ".logs", "qc.log"), backup_count=10
+        )
+        with handler.applicationbound(), logs.route(species.name, handler):
             try:
                 species.qc()
             except Exception:
-                self.log.exception(f"qc command failed for {species.name}")
+                events.emit(
+                    self.log,
+                    "species_failed",
+                    f"qc command failed for {species.name}",
+                    level=logbook.ERROR,
+                    species=species.name,
+                    exc_info=True,
+                )
+                return False
+        return True
+
+    def fetch(
+        self,
+        assembly_summary,
+        species=None,
+        workers=8,
+        qc=False,
+        profile=None,
+        memory=4.0,
+        hours=None,
+        taxonomy=None,
+    ):
+        """Download the latest genomes of `assembly_summary` into species
+        directories, see `fetch.Fetcher`.
+
+        :param species: Names of species directories to fetch, all by default
+        :param taxonomy: A `taxonomy.Taxonomy` to name species directories after
+        the species of their taxid instead of the organism name
+        :param qc: Run QC for every species directory as soon as its genomes are
+        downloaded, while other species are still downloading
+        :returns: The species directories
+        """
+        from genbankqc.fetch import Fetcher, assemblies
+        from genbankqc.species import Species
+
+        fetcher = Fetcher(self.root, workers=workers)
+        directories = []
+        logbook.set_datetime_format("local")
+        with events.EventHandler(self.paths.logs).applicationbound():
+            fetched = assemblies(assembly_summary.df, species, taxonomy)
+            for dir_ in fetcher.species(fetched):
+                directories.append(dir_)
+                if qc and self.is_species_directory(dir_):
+                    species_ = Species(
+                        dir_,
+                        profile=profile,
+                        cache=self.paths.cache,
+                        results=self.paths.metadata / "qc_results.db",
+                        memory=memory,
+                        hours=hours,
+                    )
+                    self.qc_species(species_)
+        self.log.info(
+            f"Downloaded {fetcher.downloaded} genomes of {len(directories)} species, "
+            f"{len(fetcher.failed)} failed"
+        )
+        return directories
+
+    def prune(self, assembly_summary=None):
+        """Prune all files that aren't latest assembly versions, including those
+        of suppressed assemblies.
+
+        Only directories with FASTAs of assemblies that were replaced or
+        suppressed since the last prune are searched, or all of them on the first
+        prune.
+
+        :param assembly_summary: An `AssemblySummary`. The latest one is
+        downloaded if it isn't given.
+        """
+        from genbankqc.metadata import AssemblySummary
 
-    def prune(self):
-        """Prune all files that aren't latest assembly versions."""
         p_id = re.compile("GCA_[0-9]*.[0-9]")  # patterns for matching accession IDs
-        p_glob = "GCA_[0-9]*.[0-9]_*[fasta|msh|csv]"
+        p_glob = "GCA_[0-9]*.[0-9]_*"
         d_local = defaultdict(list)  # IDs and associated files
 
+        if assembly_summary is None:
+            assembly_summary = AssemblySummary(self.paths.metadata)
+        changes, mark = self.changelog.pending("prune")
+        if changes is None:
+            paths = self.root.rglob(p_glob)
+        else:
+            # Directories may be named by other tools, find them by accession
+            directories = [i for i in self.root.iterdir() if i.is_dir()]
+            accessions = self.accessions(directories)
+            dirs = {accessions[i] for i in changes.stale if i in accessions}
+            paths = (i for dir_ in sorted(dirs) for i in dir_.rglob(p_glob))
+
         # Update `d_local` with a list containing paths for all matches
-        for path in self.root.rglob(p_glob):
-            id_ = p_id.match(path.name).group()
-            d_local[id_].append(path)
+        for path in paths:
+            if not fasta.is_fasta(path.name) and path.suffix not in [".msh", ".csv"]:
+                continue
+            match = p_id.match(path.name)
+            if match is not None:
+                d_local[match.group()].append(path)
 
         # Remove local files that aren't latest assembly versions
-        assumbly_summary = AssemblySummary(self.paths.metadata)
-        previous_versions = set(d_local.keys()) - set(assumbly_summary.ids)
+        previous_versions = set(d_local.keys()) - set(assembly_summary.latest)
         for i in previous_versions:
             for f in d_local[i]:
                 f.unlink()
                 self.log.info(f"Removed {f}")
+        self.changelog.consume("prune", mark)
 
-    def metadata(self, email, sample=False, update=True):
+    def metadata(self, email, sample=False, update=True, ttl=30, api_key=None):
         """Download and join all metadata and write out .csv for each species"""
+        from genbankqc.metadata import Metadata
+
         metadata_ = Metadata(
-            self.paths.metadata, email=email, sample=sample, update=update
+            self.paths.metadata,
+            email=email,
+            sample=sample,
+            update=update,
+            ttl=ttl,
+            api_key=api_key,
         )
         return metadata_
 
+    def accessions(self, directories=None):
+        """Map the accession ID of every genome to its species directory.
+
+        :param directories: Directories to search, `species_directories` by default
+        """
+        p_id = re.compile("GCA_[0-9]*.[0-9]")
+        accessions = {}
+        if directories is None:
+            directories = self.species_directories
+        for dir_ in directories:
+            for path in dir_.glob("GCA*"):
+                if not fasta.is_fasta(path.name):
+                    continue
+                match = p_id.match(path.name)
+                if match is None:
+                    self.log.warning(f"No accession ID in {path.name}, skipping")
+                    continue
+                accessions[match.group()] = dir_
+        return accessions
+
     def species_metadata(self, metadata):
-        for species in self.species(metadata.assembly_summary):
-            species.select_metadata(metadata)
+        """Write metadata for every species directory without loading species.
+
+        After the first call, only directories with genomes that were added or
+        replaced since the last call are written, and directories whose
+        contents changed after their metadata was written, e.g. by other
+        download tools."""
+        pending, mark = self.changelog.pending("metadata")
+        species = self.accessions()
+        if pending is not None:
+            new = pending.accessions(changes.ADDED) + pending.accessions(
+                changes.REPLACED
+            )
+            dirs = {species[i] for i in new if i in species}
+            dirs.update(i for i in set(species.values()) if self._stale_metadata(i))
+            species = {k: v for k, v in species.items() if v in dirs}
+        written = metadata.partition(species)
+        for dir_ in set(species.values()) - set(written):
+            self.log.error(f"No metadata for {dir_.name}")
+        self.log.info(f"Wrote metadata for {len(written)} species")
+        self.changelog.consume("metadata", mark)
+        return written
+
+    @staticmethod
+    def _stale_metadata(dir_):
+        """Whether `dir_` has no metadata or files were added to or removed
+        from it after its metadata was written."""
+        path = dir_ / "qc" / "{}_metadata.csv".format(dir_.name)
+        if not path.is_file():
+            return True
+        return dir_.stat().st_mtime_ns > path.stat().st_mtime_ns
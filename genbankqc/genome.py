@@ -1,27 +1,27 @@
 import os
 import re
-import subprocess
-import xml.etree.cElementTree as ET
 from collections import defaultdict
+from collections.abc import Sequence
 from xml.etree.ElementTree import ParseError
 
-import pandas as pd
 from logbook import Logger
 
-from Bio import SeqIO
-from tenacity import retry, stop_after_attempt, wait_fixed
+from genbankqc import docsum, entrez, fasta, logs
+from genbankqc.atomic import atomic_write
+from genbankqc.cache import open_artifact_cache
+from genbankqc.sketch import Sketcher
 
 
 class Genome:
     def __init__(self, genome, assembly_summary=None):
         """
-        :param genome: Path to genome
+        :param genome: Path to genome, a FASTA that may be gzip or bgzip compressed
         :returns: Path to genome and name of the genome
         :rtype:
         """
         self.path = os.path.abspath(genome)
         self.species_dir, self.fasta = os.path.split(self.path)
-        self.name = os.path.splitext(self.fasta)[0]
+        self.name = fasta.split_name(self.fasta)[0]
         self.log = Logger(self.name)
         self.qc_dir = os.path.join(self.species_dir, "qc")
         self.stats_file = os.path.join(self.qc_dir, self.name + ".csv")
@@ -36,9 +36,11 @@ class Genome:
             self.accession_id = "missing"
             self.log.exception("Invalid accession ID")
         # Don't do this here
-        if isinstance(self.assembly_summary, pd.DataFrame):
+        # Either an `AssemblySummary` or its DataFrame
+        summary = getattr(assembly_summary, "df", assembly_summary)
+        if hasattr(summary, "loc"):
             try:
-                biosample = assembly_summary.loc[self.accession_id].biosample
+                biosample = summary.loc[self.accession_id].biosample
                 self.metadata["biosample_id"] = biosample
             except (AttributeError, KeyError):
                 self.log.exception("Unable to get biosample ID")
@@ -52,11 +54,14 @@ class Genome:
         Return a list of of Bio.Seq.Seq objects for fasta and calculate
         the total the number of contigs.
         """
+        from Bio import SeqIO
+
         try:
-            self.contigs = [seq.seq for seq in SeqIO.parse(self.path, "fasta")]
+            with fasta.open_fasta(self.path) as f:
+                self.contigs = [seq.seq for seq in SeqIO.parse(f, "fasta")]
             self.count_contigs = len(self.contigs)
-        except UnicodeDecodeError:
-            self.log.exception()
+        except (UnicodeDecodeError, OSError, EOFError, ValueError):
+            self.log.exception("Unable to read FASTA")
 
     def get_assembly_size(self):
         """Calculate the sum of all contig lengths"""
@@ -72,139 +77,241 @@ class Genome:
     def get_distance(self, dmx_mean):
         self.distance = dmx_mean.loc[self.name]
 
-    def sketch(self):
-        cmd = "mash sketch '{}' -o '{}'".format(self.path, self.sketch_file)
+    def sketch(self, cache=None):
+        """Sketch the genome unless its sketch exists.
+
+        :param cache: A `cache.ArtifactCache` to get the sketch from or add it to
+        :returns: The cache status, "hit" or "miss", "exists" or None without cache
+        """
         if os.path.isfile(self.sketch_file):
-            pass
-        else:
-            subprocess.Popen(cmd, shell="True", stderr=subprocess.DEVNULL).wait()
+            return "exists"
+        elif cache is not None:
+            return cache.sketch(self.path, self.sketch_file)
+        error = Sketcher(threads=1).sketch_one(self.path, self.sketch_file)
+        if error is not None:
+            self.log.error(f"Failed to sketch: {error}")
+
+    def get_stats(self, dmx_mean, cache=None):
+        """Get the number of contigs, assembly size, unknown bases and mean MASH
+        distance into `self.stats` and write them to `self.stats_file`.
 
-    def get_stats(self, dmx_mean):
-        if not os.path.isfile(self.stats_file):
+        :param cache: A `cache.ArtifactCache`. Only the distance is computed
+        for genomes with cached stats.
+        :returns: The cache status, like `sketch`
+        """
+        import pandas as pd
+
+        if os.path.isfile(self.stats_file):
+            self.stats = pd.read_csv(self.stats_file, index_col=0)
+            return "exists"
+        status = None
+        cached = None if cache is None else cache.get_stats(self.path)
+        if cached is not None:
+            status = "hit"
+            self.count_contigs = cached["contigs"]
+            self.assembly_size = cached["assembly_size"]
+            self.unknowns = cached["unknowns"]
+        else:
             self.get_contigs()
             self.get_assembly_size()
             self.get_unknowns()
-            self.get_distance(dmx_mean)
-            data = {
-                "contigs": self.count_contigs,
-                "assembly_size": self.assembly_size,
-                "unknowns": self.unknowns,
-                "distance": self.distance,
-            }
-            self.stats = pd.DataFrame(data, index=[self.name])
-            self.stats.to_csv(self.stats_file)
-
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-    def efetch(self, db):
-        """
-        Use NCBI's efetch tools to get xml for genome's biosample id or SRA id
-        """
-        if db == "biosample":
-            db_id = db + "_id"
-        elif db == "sra":
-            db_id = db + "_id"
-        cmd = "esearch -db {} -query {} | " "efetch -format docsum".format(
-            db, self.metadata[db_id]
-        )
-        # Make efetch timeout and retry after 30 seconds
-        time_limit = 30
-        if self.metadata[db_id] != "missing":
-            try:
-                p = subprocess.run(
-                    cmd,
-                    shell="True",
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.DEVNULL,
-                    timeout=time_limit,
-                )
-                xml = p.stdout
-                self.xml[db] = xml
-            except subprocess.TimeoutExpired:
-                self.log.error("Retrying efetch after timeout")
-                raise subprocess.TimeoutExpired(cmd, time_limit)
-            except Exception:
-                self.log.exception(db)
+            if cache is not None:
+                status = "miss"
+                stats = {
+                    "contigs": self.count_contigs,
+                    "assembly_size": self.assembly_size,
+                    "unknowns": self.unknowns,
+                }
+                cache.put_stats(self.path, stats)
+        self.get_distance(dmx_mean)
+        data = {
+            "contigs": self.count_contigs,
+            "assembly_size": self.assembly_size,
+            "unknowns": self.unknowns,
+            "distance": self.distance,
+        }
+        self.stats = pd.DataFrame(data, index=[self.name])
+        with atomic_write(self.stats_file) as f:
+            self.stats.to_csv(f)
+        return status
 
     def parse_biosample(self):
         """
-        Get what we need out of the xml returned by efetch("biosample")ncluding
-        the SRA ID and fields of interest as defined in Metadata.biosample_fields
+        Get what we need out of the docsum in self.xml["biosample"] including
+        the SRA ID and fields of interest as defined in docsum.ATTRIBUTES
         """
-        attributes = [
-            "BioSample",
-            "geo_loc_name",
-            "collection_date",
-            "strain",
-            "isolation_source",
-            "host",
-            "collected_by",
-            "sample_type",
-            "sample_name",
-            "host_disease",
-            "isolate",
-            "host_health_state",
-            "serovar",
-            "env_biome",
-            "env_feature",
-            "ref_biomaterial",
-            "env_material",
-            "isol_growth_condt",
-            "num_replicons",
-            "sub_species",
-            "host_age",
-            "genotype",
-            "host_sex",
-            "serotype",
-            "host_disease_outcome",
-        ]
+        parser = docsum.BioSampleParser(missing="missing")
         try:
-            tree = ET.fromstring(self.xml["biosample"])
-            sra = tree.find('DocumentSummary/SampleData/BioSample/Ids/Id/[@db="SRA"]')
-            try:
-                self.metadata["sra_id"] = sra.text
-            except AttributeError:
-                self.metadata["sra_id"] = "missing"
-            for name in attributes:
-                xp = (
-                    "DocumentSummary/SampleData/BioSample/Attributes/"
-                    'Attribute/[@harmonized_name="{}"]'.format(name)
-                )
-                attrib = tree.find(xp)
-                try:
-                    self.metadata[name] = attrib.text
-                except AttributeError:
-                    self.metadata[name] = "missing"
+            parser.parse_string(self.xml["biosample"])
         except ParseError:
             self.log.exception()
+            return
+        record = next(parser.records(), {"SRA": "missing"})
+        self.metadata["sra_id"] = record.pop("SRA")
+        self.metadata.update(record)
 
     def parse_sra(self):
+        parser = docsum.SRARunsParser()
         try:
-            tree = ET.fromstring(self.xml["sra"])
-            elements = tree.iterfind("DocumentSummary/Runs/Run/[@acc]")
-            srr_accessions = []
-            for el in elements:
-                items = el.items()
-                acc = [i[1] for i in items if i[0] == "acc"]
-                acc = acc[0]
-                srr_accessions.append(acc)
-            self.metadata["srr_accessions"] = ",".join(srr_accessions)
+            parser.parse_string(self.xml["sra"])
         except ParseError:
             self.log.exception("Parse error for SRA XML")
+            return
+        runs = [run for runs in parser.runs.values() for run in runs]
+        self.metadata["srr_accessions"] = ",".join(runs)
 
-    def get_metadata(self):
-        self.efetch("biosample")
-        self.parse_biosample()
-        self.efetch("sra")
-        self.parse_sra()
+    def get_metadata(self, client=None):
+        """Fill in `self.metadata` from BioSample and SRA.
 
+        :param client: An `entrez.MetadataClient`. Share one between genomes, or
+        better, use `Species.get_metadata` to fetch metadata in batches.
+        """
+        if client is None:
+            client = entrez.MetadataClient.for_mirror(os.path.dirname(self.species_dir))
+        client.fill([self])
 
-# make sure Genome reads in the assembly summary here
-def sketch_genome(path):
-    genome = Genome(path)
-    genome.sketch()
 
+class GenomeRow:
+    """View of one genome of a `GenomeTable` with the attributes of `Genome`
+    that don't need a `Genome` object."""
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __repr__(self):
+        return "GenomeRow({!r})".format(self.name)
+
+    @property
+    def name(self):
+        return self.table.names[self.index]
+
+    @property
+    def accession_id(self):
+        return self.table.accessions[self.index]
+
+    @property
+    def path(self):
+        return self.table.paths[self.index]
+
+    @property
+    def size(self):
+        return int(self.table.sizes[self.index])
+
+    @property
+    def sketch_file(self):
+        return self.table.sketch_files[self.index]
+
+    @property
+    def stats_file(self):
+        return self.table.stats_files[self.index]
 
-def mp_stats(path, dmx_mean):
-    genome = Genome(path)
-    genome.get_stats(dmx_mean)
-    return genome.stats
+    def genome(self):
+        return self.table.genome(self.index)
+
+
+class GenomeTable:
+    """Names, accessions, paths and file sizes of the FASTAs of a species
+    directory as arrays.
+
+    `Genome` objects are only made for genomes that are asked for and are kept
+    after, see `genomes`.
+    """
+
+    def __init__(self, species_dir, names, paths, sizes, assembly_summary=None):
+        import numpy as np
+        import pandas as pd
+
+        self.species_dir = os.path.abspath(species_dir)
+        self.qc_dir = os.path.join(self.species_dir, "qc")
+        self.names = np.array(names, dtype=object)
+        self.paths = np.array(paths, dtype=object)
+        self.sizes = np.array(sizes, dtype=np.int64)
+        accessions = pd.Series(self.names, dtype=object).str.extract(
+            "(GCA_[0-9]*.[0-9])", expand=False
+        )
+        self.accessions = accessions.fillna("missing").values.astype(object)
+        self.assembly_summary = assembly_summary
+        self.index = pd.Index(self.names)
+        self._sketch_files = None
+        self._stats_files = None
+        self._genomes = {}
+
+    @classmethod
+    def from_directory(cls, species_dir, assembly_summary=None):
+        """Table of every FASTA in `species_dir`, see `fasta.EXTENSIONS`."""
+        names, paths, sizes = [], [], []
+        with os.scandir(species_dir) as entries:
+            for entry in entries:
+                name, extension = fasta.split_name(entry.name)
+                if extension is None:
+                    continue
+                names.append(name)
+                paths.append(os.path.abspath(entry.path))
+                sizes.append(entry.stat().st_size)
+        return cls(species_dir, names, paths, sizes, assembly_summary)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError("genome index out of range")
+        return GenomeRow(self, index % len(self))
+
+    def __iter__(self):
+        return (GenomeRow(self, i) for i in range(len(self)))
+
+    def _files(self, extension):
+        return [os.path.join(self.qc_dir, i + extension) for i in self.names]
+
+    @property
+    def sketch_files(self):
+        if self._sketch_files is None:
+            self._sketch_files = self._files(".msh")
+        return self._sketch_files
+
+    @property
+    def stats_files(self):
+        if self._stats_files is None:
+            self._stats_files = self._files(".csv")
+        return self._stats_files
+
+    def genome(self, index):
+        """The `Genome` of row `index`, made on first use."""
+        if index not in self._genomes:
+            self._genomes[index] = Genome(self.paths[index], self.assembly_summary)
+        return self._genomes[index]
+
+    @property
+    def genomes(self):
+        """Sequence of the `Genome` of every row, made as they are accessed."""
+        return _Genomes(self)
+
+
+class _Genomes(Sequence):
+    __slots__ = ("table",)
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self))[index]]
+        if not -len(self) <= index < len(self):
+            raise IndexError("genome index out of range")
+        return self.table.genome(index % len(self))
+
+
+# make sure Genome reads in the assembly summary here
+def mp_stats(path, dmx_mean, cache_root=None):
+    species = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    with logs.worker(species):
+        genome = Genome(path)
+        status = genome.get_stats(dmx_mean, open_artifact_cache(cache_root))
+    return genome.stats, status
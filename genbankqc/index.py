@@ -0,0 +1,281 @@
+"""Mirror-wide index of species sketches for nearest species queries.
+
+The index holds the MinHash sketches of a few representative genomes per
+species, the most central ones by mean MASH distance if stats exist. All hashes
+are kept in one sorted array, so a query is a binary search of its hashes
+followed by a count of shared hashes per representative. Genomes are scored
+against a species by the median over its representatives.
+"""
+import os
+import json
+import warnings
+import hashlib
+import tempfile
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import attr
+import numpy as np
+from logbook import Logger
+
+
+def read_sketch(path):
+    """Return the hashes of the first sketch in the mash sketch at `path`."""
+    cmd = ["mash", "info", "-d", str(path)]
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    sketch = json.loads(output.decode())["sketches"][0]
+    return np.unique(np.array(sketch["hashes"], dtype=np.uint64))
+
+
+def sketch_fasta(path):
+    """Sketch the FASTA at `path` into a temporary file and return its hashes."""
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "query")
+        cmd = ["mash", "sketch", str(path), "-o", out]
+        subprocess.run(cmd, stderr=subprocess.DEVNULL, check=True)
+        return read_sketch(out + ".msh")
+
+
+def read_query(path):
+    """Hashes of a mash sketch or FASTA at `path`."""
+    if str(path).endswith(".msh"):
+        return read_sketch(path)
+    return sketch_fasta(path)
+
+
+def sketches(species_dir):
+    """Map genome names to sketch paths in the qc directory of `species_dir`."""
+    qc_dir = Path(species_dir, "qc")
+    if not qc_dir.is_dir():
+        return {}
+    return {i.stem: i for i in qc_dir.glob("*.msh") if i.name != "all.msh"}
+
+
+@attr.s
+class SketchIndex(object):
+    """Nearest species index of the GenBank mirror at `root`.
+
+    :param root: Root of the GenBank mirror
+    :param representatives: Number of genomes indexed per species
+    :param workers: Threads for reading sketches with mash
+    """
+
+    root = attr.ib(converter=Path)
+    representatives = attr.ib(default=3)
+    workers = attr.ib(default=8)
+    log = Logger("SketchIndex")
+
+    def __attrs_post_init__(self):
+        self.path = self.root / ".cache" / "index"
+        (self.path / "species").mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.path / "manifest.json"
+        self.combined_path = self.path / "index.npz"
+        self.manifest = {}
+        if self.manifest_path.is_file():
+            with self.manifest_path.open() as f:
+                self.manifest = json.load(f)
+        self.hashes = None
+
+    def species_directories(self):
+        from genbankqc import Genbank
+
+        return {i.name: i for i in Genbank(self.root).species_directories}
+
+    def fingerprint(self, species_dir):
+        """Digest of the sketch files and stats of a species, which change
+        whenever its genomes or their QC results do."""
+        sha1 = hashlib.sha1(str(self.representatives).encode())
+        paths = sorted(sketches(species_dir).values())
+        stats = Path(species_dir, "qc", "stats.csv")
+        for path in paths + ([stats] if stats.is_file() else []):
+            stat = path.stat()
+            sha1.update(
+                "{} {} {}\n".format(path.name, stat.st_size, stat.st_mtime_ns).encode()
+            )
+        return sha1.hexdigest()
+
+    def choose(self, species_dir):
+        """Names and sketch paths of the representatives of a species."""
+        available = sketches(species_dir)
+        names = sorted(available)
+        stats = Path(species_dir, "qc", "stats.csv")
+        if stats.is_file():
+            import pandas as pd
+
+            distance = pd.read_csv(stats, index_col=0)["distance"]
+            distance = distance[distance.index.isin(available)]
+            central = distance.sort_values(kind="mergesort").index.tolist()
+            names = central + [i for i in names if i not in set(central)]
+        return [(i, available[i]) for i in names[: self.representatives]]
+
+    def index_species(self, name, species_dir):
+        representatives = self.choose(species_dir)
+        with ThreadPoolExecutor(self.workers) as executor:
+            hashes = list(executor.map(read_sketch, [i[1] for i in representatives]))
+        np.savez(
+            str(self.path / "species" / "{}.npz".format(name)),
+            names=np.array([i[0] for i in representatives], dtype=str),
+            sizes=np.array([len(i) for i in hashes], dtype=np.int64),
+            hashes=np.concatenate(hashes) if hashes else np.array([], np.uint64),
+        )
+
+    def update(self):
+        """Re-index species whose sketches changed since the last update.
+
+        :returns: Dict of "added", "updated" and "removed" species names
+        """
+        changes = {"added": [], "updated": [], "removed": []}
+        current = self.species_directories()
+        for name in sorted(set(self.manifest) - set(current)):
+            (self.path / "species" / "{}.npz".format(name)).unlink()
+            del self.manifest[name]
+            changes["removed"].append(name)
+        for name, species_dir in sorted(current.items()):
+            fingerprint = self.fingerprint(species_dir)
+            if self.manifest.get(name) == fingerprint:
+                continue
+            changes["updated" if name in self.manifest else "added"].append(name)
+            try:
+                self.index_species(name, species_dir)
+            except (OSError, subprocess.CalledProcessError, ValueError):
+                self.log.exception(f"Failed to index {name}")
+                continue
+            self.manifest[name] = fingerprint
+        if any(changes.values()) or not self.combined_path.is_file():
+            self.combine()
+        for change, names in changes.items():
+            self.log.info(f"{change.capitalize()} {len(names)} species")
+        return changes
+
+    def combine(self):
+        """Merge per-species entries into one array sorted by hash."""
+        species, names, owners, hashes, sizes = [], [], [], [], []
+        for i, name in enumerate(sorted(self.manifest)):
+            entry = np.load(str(self.path / "species" / "{}.npz".format(name)))
+            species.append(name)
+            for rep, size in zip(entry["names"], entry["sizes"]):
+                owners.append(np.full(size, len(names), dtype=np.int64))
+                names.append((i, str(rep)))
+                sizes.append(size)
+            hashes.append(entry["hashes"])
+        hashes = np.concatenate(hashes) if hashes else np.array([], np.uint64)
+        owners = np.concatenate(owners) if owners else np.array([], np.int64)
+        order = np.argsort(hashes, kind="mergesort")
+        np.savez(
+            str(self.combined_path),
+            species=np.array(species, dtype=str),
+            rep_species=np.array([i[0] for i in names], dtype=np.int64),
+            rep_names=np.array([i[1] for i in names], dtype=str),
+            rep_sizes=np.array(sizes, dtype=np.int64),
+            hashes=hashes[order],
+            owners=owners[order],
+        )
+        with self.manifest_path.open("w") as f:
+            json.dump(self.manifest, f)
+        self.hashes = None
+
+    def load(self):
+        if self.hashes is None:
+            if not self.combined_path.is_file():
+                self.update()
+            index = np.load(str(self.combined_path))
+            for key in index.files:
+                setattr(self, key, index[key])
+            self.species_ids = {name: i for i, name in enumerate(self.species)}
+            # Position of each representative within its species
+            starts = np.searchsorted(self.rep_species, self.rep_species)
+            self.rep_ranks = np.arange(len(self.rep_species)) - starts
+        return self
+
+    def shared(self, hashes):
+        """Number of `hashes` shared with each representative."""
+        self.load()
+        lo = np.searchsorted(self.hashes, hashes, "left")
+        counts = np.searchsorted(self.hashes, hashes, "right") - lo
+        total = counts.sum()
+        starts = np.repeat(lo, counts)
+        # Position of every match within its run of equal hashes
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        owners = self.owners[starts + offsets]
+        return np.bincount(owners, minlength=len(self.rep_names))
+
+    def species_scores(self, hashes, exclude=None):
+        """Median fraction of shared hashes with the representatives of each
+        species. The median keeps one mislabeled representative from pulling
+        genomes of another species towards its directory.
+
+        :param exclude: Name of a genome to leave out, i.e. the query itself
+        """
+        shared = self.shared(hashes)
+        scores = shared / np.maximum(np.minimum(self.rep_sizes, len(hashes)), 1)
+        if exclude is not None:
+            scores[self.rep_names == exclude] = np.nan
+        width = self.rep_ranks.max() + 1 if len(self.rep_ranks) else 1
+        table = np.full((len(self.species), width), np.nan)
+        table[self.rep_species, self.rep_ranks] = scores
+        with warnings.catch_warnings():
+            # Species without any representative left are all NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return np.nan_to_num(np.nanmedian(table, axis=1))
+
+    def nearest(self, hashes, k=3, exclude=None):
+        """List of the `k` nearest (species, score) pairs for sketch `hashes`."""
+        scores = self.species_scores(hashes, exclude)
+        top = np.argsort(-scores, kind="mergesort")[:k]
+        return [(str(self.species[i]), float(scores[i])) for i in top]
+
+    def query(self, path, k=3):
+        """Nearest species of the genome or sketch at `path`."""
+        return self.nearest(read_query(path), k)
+
+    def query_species(self, species_dir, margin=0.0):
+        """Nearest species of every sketched genome in `species_dir`.
+
+        Genomes whose nearest species isn't their own by more than `margin` are
+        flagged as mislabeled.
+
+        :returns: DataFrame indexed by genome name
+        """
+        import pandas as pd
+
+        self.load()
+        name = Path(species_dir).name
+        own = self.species_ids.get(name)
+        available = sketches(species_dir)
+        genomes = sorted(available)
+        with ThreadPoolExecutor(self.workers) as executor:
+            hashes = executor.map(read_sketch, [available[i] for i in genomes])
+            rows = []
+            for genome, query in zip(genomes, hashes):
+                scores = self.species_scores(query, exclude=genome)
+                nearest = int(np.argmax(scores))
+                own_score = scores[own] if own is not None else 0.0
+                rows.append(
+                    {
+                        "species": name,
+                        "nearest": str(self.species[nearest]),
+                        "score": float(scores[nearest]),
+                        "own_score": float(own_score),
+                        "mislabeled": bool(
+                            nearest != own and scores[nearest] > own_score + margin
+                        ),
+                    }
+                )
+        columns = ["species", "nearest", "score", "own_score", "mislabeled"]
+        return pd.DataFrame(
+            rows, index=pd.Index(genomes, name="genome"), columns=columns
+        )
+
+    def mislabeled(self, margin=0.0):
+        """Genomes of every indexed species that are closer to another species."""
+        import pandas as pd
+
+        frames = [
+            self.query_species(species_dir, margin)
+            for species_dir in self.species_directories().values()
+        ]
+        if not frames:
+            return pd.DataFrame()
+        results = pd.concat(frames)
+        return results[results.mislabeled]
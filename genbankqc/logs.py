@@ -0,0 +1,131 @@
+"""Logging from worker processes.
+
+Pool workers inherit the parent's handlers when they are forked, so their
+records would be written to the same files without synchronization, or lost
+with handlers that only exist in the parent. Instead, `worker` makes workers
+put their records on a multiprocessing queue, which never blocks them, and tags
+every record with the species it belongs to. One `Listener` thread in the
+parent takes records off the queue and hands them to the handler `route`d for
+their species, or to the parent's handlers if the species has none, so records
+of species that run concurrently end up in their own logs.
+"""
+import os
+import atexit
+import itertools
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+import attr
+import logbook
+from logbook.queues import MultiProcessingHandler
+
+_listener = None
+_lock = threading.Lock()
+
+
+@attr.s
+class Listener(object):
+    """Thread that dispatches the records that workers put on `queue`."""
+
+    queue = attr.ib(default=attr.Factory(multiprocessing.Queue))
+    log = logbook.Logger("Listener")
+
+    def __attrs_post_init__(self):
+        self.pid = os.getpid()
+        self.routes = {}
+        self.flushes = {}
+        self.tokens = itertools.count()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="log-listener")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Dispatch the records that are already queued and stop."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def flush(self, timeout=10):
+        """Wait until the records queued so far are dispatched."""
+        done = threading.Event()
+        with self.lock:
+            token = next(self.tokens)
+            self.flushes[token] = done
+        self.queue.put(("flush", token))
+        return done.wait(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get()
+            except (EOFError, OSError):
+                # The queue was closed at exit
+                break
+            if item is None:
+                break
+            if isinstance(item, tuple):
+                with self.lock:
+                    self.flushes.pop(item[1]).set()
+                continue
+            try:
+                self.dispatch(logbook.LogRecord.from_dict(item))
+            except Exception:
+                self.log.exception("Unable to dispatch a worker's record")
+
+    def dispatch(self, record):
+        handler = self.routes.get(record.extra["species"])
+        if handler is not None:
+            handler.handle(record)
+        else:
+            logbook.dispatch_record(record)
+
+
+def listen():
+    """Start the `Listener` of this process unless it's running.
+    Call this before forking workers."""
+    global _listener
+    with _lock:
+        if _listener is None or _listener.pid != os.getpid():
+            _listener = Listener().start()
+            atexit.register(_listener.stop)
+        return _listener
+
+
+def flush(timeout=10):
+    """Wait until the records workers queued so far are dispatched."""
+    if _listener is not None and _listener.pid == os.getpid():
+        _listener.flush(timeout)
+
+
+@contextmanager
+def route(species, handler):
+    """Send records of workers of `species` to `handler` instead of the
+    handlers of the listener's process."""
+    listener = listen()
+    listener.routes[species] = handler
+    try:
+        yield handler
+    finally:
+        listener.flush()
+        listener.routes.pop(species, None)
+
+
+@contextmanager
+def worker(species):
+    """Send records logged in the block to the listener of the parent, tagged
+    with `species`. Does nothing outside of workers forked from a process with
+    a listener."""
+    if _listener is None or _listener.pid == os.getpid():
+        yield
+        return
+
+    def tag(record):
+        record.extra["species"] = species
+
+    handler = MultiProcessingHandler(_listener.queue)
+    with handler.threadbound(), logbook.Processor(tag).threadbound():
+        yield
@@ -1,43 +1,126 @@
-import subprocess
-import xml.etree.cElementTree as ET
+import io
+import os
+import json
+import shutil
+import functools
+import urllib.error
+import urllib.request
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree.ElementTree import ParseError
 
 import attr
 import pandas as pd
 from logbook import Logger
 
-from Bio import Entrez
-from genbankqc import config
+from genbankqc import changes, config, docsum, entrez
+from genbankqc.atomic import atomic_write
+from genbankqc.cache import DAY, MetadataCache
 from tenacity import retry, stop_after_attempt, wait_fixed
 
 
 @attr.s
 class AssemblySummary(object):
-    """Read in existing file or download latest assembly summary."""
+    """Read in existing file or download latest assembly summary.
+
+    Downloads are conditional on the ETag, Last-Modified and Content-Length of
+    the previous download, kept in assembly_summary.json, so an unchanged summary
+    isn't downloaded again. A new summary is compared with the previous one and
+    the `changes.ChangeSet` between them is stored in `changes` and appended to
+    the `changes.ChangeLog` in assembly_changes.jsonl. `changes` is None if there
+    was no previous summary. Species directories of changes are named after
+    the species of their taxid if a `taxonomy.Taxonomy` is given.
+    """
 
     path = attr.ib(converter=Path)
     update = attr.ib(default=True)
-    url = "ftp://ftp.ncbi.nlm.nih.gov/genomes/genbank/bacteria/assembly_summary.txt"
+    url = attr.ib(
+        default="https://ftp.ncbi.nlm.nih.gov/genomes/genbank/bacteria/"
+        "assembly_summary.txt"
+    )
+    timeout = attr.ib(default=300)
+    taxonomy = attr.ib(default=None)
+    validators = ["ETag", "Last-Modified", "Content-Length"]
+    log = Logger("AssemblySummary")
 
     def __attrs_post_init__(self):
         self.file_ = self.path / "assembly_summary.txt"
+        self.validators_path = self.path / "assembly_summary.json"
+        self.changelog = changes.ChangeLog(self.path / "assembly_changes.jsonl")
+        self.changes = changes.ChangeSet()
         if self.update:
             self.df = self._update()
         else:
             self.df = self._read()
         self.ids = self.df.index.tolist()
+        latest = self.df
+        if "version_status" in latest.columns:
+            latest = latest[latest.version_status == "latest"]
+        self.latest = latest.index.tolist()
+
+    def _download(self, tmp):
+        """Download the summary to `tmp` unless it's unchanged.
+
+        :returns: Validators of the download, or None if it's unchanged
+        """
+        previous = {}
+        request = urllib.request.Request(self.url)
+        if self.file_.is_file() and self.validators_path.is_file():
+            with open(self.validators_path) as f:
+                previous = json.load(f)
+            if previous.get("ETag"):
+                request.add_header("If-None-Match", previous["ETag"])
+            if previous.get("Last-Modified"):
+                request.add_header("If-Modified-Since", previous["Last-Modified"])
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise
+        with response:
+            validators = {i: response.headers.get(i) for i in self.validators}
+            # Servers that ignore conditional requests and FTP
+            if any(validators.values()) and validators == previous:
+                return None
+            with open(tmp, "wb") as f:
+                first = response.readline()
+                # Skip the comment line above the header
+                if first.startswith(b"# assembly_accession"):
+                    f.write(first)
+                shutil.copyfileobj(response, f)
+        return validators
 
     @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
     def _update(self):
-        df = pd.read_csv(self.url, sep="\t", index_col=0, skiprows=1)
-        df.to_csv(self.file_, sep="\t")
-        return df
+        tmp = self.path / ".assembly_summary.txt.tmp"
+        try:
+            validators = self._download(tmp)
+            if validators is None:
+                self.log.info("assembly_summary.txt is up to date")
+                return self._read()
+            df = pd.read_csv(tmp, sep="\t", index_col=0)
+            if self.file_.is_file():
+                self.changes = changes.diff(self._read(), df, self.taxonomy)
+                self.log.info(f"assembly_summary.txt: {self.changes.summary()}")
+            else:
+                self.changes = None
+            os.replace(tmp, self.file_)
+            with atomic_write(self.validators_path) as f:
+                json.dump(validators, f)
+            # Only log changes once the summary they lead to is in place, so a
+            # retry doesn't diff against the old summary and log them again
+            self.changelog.append(self.changes)
+            return df
+        finally:
+            if tmp.exists():
+                tmp.unlink()
 
     def _read(self):
         try:
             return pd.read_csv(self.file_, sep="\t", index_col=0)
         except FileNotFoundError:
-            return self._download()
+            return self._update()
 
 
 @attr.s
@@ -48,124 +131,87 @@ class BioSample(object):
     email = attr.ib()
     sample = attr.ib(default=False)
     update = attr.ib(default=True)
+    cache = attr.ib(default=None)
+    accessions = attr.ib(default=None)
+    client = attr.ib(default=None)
 
-    attributes = [
-        "BioSample",
-        "SRA",
-        "geo_loc_name",
-        "collection_date",
-        "strain",
-        "isolation_source",
-        "host",
-        "collected_by",
-        "sample_type",
-        "sample_name",
-        "host_disease",
-        "isolate",
-        "host_health_state",
-        "serovar",
-        "env_biome",
-        "env_feature",
-        "ref_biomaterial",
-        "env_material",
-        "isol_growth_condt",
-        "num_replicons",
-        "sub_species",
-        "host_age",
-        "genotype",
-        "host_sex",
-        "serotype",
-        "host_disease_outcome",
-    ]
+    attributes = ["BioSample", "SRA"] + docsum.ATTRIBUTES
 
     def __attrs_post_init__(self):
         self.paths = config.Paths(root=self.outdir)
-        self.df = pd.DataFrame(index=["BioSample"], columns=self.attributes)
-        self.data = [self.df]
+        self.parser = docsum.BioSampleParser(self.attributes)
+        self.df = pd.DataFrame(columns=self.attributes).set_index("BioSample")
+        if self.client is None:
+            self.client = entrez.Client(email=self.email)
         if not self.update:
             self.df = self.read()
 
     log = Logger("BioSample")
 
-    # @retry(stop_max_attempt_number=3, stop_max_delay=10000, wait_fixed=100)
     def _esearch(
         self, db="biosample", term="bacteria[orgn] AND biosample_assembly[filter]"
     ):
-        """Use NCBI's esearch to make a query"""
-        Entrez.email = self.email
-        esearch_handle = Entrez.esearch(db=db, term=term, usehistory="y")
-        self.esearch_results = Entrez.read(esearch_handle)
+        """Use NCBI's esearch to store the results of a query on the history server"""
+        self.web_env, self.query_key, self.count = self.client.esearch(db, term)
 
     def _efetch(self):
         """Use NCBI's efetch to download esearch results"""
-        db_xp = 'Ids/Id/[@db="{}"]'
-        # Tuples for building XPath patterns
-        xp_tups = [("SRA", "db", db_xp), ("BioSample", "db", db_xp)]
-        for attrib in self.attributes:
-            xp_tups.append(
-                (
-                    attrib,
-                    "harmonized_name",
-                    'Attributes/Attribute/[@harmonized_name="{}"]',
-                )
-            )
-
-        def parse_record(xml):
-            data = {}
-            tree = ET.fromstring(xml)
-            for attrib, key, xp in xp_tups:
-                e = tree.find(xp.format(attrib))
-                if e is not None:
-                    name = e.get(key)
-                    attribute = e.text
-                    data[name] = attribute
-            self.data.append(pd.DataFrame(data, index=[data["BioSample"]]))
-
-        web_env = self.esearch_results["WebEnv"]
-        query_key = self.esearch_results["QueryKey"]
         if self.sample:
             count = self.sample
             batch_size = self.sample
             group = range(0, count, batch_size)
         else:
-            count = int(self.esearch_results["Count"])
+            count = self.count
             batch_size = 10000
             group = range(0, count, batch_size)
-        # Return a list of handles for multiprocessing
         for start in group:
             end = min(count, start + batch_size)
-            with Entrez.efetch(
+            page = self.client.post(
+                "efetch",
                 db="biosample",
                 rettype="docsum",
-                webenv=web_env,
-                query_key=query_key,
+                WebEnv=self.web_env,
+                query_key=self.query_key,
                 retstart=start,
                 retmax=batch_size,
-            ) as handle:
-                try:
-                    print("Downloading records {} to {}".format(start + 1, end))
-                    efetch_record = Entrez.read(handle, validate=False)
-                    for xml in efetch_record["DocumentSummarySet"]["DocumentSummary"]:
-                        xml = xml["SampleData"]
-                        parse_record(xml)
-                except Entrez.Parser.CorruptedXMLError:
-                    continue
-                    # log here
+            )
+            try:
+                print("Downloading records {} to {}".format(start + 1, end))
+                self.parser.parse(io.BytesIO(page))
+            except ParseError:
+                self.log.exception(f"Failed to parse records {start + 1} to {end}")
+                continue
+        if self.parser.errors:
+            self.log.error(f"{self.parser.errors} records without sample data")
 
     @property
     def sra_ids(self):
         ids = self.df[self.df.SRA.notnull()].SRA.tolist()
         return ids
 
+    def _read_through(self):
+        """Get records for `self.accessions` from `self.cache`, only fetching
+        those that are missing or expired."""
+        client = entrez.MetadataClient(self.client, cache=self.cache)
+        records = client.biosamples(self.accessions)
+        self.df = pd.DataFrame.from_records(
+            list(records.values()), columns=self.attributes
+        ).set_index("BioSample")
+
     def _DataFrame(self):
-        self.df = pd.concat(self.data)
-        self.df.set_index("BioSample", inplace=True)
         self.paths.raw = self.outdir / "_biosample_raw.csv"
         self.df.to_csv(self.paths.raw)
 
     def generate(self):
-        self._esearch()
-        self._efetch()
+        if self.accessions is None:
+            self._esearch()
+            self._efetch()
+            self.df = self.parser.to_frame()
+            if self.cache is not None:
+                records = {i["BioSample"]: i for i in self.parser.records()}
+                self.cache.put_many("biosample", records)
+        else:
+            self._read_through()
         self._DataFrame()
         self.paths.sra_ids = self.outdir / "sra_ids.txt"
         with open(self.paths.sra_ids, "w") as f:
@@ -177,22 +223,117 @@ class BioSample(object):
 
 @attr.s
 class SRA:
-    """Runs from the SRA database"""
+    """Runs from the SRA database
 
-    path = attr.ib()
+    Runs are stored in sra_runs.json as a mapping of BioSample accession to a
+    list of run accessions.
+    """
+
+    path = attr.ib(converter=Path)
+    cache = attr.ib(default=None)
+    email = attr.ib(default=None)
+    chunk_size = attr.ib(default=5000)
+    workers = attr.ib(default=3)
+    client = attr.ib(default=None)
+    log = Logger("SRA")
 
     def __attrs_post_init__(self):
         self.paths = config.Paths(root=self.path)
-        self.paths.runs = self.path / "sra_runs.tsv"
-        self.id_files = list(self.path.glob("_sra_ids_*"))
-        self.runs = pd.read_csv(
-            self.paths.runs,
-            index_col=0,
-            names=["biosample", "runs"],
-            sep="\t",
-            error_bad_lines=False,
-            warn_bad_lines=False,
-        )
+        self.paths.runs = self.path / "sra_runs.json"
+        self.paths.ids = self.path / "sra_ids.txt"
+        self.paths.progress = self.path / "_sra_progress.jsonl"
+        self.malformed = 0
+        self.run_lists = self.read()
+        self.runs = self._DataFrame(self.run_lists)
+
+    def read(self):
+        if not self.paths.runs.is_file():
+            return {}
+        with open(self.paths.runs) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _DataFrame(run_lists):
+        runs = {i: ",".join(runs) for i, runs in run_lists.items() if runs}
+        runs = pd.Series(runs, name="runs", dtype=object).to_frame()
+        runs.index.rename("biosample", inplace=True)
+        return runs
+
+    def read_progress(self):
+        """Runs and malformed record counts of the chunks that a previous,
+        interrupted `fetch` completed, by BioSample accession."""
+        run_lists, malformed = {}, 0
+        if not self.paths.progress.is_file():
+            return run_lists, malformed
+        with open(self.paths.progress) as f:
+            for line in f:
+                # A crash may leave the last line incomplete
+                if not line.endswith("\n"):
+                    continue
+                chunk = json.loads(line)
+                run_lists.update(chunk["runs"])
+                malformed += chunk["malformed"]
+        return run_lists, malformed
+
+    def fetch(self, sra_ids):
+        """Download runs for `sra_ids`, a Series of BioSample accession -> SRA
+        ID, in concurrent chunks.
+
+        The runs of every BioSample of a completed chunk are appended to
+        `paths.progress` until all chunks are done. An interrupted download
+        resumes with the BioSamples that are missing, however the IDs are
+        chunked this time.
+
+        :returns: dict of BioSample accession -> list of run accessions
+        """
+        sra_ids = pd.Series(sra_ids, dtype=object).dropna()
+        run_lists, self.malformed = self.read_progress()
+        todo = sra_ids[~sra_ids.index.isin(list(run_lists))]
+        biosamples = {}
+        for biosample, sra_id in todo.items():
+            biosamples.setdefault(sra_id, []).append(biosample)
+        client = self.client or entrez.Client(email=self.email)
+        chunks = list(entrez.chunked(sorted(biosamples), self.chunk_size))
+        fetch_runs = functools.partial(entrez.fetch_runs, client)
+        with ThreadPoolExecutor(self.workers) as executor:
+            for i, (ids, parser) in enumerate(
+                zip(chunks, executor.map(fetch_runs, chunks)), 1
+            ):
+                self.log.info(f"Downloaded runs for chunk {i} of {len(chunks)}")
+                # Every BioSample of the chunk gets a record, even without runs
+                runs = {
+                    j: parser.runs.get(j, [])
+                    for sra_id in ids
+                    for j in biosamples[sra_id]
+                }
+                chunk = {"runs": runs, "malformed": parser.errors}
+                with open(self.paths.progress, "a") as f:
+                    f.write(json.dumps(chunk) + "\n")
+                run_lists.update(runs)
+                self.malformed += parser.errors
+        if self.malformed:
+            self.log.error(f"{self.malformed} malformed SRA records")
+        if self.paths.progress.is_file():
+            self.paths.progress.unlink()
+        return {i: run_lists[i] for i in sra_ids.index if i in run_lists}
+
+    def update(self, biosample):
+        """Get runs for every BioSample in `biosample.df` with an SRA ID.
+        Only runs that are not in `self.cache` are downloaded."""
+        sra_ids = biosample.df.SRA.dropna()
+        cached = {}
+        if self.cache is not None:
+            cached = self.cache.get_many("sra", sra_ids.index)
+        missing = sra_ids[~sra_ids.index.isin(list(cached))]
+        with atomic_write(self.paths.ids) as f:
+            f.write("\n".join(missing))
+        fetched = self.fetch(missing)
+        if self.cache is not None:
+            self.cache.put_many("sra", fetched)
+        self.run_lists = dict(cached, **fetched)
+        with atomic_write(self.paths.runs) as f:
+            json.dump(self.run_lists, f)
+        self.runs = self._DataFrame(self.run_lists)
 
 
 @attr.s
@@ -203,37 +344,89 @@ class Metadata:
     email = attr.ib()
     sample = attr.ib(default=False)
     update = attr.ib(default=True)
+    ttl = attr.ib(default=30)
+    api_key = attr.ib(default=None)
 
     def __attrs_post_init__(self):
         self.csv = self.path / "metadata.csv"
-        if self.update:
-            self._update()
-        else:
-            self.assembly_summary = AssemblySummary(self.path, self.update)
-            self.biosample = BioSample(
-                email=self.email,
-                outdir=self.path,
-                sample=self.sample,
-                update=self.update,
-            )
-            self.sra = SRA(self.path)
-            self._join()
+        # One client shares its connections and rate limit between all requests
+        self.client = entrez.Client(email=self.email, api_key=self.api_key)
+        self.cache = MetadataCache(self.path / "cache.sqlite", ttl=self.ttl * DAY)
+        # Only the statistics of the cache are used afterwards
+        with self.cache:
+            if self.update:
+                self._update()
+            else:
+                self.assembly_summary = AssemblySummary(self.path, self.update)
+                self.biosample = BioSample(
+                    email=self.email,
+                    outdir=self.path,
+                    sample=self.sample,
+                    update=self.update,
+                    client=self.client,
+                )
+                self.sra = SRA(self.path, client=self.client)
+                self._join()
 
     def _update(self):
+        """Refresh missing or expired records and join them with the assembly
+        summary. The full BioSample database is downloaded when sampling."""
         self.assembly_summary = AssemblySummary(self.path)
+        accessions = None
+        if not self.sample:
+            accessions = self.assembly_summary.df.biosample.dropna().unique()
         self.biosample = BioSample(
-            email=self.email, outdir=self.path, sample=self.sample
+            email=self.email,
+            outdir=self.path,
+            sample=self.sample,
+            cache=self.cache,
+            accessions=accessions,
+            client=self.client,
         )
         self.biosample.generate()
-        subprocess.run(["bash", "./scripts/efetch_sra_runs.sh", f"{self.path}/"])
-        self.sra = SRA(self.path)
+        self.sra = SRA(self.path, cache=self.cache, client=self.client)
+        self.sra.update(self.biosample)
         self._join()
+        self.cache.report()
 
     def _join(self):
+        """Join BioSample records, assembly accessions and SRA runs.
+
+        BioSamples and runs are deduplicated first so that every assembly of a
+        BioSample gets exactly one row.
+        """
+        biosample = self.biosample.df[~self.biosample.df.index.duplicated(keep="last")]
+        runs = self.sra.runs[~self.sra.runs.index.duplicated(keep="last")]
         accession_ids = self.assembly_summary.df.reset_index()[
             ["biosample", "# assembly_accession"]
         ]
+        accession_ids = accession_ids.dropna(subset=["biosample"])
         accession_ids.set_index("biosample", inplace=True)
-        self.joined = self.biosample.df.join(accession_ids).join(self.sra.runs)
+        self.joined = biosample.join(accession_ids).join(runs)
         self.joined.index.rename("biosample", inplace=True)
-        self.joined.to_csv(self.csv)
+        with atomic_write(self.csv) as f:
+            self.joined.to_csv(f)
+
+    def partition(self, species):
+        """See `partition`."""
+        return partition(self.joined, species)
+
+
+def partition(joined, species, accession="# assembly_accession"):
+    """Split joined metadata by species directory in one pass and write
+    qc/<species>_metadata.csv for each.
+
+    :param joined: Joined metadata with a column of assembly accessions
+    :param species: dict mapping assembly accessions to species directories
+    :returns: dict of species directory -> number of rows written
+    """
+    directories = joined[accession].map(species)
+    written = {}
+    for dir_, df in joined.groupby(directories, sort=False):
+        dir_ = Path(dir_)
+        qc_dir = dir_ / "qc"
+        qc_dir.mkdir(exist_ok=True)
+        with atomic_write(qc_dir / "{}_metadata.csv".format(dir_.name)) as f:
+            df.to_csv(f)
+        written[dir_] = len(df)
+    return written
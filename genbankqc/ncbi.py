@@ -0,0 +1,273 @@
+"""Pooled, rate-limited HTTP access to NCBI.
+
+Every request to NCBI goes through a `Session`. It keeps a pool of persistent
+connections per host, asks for gzip compressed responses and retries
+throttled or failed requests with exponential backoff. Before every request it
+takes a token from a `TokenBucket` whose state lives in a locked file, so that
+all threads and processes on a machine together stay below NCBI's limit of 3
+requests per second, or 10 with an API key.
+"""
+import os
+import gzip
+import time
+import queue
+import hashlib
+import tempfile
+import threading
+import http.client
+import urllib.parse
+from pathlib import Path
+
+import attr
+from logbook import Logger
+from tenacity import retry, retry_if_exception, stop_after_attempt
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+NCBI_HOST = "ncbi.nlm.nih.gov"
+# Requests per second NCBI allows without and with an API key
+RATE = 3
+API_KEY_RATE = 10
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class NCBIError(Exception):
+    """NCBI answered with an HTTP error status."""
+
+    def __init__(self, status, reason, url, retry_after=None):
+        super().__init__("{} {} for {}".format(status, reason, url))
+        self.status = status
+        self.retry_after = retry_after
+
+
+def retryable(error):
+    """Whether a request that raised `error` may succeed when sent again."""
+    if isinstance(error, NCBIError):
+        return error.status in RETRY_STATUSES
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+def retry_after(value):
+    """Seconds of a Retry-After header, or None if it's missing or a date."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+@attr.s
+class TokenBucket(object):
+    """Limit requests to `rate` per second with bursts of up to `burst`.
+
+    The bucket only stores the time at which it will be full again. Taking a
+    token reserves the next free slot and sleeps until it, outside of any lock,
+    so waiting threads and processes don't block each other.
+
+    :param path: File holding the state of a bucket shared between processes,
+    or None to share it between the threads of this process only
+    """
+
+    rate = attr.ib()
+    burst = attr.ib(default=1)
+    path = attr.ib(default=None)
+    clock = attr.ib(default=time.time)
+
+    def __attrs_post_init__(self):
+        self.lock = threading.Lock()
+        self.full_at = 0.0
+
+    def _reserve(self, full_at):
+        interval = 1 / self.rate
+        now = self.clock()
+        full_at = max(full_at, now)
+        wait = max(0.0, full_at - (self.burst - 1) * interval - now)
+        return full_at + interval, wait
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before using it."""
+        with self.lock:
+            if self.path is None:
+                self.full_at, wait = self._reserve(self.full_at)
+                return wait
+            fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    full_at = float(os.read(fd, 64) or 0)
+                except ValueError:
+                    full_at = 0.0
+                full_at, wait = self._reserve(full_at)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, repr(full_at).encode())
+            finally:
+                # Closing the file releases the lock
+                os.close(fd)
+            return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+
+def shared_bucket(rate, api_key=None):
+    """Token bucket shared by every process on this machine using `api_key`."""
+    key = hashlib.sha1((api_key or "").encode()).hexdigest()[:12]
+    path = Path(tempfile.gettempdir()) / "genbankqc-ncbi-{}.bucket".format(key)
+    return TokenBucket(rate, path=path)
+
+
+@attr.s
+class Session(object):
+    """Thread-safe HTTP client for NCBI with a pool of keep-alive connections.
+
+    :param api_key: NCBI API key, read from $NCBI_API_KEY by default
+    :param email: Contact address sent along with every request
+    :param rate: Requests per second. Defaults to NCBI's limit for hosts under
+    ncbi.nlm.nih.gov and no limit for other hosts.
+    :param bucket: A `TokenBucket` to use for every host instead
+    :param pool_size: Idle connections kept per host
+    :param retries: Attempts per request
+    :param backoff: Seconds before the first retry, doubled for every further
+    one unless the response says how long to wait
+    """
+
+    api_key = attr.ib(default=None)
+    email = attr.ib(default=None)
+    timeout = attr.ib(default=60)
+    rate = attr.ib(default=None)
+    bucket = attr.ib(default=None)
+    pool_size = attr.ib(default=10)
+    retries = attr.ib(default=5)
+    backoff = attr.ib(default=1.0)
+    max_backoff = attr.ib(default=60.0)
+    tool = "genbankqc"
+    log = Logger("NCBI")
+
+    def __attrs_post_init__(self):
+        self.api_key = self.api_key or os.environ.get("NCBI_API_KEY")
+        self.lock = threading.Lock()
+        self.pools = {}
+        self.buckets = {}
+
+    def _bucket(self, host):
+        if self.bucket is not None:
+            return self.bucket
+        with self.lock:
+            if host not in self.buckets:
+                bucket = None
+                if (host or "").endswith(NCBI_HOST):
+                    rate = self.rate or (API_KEY_RATE if self.api_key else RATE)
+                    bucket = shared_bucket(rate, self.api_key)
+                elif self.rate:
+                    bucket = TokenBucket(self.rate)
+                self.buckets[host] = bucket
+            return self.buckets[host]
+
+    def _pool(self, scheme, netloc):
+        with self.lock:
+            return self.pools.setdefault((scheme, netloc), queue.LifoQueue())
+
+    def _connect(self, scheme, netloc):
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _wait(self, retry_state):
+        error = retry_state.outcome.exception()
+        if getattr(error, "retry_after", None) is not None:
+            return error.retry_after
+        backoff = self.backoff * 2 ** (retry_state.attempt_number - 1)
+        return min(self.max_backoff, backoff)
+
+    def _before_sleep(self, retry_state):
+        self.log.warning(
+            "Retrying after {} (attempt {} of {})".format(
+                retry_state.outcome.exception(),
+                retry_state.attempt_number,
+                self.retries,
+            )
+        )
+
+    def _send(self, method, url, body, headers):
+        parts = urllib.parse.urlsplit(url)
+        target = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        bucket = self._bucket(parts.hostname)
+        if bucket is not None:
+            bucket.acquire()
+        pool = self._pool(parts.scheme, parts.netloc)
+        try:
+            connection = pool.get_nowait()
+        except queue.Empty:
+            connection = self._connect(parts.scheme, parts.netloc)
+        try:
+            connection.request(method, target, body, headers)
+            response = connection.getresponse()
+            data = response.read()
+        except Exception:
+            connection.close()
+            raise
+        # http.client reconnects by itself if the server closed the connection
+        if pool.qsize() < self.pool_size:
+            pool.put(connection)
+        else:
+            connection.close()
+        if response.status >= 400:
+            raise NCBIError(
+                response.status,
+                response.reason,
+                url,
+                retry_after(response.getheader("Retry-After")),
+            )
+        if response.getheader("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        return data
+
+    def request(self, method, url, body=None, headers=None):
+        """Send a request and return the decompressed response body.
+
+        :raises NCBIError: For error statuses, after all retries for
+        transient ones
+        """
+        headers = dict(headers or {})
+        headers.setdefault("Accept-Encoding", "gzip")
+        send = retry(
+            stop=stop_after_attempt(self.retries),
+            wait=self._wait,
+            retry=retry_if_exception(retryable),
+            before_sleep=self._before_sleep,
+            reraise=True,
+        )(self._send)
+        return send(method, url, body, headers)
+
+    def params(self, params):
+        params = dict(params, tool=self.tool)
+        if self.email:
+            params["email"] = self.email
+        if self.api_key:
+            params["api_key"] = self.api_key
+        return params
+
+    def get(self, url, **params):
+        """GET `url` with `params` and the tool, email and API key."""
+        query = urllib.parse.urlencode(self.params(params))
+        return self.request("GET", "{}?{}".format(url, query))
+
+    def post(self, url, **params):
+        """POST `params` along with the tool, email and API key to `url`."""
+        body = urllib.parse.urlencode(self.params(params)).encode()
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        return self.request("POST", url, body, headers)
+
+    def close(self):
+        """Close all idle connections."""
+        with self.lock:
+            pools, self.pools = self.pools, {}
+        for pool in pools.values():
+            while not pool.empty():
+                pool.get_nowait().close()
@@ -0,0 +1,91 @@
+"""Update a species tree in place when genomes are added or removed.
+
+Leaves of removed genomes are pruned. New genomes are placed one at a time
+using only their own row of distances, so only the rows of new genomes are
+read from the distance matrix: next to the nearest leaf, at half the
+distance to it, on the edge of its path to the root where the tree reaches that
+height. This is how weighted linkage would join them if the new genome didn't
+change the rest of the clustering, which holds as long as few genomes change.
+"""
+import numpy as np
+
+
+def leaf_name(name):
+    return "{}.fasta".format(name)
+
+
+def genome_name(leaf):
+    return leaf[: -len(".fasta")] if leaf.endswith(".fasta") else leaf
+
+
+def heights(tree):
+    """Distance from every node to its farthest leaf."""
+    heights = {}
+    for node in tree.traverse("postorder"):
+        heights[node] = max((heights[i] + i.dist for i in node.children), default=0.0)
+    return heights
+
+
+def place(tree, name, distances, heights):
+    """Add a leaf for genome `name` to `tree` and return the new root.
+
+    :param distances: Series of distances from `name` to the genomes of the
+    current leaves
+    :param heights: `heights` of `tree`, updated with the new nodes
+    """
+    from ete3 import Tree
+
+    nearest = distances.idxmin()
+    height = max(float(distances[nearest]) / 2, 0.0)
+    (node,) = tree.get_leaves_by_name(leaf_name(nearest))
+    while node.up is not None and heights[node.up] <= height:
+        node = node.up
+    leaf = Tree(name=leaf_name(name), dist=height)
+    heights[leaf] = 0.0
+    if node.up is None:
+        # Above the root, join both under a new root
+        root = Tree()
+        node.dist = height - heights[node]
+        root.add_child(node)
+        root.add_child(leaf)
+        heights[root] = height
+        return root
+    parent = node.up
+    node.detach()
+    joint = parent.add_child(dist=max(node.dist - (height - heights[node]), 0.0))
+    node.dist = height - heights[node]
+    joint.add_child(node)
+    joint.add_child(leaf)
+    heights[joint] = height
+    return tree
+
+
+def update(tree, names, rows, threshold):
+    """Update `tree` to have a leaf for every genome in `names`, pruning leaves
+    of other genomes and placing new ones.
+
+    :param rows: Function that returns the distances from a list of genomes to
+    all genomes in `names`, as a DataFrame with a row for each. Only called
+    with the new genomes.
+    :param threshold: Largest fraction of added and removed genomes to update
+    the tree for
+    :returns: The updated tree, or None if more genomes changed than
+    `threshold` allows and the tree should be rebuilt
+    """
+    leaves = {genome_name(i) for i in tree.get_leaf_names()}
+    genomes = set(names)
+    added = [i for i in names if i not in leaves]
+    removed = leaves - genomes
+    kept = leaves & genomes
+    if not kept or len(added) + len(removed) > threshold * len(genomes):
+        return None
+    if removed:
+        tree.prune([leaf_name(i) for i in kept], preserve_branch_length=True)
+    placed = sorted(kept)
+    heights_ = heights(tree)
+    distances = rows(added) if added else None
+    for name in added:
+        row = distances.loc[name, placed]
+        tree = place(tree, name, row.astype(np.float64), heights_)
+        placed.append(name)
+    return tree
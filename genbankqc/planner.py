@@ -0,0 +1,193 @@
+"""Choose how to run the QC stages of a species within a memory budget.
+
+The memory and time of every stage are estimated from the number of genomes
+and their sizes before anything runs, with rough per-item costs measured on
+typical bacterial genomes. `Planner.plan` then picks the cheapest strategy of
+every stage that fits the budget:
+
+- distances: one dense tile, memory mapped blocks, or distances to a sample of
+  genomes if all pairs would take longer than the time budget
+- stats: as many parallel workers as there are genomes that fit in memory
+- tree: dense linkage of all genomes, or of as many sampled genomes as fit
+- rendering: render the tree, or skip it when it's too large to read
+"""
+import os
+import math
+
+import attr
+
+from genbankqc.distance import TILE_BYTES_PER_CELL, block_size, workers_for
+from genbankqc.fasta import COMPRESSED
+
+# mash dist comparisons of 1000 hash sketches per thread and second
+PAIRS_PER_SECOND = 1e6
+# FASTA bytes parsed per stats worker and second
+STATS_BYTES_PER_SECOND = 50e6
+# Memory held by a stats worker per byte of its FASTA
+STATS_MEMORY_FACTOR = 4
+# Ratio of raw to gzip compressed FASTA size
+COMPRESSION_RATIO = 3.5
+# Condensed float64 distances and the working copy made by scipy's linkage
+LINKAGE_BYTES_PER_PAIR = 16
+LINKAGE_PAIRS_PER_SECOND = 2e7
+# ete3 holds the faces and layout of every rendered leaf
+RENDER_BYTES_PER_LEAF = 64 * 1024
+RENDER_LEAVES_PER_SECOND = 200
+# Trees with more leaves are unreadable as an image
+RENDER_LEAVES = 2000
+
+
+def genome_bytes(path, size=None):
+    """Estimated uncompressed size of the FASTA at `path`.
+
+    :param size: Size of the file if it's already known
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    if os.path.splitext(path)[1] in COMPRESSED:
+        return int(size * COMPRESSION_RATIO)
+    return size
+
+
+@attr.s
+class Step(object):
+    """Strategy of one stage with its estimated peak memory in bytes and time
+    in seconds. `params` are passed on to the stage."""
+
+    stage = attr.ib()
+    strategy = attr.ib()
+    memory = attr.ib()
+    seconds = attr.ib()
+    params = attr.ib(default=attr.Factory(dict))
+
+    def __str__(self):
+        params = "".join(" {}={}".format(k, v) for k, v in sorted(self.params.items()))
+        return "{}: {}{} ({:.2f} GiB, {:.0f} s)".format(
+            self.stage, self.strategy, params, self.memory / 1024 ** 3, self.seconds
+        )
+
+
+@attr.s
+class Plan(object):
+    """Steps of a species by stage, in the order they run."""
+
+    genomes = attr.ib()
+    genome_bytes = attr.ib()
+    steps = attr.ib(default=attr.Factory(dict))
+
+    def __getitem__(self, stage):
+        return self.steps[stage]
+
+    def add(self, step):
+        self.steps[step.stage] = step
+
+    @property
+    def memory(self):
+        return max((i.memory for i in self.steps.values()), default=0)
+
+    @property
+    def seconds(self):
+        return sum(i.seconds for i in self.steps.values())
+
+    def summary(self):
+        """Strategy of every stage, e.g. for `profiling.Profiler.note`."""
+        return {stage: step.strategy for stage, step in self.steps.items()}
+
+    def log(self, logger):
+        logger.info(
+            "Plan for {} genomes, {:.1f} GB: peak {:.2f} GiB, about {:.0f} s".format(
+                self.genomes,
+                self.genome_bytes / 1e9,
+                self.memory / 1024 ** 3,
+                self.seconds,
+            )
+        )
+        for step in self.steps.values():
+            logger.info(str(step))
+
+
+@attr.s
+class Planner(object):
+    """Plan QC stages to fit `memory`.
+
+    :param memory: Memory budget in bytes
+    :param seconds: Time budget in seconds for distances, or None for exact
+    distances however long they take
+    :param cpus: Number of CPUs, all of them by default
+    :param min_sample: Fewest genomes to sample for approximate distances
+    """
+
+    memory = attr.ib()
+    seconds = attr.ib(default=None)
+    cpus = attr.ib(default=None)
+    min_sample = attr.ib(default=100)
+
+    def __attrs_post_init__(self):
+        self.cpus = self.cpus or os.cpu_count() or 1
+
+    def plan(self, sizes):
+        """Plan the stages of a species with genomes of `sizes` bytes."""
+        plan = Plan(len(sizes), sum(sizes))
+        distances = self.distances(len(sizes))
+        plan.add(distances)
+        plan.add(self.stats(sizes))
+        tree = self.tree(distances.params.get("sample", len(sizes)))
+        plan.add(tree)
+        plan.add(self.render(tree.params["leaves"]))
+        return plan
+
+    def distances(self, n):
+        workers = workers_for(self.cpus)
+        rate = PAIRS_PER_SECOND * self.cpus
+        seconds = n * (n + 1) / 2 / rate
+        if self.seconds is not None and seconds > self.seconds:
+            sample = int(self.seconds * rate / max(n, 1))
+            sample = min(n, max(self.min_sample, sample))
+            if sample < n:
+                rows = max(
+                    1, int(self.memory / (workers * TILE_BYTES_PER_CELL * sample))
+                )
+                memory = workers * min(rows, n) * sample * TILE_BYTES_PER_CELL
+                return Step(
+                    "distances",
+                    "sampled",
+                    memory,
+                    n * sample / rate,
+                    {"sample": sample},
+                )
+        block = block_size(n, self.memory, workers)
+        if block >= n:
+            return Step("distances", "dense", n * n * TILE_BYTES_PER_CELL, seconds)
+        memory = workers * block * block * TILE_BYTES_PER_CELL
+        return Step("distances", "blocked", memory, seconds, {"block": block})
+
+    def stats(self, sizes):
+        largest = max(sizes, default=0) * STATS_MEMORY_FACTOR
+        workers = int(self.memory // largest) if largest else self.cpus
+        workers = max(1, min(self.cpus, workers, len(sizes) or 1))
+        seconds = sum(sizes) / (STATS_BYTES_PER_SECOND * workers)
+        return Step(
+            "stats", "parallel", workers * largest, seconds, {"workers": workers}
+        )
+
+    def tree(self, n):
+        pairs = n * (n - 1) / 2
+        if pairs * LINKAGE_BYTES_PER_PAIR <= self.memory:
+            memory = pairs * LINKAGE_BYTES_PER_PAIR
+            seconds = pairs / LINKAGE_PAIRS_PER_SECOND
+            return Step("tree", "dense", memory, seconds, {"leaves": n})
+        leaves = int((1 + math.sqrt(1 + 8 * self.memory / LINKAGE_BYTES_PER_PAIR)) / 2)
+        pairs = leaves * (leaves - 1) / 2
+        return Step(
+            "tree",
+            "sampled",
+            pairs * LINKAGE_BYTES_PER_PAIR,
+            pairs / LINKAGE_PAIRS_PER_SECOND,
+            {"leaves": leaves},
+        )
+
+    def render(self, leaves):
+        memory = leaves * RENDER_BYTES_PER_LEAF
+        if leaves > RENDER_LEAVES or memory > self.memory:
+            return Step("render", "skip", 0, 0)
+        return Step("render", "full", memory, leaves / RENDER_LEAVES_PER_SECOND)
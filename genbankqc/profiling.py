@@ -0,0 +1,201 @@
+"""Resource accounting for the stages of a species QC run.
+
+Every run appends one JSON line to `.logs/profile.jsonl` with the wall time,
+CPU time (including mash and pool workers), peak RSS and bytes read/written of
+each stage. A "stage" event is also logged for every stage.
+"""
+import os
+import json
+import time
+import resource
+import functools
+from pathlib import Path
+from contextlib import contextmanager
+
+import attr
+import logbook
+
+from genbankqc import events
+
+
+def io_counters():
+    """Return (bytes read, bytes written) by this process and its reaped
+    children, or (None, None) where /proc/self/io isn't available."""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(":") for line in f)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def reset_peak_rss():
+    """Reset the kernel's resident set high-water mark (VmHWM) for this process.
+    Only supported on Linux."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """High-water mark of this process's resident set since the last reset."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def snapshot():
+    times = os.times()
+    read, written = io_counters()
+    return {
+        "wall": time.perf_counter(),
+        "cpu": times.user + times.system,
+        "cpu_children": times.children_user + times.children_system,
+        "bytes_read": read,
+        "bytes_written": written,
+    }
+
+
+def usage(start, end):
+    """Differences between two snapshots, rounded for readable logs."""
+    diff = {}
+    for key, value in end.items():
+        if value is None or start[key] is None:
+            diff[key] = None
+        elif key.startswith("bytes"):
+            diff[key] = value - start[key]
+        else:
+            diff[key] = round(value - start[key], 4)
+    diff["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    # The children's high-water mark can't be reset, it covers every child so far
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    diff["peak_rss_children_mb"] = round(children, 1)
+    return diff
+
+
+@attr.s
+class Profiler(object):
+    """Record the resource usage of each stage of a run.
+
+    :param path: Directory for profile.jsonl and cProfile dumps
+    :param name: Name of the species being profiled
+    :param threshold: Dump cProfile stats for stages slower than this many
+    seconds. Stages aren't profiled if it is None.
+    """
+
+    log = logbook.Logger("Profiler")
+    path = attr.ib(converter=Path)
+    name = attr.ib()
+    threshold = attr.ib(default=None)
+    record = attr.ib(default=None, init=False)
+
+    @property
+    def records_path(self):
+        return self.path / "profile.jsonl"
+
+    @property
+    def profiles_dir(self):
+        return self.path / "profiles"
+
+    @contextmanager
+    def run(self, **fields):
+        """Collect stages run inside this context into one record, which is
+        appended to `records_path` even if a stage raises."""
+        self.record = {
+            "species": self.name,
+            "start": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "status": "ok",
+            "error": None,
+        }
+        self.record.update(fields)
+        self.record["stages"] = []
+        start = snapshot()
+        try:
+            yield self.record
+        except Exception as e:
+            self.record["status"] = "failed"
+            self.record["error"] = "{}: {}".format(type(e).__name__, e)
+            raise
+        finally:
+            record, self.record = self.record, None
+            record.update(usage(start, snapshot()))
+            peaks = [i["peak_rss_mb"] for i in record["stages"]]
+            record["peak_rss_mb"] = max(peaks + [record["peak_rss_mb"]])
+            self.write(record)
+
+    def note(self, **fields):
+        """Add `fields` to the record of the current run, if there is one."""
+        if self.record is not None:
+            self.record.update(fields)
+
+    @contextmanager
+    def stage(self, name):
+        """Measure one stage of the current run. Does nothing outside of `run`."""
+        if self.record is None:
+            yield None
+            return
+        profile = self.start_profile()
+        reset_peak_rss()
+        stage = {"stage": name, "error": None}
+        start = snapshot()
+        try:
+            yield stage
+        except Exception as e:
+            stage["error"] = "{}: {}".format(type(e).__name__, e)
+            raise
+        finally:
+            end = snapshot()
+            if profile is not None:
+                profile.disable()
+            stage.update(usage(start, end))
+            if profile is not None and stage["wall"] > self.threshold:
+                stage["profile"] = self.dump_profile(profile, name)
+            self.record["stages"].append(stage)
+            message = "{} finished in {:.2f} s".format(name, stage["wall"])
+            events.emit(self.log, "stage", message, species=self.name, **stage)
+
+    def start_profile(self):
+        if self.threshold is None:
+            return None
+        import cProfile
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active
+            self.log.warning("Unable to profile, another profiler is active")
+            return None
+        return profile
+
+    def dump_profile(self, profile, stage):
+        self.profiles_dir.mkdir(exist_ok=True)
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        path = self.profiles_dir / "{}-{}.prof".format(stage, timestamp)
+        profile.dump_stats(str(path))
+        self.log.info("Wrote profile for {} to {}".format(stage, path))
+        return str(path)
+
+    def write(self, record):
+        with self.records_path.open("a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def stage(f):
+    """Measure method `f` as a stage of the current run of `self.profiler`."""
+
+    @functools.wraps(f)
+    def wrapper(self, *args, **kwargs):
+        with self.profiler.stage(f.__name__):
+            return f(self, *args, **kwargs)
+
+    return wrapper
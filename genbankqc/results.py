@@ -0,0 +1,213 @@
+"""Mirror-wide store of QC results.
+
+`Species.filter` records the status, failing criterion and stats of every
+genome along with the thresholds of its run in metadata/qc_results.db, in one
+transaction that replaces the previous results of the species for the same
+label. Genome lookups and aggregates are answered from indexes instead of
+walking every species directory.
+"""
+import re
+import time
+import pickle
+import sqlite3
+from pathlib import Path
+
+import attr
+
+CRITERIA = ["unknowns", "contigs", "assembly_size", "distance"]
+
+
+def accession(genome):
+    match = re.match("GCA_[0-9]*.[0-9]", genome)
+    return match.group() if match else genome
+
+
+@attr.s
+class ResultsDB(object):
+    """SQLite database of QC results of a GenBank mirror.
+
+    :param path: Path to the SQLite file, usually metadata/qc_results.db
+    """
+
+    path = attr.ib(converter=Path)
+
+    def __attrs_post_init__(self):
+        self.db = sqlite3.connect(self.path.as_posix(), timeout=60)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "genome TEXT NOT NULL, "
+                "accession TEXT NOT NULL, "
+                "species TEXT NOT NULL, "
+                "label TEXT NOT NULL, "
+                "status TEXT NOT NULL, "
+                "criterion TEXT, "
+                "unknowns REAL, "
+                "contigs REAL, "
+                "assembly_size REAL, "
+                "distance REAL, "
+                "updated_at REAL NOT NULL, "
+                "PRIMARY KEY (genome, label))"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS results_accession ON results (accession)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS results_species "
+                "ON results (species, label)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS results_status "
+                "ON results (label, status, criterion)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS thresholds ("
+                "species TEXT NOT NULL, "
+                "label TEXT NOT NULL, "
+                "criterion TEXT NOT NULL, "
+                "allowed TEXT, "
+                "tolerance REAL, "
+                "filtered INTEGER NOT NULL, "
+                "PRIMARY KEY (species, label, criterion))"
+            )
+
+    def put_species(self, species, label, stats, failed, thresholds, now=None):
+        """Replace the results of `species` for `label`.
+
+        :param stats: DataFrame of stats indexed by genome name
+        :param failed: Dict of failed genome names to the criterion they failed
+        :param thresholds: Dict of criteria to (allowed, tolerance, filtered)
+        """
+        import pandas as pd
+
+        now = time.time() if now is None else now
+        rows = []
+        for genome, row in stats.iterrows():
+            criterion = failed.get(genome)
+            values = [row.get(i) for i in CRITERIA]
+            rows.append(
+                [genome, accession(genome), species, label]
+                + ["passed" if criterion is None else "failed", criterion]
+                + [None if pd.isnull(i) else float(i) for i in values]
+                + [now]
+            )
+        with self.db:
+            self.db.execute(
+                "DELETE FROM results WHERE species = ? AND label = ?", (species, label)
+            )
+            self.db.execute(
+                "DELETE FROM thresholds WHERE species = ? AND label = ?",
+                (species, label),
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO results VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.db.executemany(
+                "INSERT INTO thresholds VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (species, label, criterion, str(allowed), tolerance, filtered)
+                    for criterion, (allowed, tolerance, filtered) in thresholds.items()
+                ],
+            )
+
+    def import_species(self, species_dir):
+        """Record the results of every label from the QC files of an already
+        filtered species.
+
+        :returns: Number of labels imported
+        """
+        import pandas as pd
+
+        species_dir = Path(species_dir)
+        qc_dir = species_dir / "qc"
+        stats_path = qc_dir / "stats.csv"
+        if not stats_path.is_file():
+            return 0
+        stats = pd.read_csv(stats_path, index_col=0)
+        imported = 0
+        for label_dir in sorted(qc_dir.iterdir()):
+            failed_path = label_dir / "failed.csv"
+            allowed_path = label_dir / "allowed.p"
+            if not failed_path.is_file() or not allowed_path.is_file():
+                continue
+            report = pd.read_csv(failed_path, index_col=0)
+            failed = report.criteria.dropna().to_dict()
+            with allowed_path.open("rb") as f:
+                allowed = pickle.load(f)
+            tolerances = dict(zip(CRITERIA, label_dir.name.split("-")))
+            thresholds = {
+                i: (
+                    allowed.get(i, ""),
+                    float(tolerances[i]),
+                    sum(1 for j in failed.values() if j == i),
+                )
+                for i in CRITERIA
+            }
+            self.put_species(
+                species_dir.name, label_dir.name, stats, failed, thresholds
+            )
+            imported += 1
+        return imported
+
+    def lookup(self, genome, label=None):
+        """Results of a genome by accession or full name, one per label."""
+        query = "SELECT * FROM results WHERE {} = ?"
+        args = [genome]
+        if label is not None:
+            query += " AND label = ?"
+            args.append(label)
+        column = "accession" if accession(genome) == genome else "genome"
+        rows = self.db.execute(query.format(column), args).fetchall()
+        return [dict(i) for i in rows]
+
+    def species(self, species, label=None):
+        """Results of every genome of a species."""
+        query = "SELECT * FROM results WHERE species = ?"
+        args = [species]
+        if label is not None:
+            query += " AND label = ?"
+            args.append(label)
+        return [dict(i) for i in self.db.execute(query + " ORDER BY genome", args)]
+
+    def thresholds(self, species, label=None):
+        """Thresholds of each criterion used for a species."""
+        query = "SELECT * FROM thresholds WHERE species = ?"
+        args = [species]
+        if label is not None:
+            query += " AND label = ?"
+            args.append(label)
+        return [dict(i) for i in self.db.execute(query, args)]
+
+    def counts(self, label=None):
+        """Number of genomes of every label by status and failing criterion
+        across all species.
+
+        :returns: List of dicts with label, status, criterion and genomes
+        """
+        query = (
+            "SELECT label, status, criterion, COUNT(*) AS genomes FROM results {}"
+            "GROUP BY label, status, criterion ORDER BY label, status, criterion"
+        )
+        if label is None:
+            rows = self.db.execute(query.format(""))
+        else:
+            rows = self.db.execute(query.format("WHERE label = ? "), (label,))
+        return [dict(i) for i in rows]
+
+    def report(self, label=None):
+        """Human readable summary of `counts`."""
+        lines = []
+        for row in self.counts(label):
+            status = row["status"]
+            if row["criterion"]:
+                status += " ({})".format(row["criterion"])
+            lines.append(
+                "{:<20} {:<28} {:>8}".format(row["label"], status, row["genomes"])
+            )
+        return "\n".join(lines)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,186 @@
+"""Sketch genomes with mash without a shell.
+
+Every genome gets its own sketch, because the cache, sampled distances and
+incremental updates of the combined sketch all work on per-genome sketches and
+mash can't split a combined sketch. `Sketcher` runs one mash process per genome,
+side by side from a thread pool. mash's stderr is kept and the genomes it names
+in errors are reported as failed. `CombinedSketch` pastes new per-genome sketches
+onto the combined sketch from a list file instead of a shell glob.
+"""
+import os
+import tempfile
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import attr
+from logbook import Logger
+
+
+def write_list(paths, path):
+    """Write `paths` one per line to the list file `path` for mash -l."""
+    with open(str(path), "w") as f:
+        f.write("".join("{}\n".format(i) for i in paths))
+    return str(path)
+
+
+def messages(stderr, paths):
+    """Map each of `paths` to the ERROR and WARNING lines of mash's `stderr`
+    that name it."""
+    found = {}
+    for line in stderr.splitlines():
+        if "ERROR" not in line and "WARNING" not in line:
+            continue
+        for path in paths:
+            if str(path) in line:
+                found.setdefault(path, []).append(line.strip())
+    return found
+
+
+def last_line(stderr):
+    lines = [i.strip() for i in stderr.splitlines() if i.strip()]
+    return lines[-1] if lines else "mash exited without output"
+
+
+def signature(path):
+    stat = os.stat(str(path))
+    return "{} {}".format(stat.st_size, stat.st_mtime_ns)
+
+
+@attr.s
+class Sketcher(object):
+    """Run mash sketch on many genomes.
+
+    :param threads: Number of mash processes at a time
+    :param options: Extra mash sketch options, e.g. ["-s", "10000"]
+    """
+
+    threads = attr.ib(default=None)
+    options = attr.ib(default=attr.Factory(list))
+    log = Logger("Sketcher")
+
+    def __attrs_post_init__(self):
+        self.threads = self.threads or os.cpu_count() or 1
+
+    def run(self, args):
+        """Run mash sketch with `args` and return its exit code and stderr."""
+        cmd = ["mash", "sketch"] + self.options + [str(i) for i in args]
+        try:
+            proc = subprocess.run(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+            )
+        except OSError as e:
+            return None, str(e)
+        return proc.returncode, proc.stderr.decode(errors="replace")
+
+    def warn(self, found):
+        for path, lines in found.items():
+            for line in lines:
+                if "ERROR" not in line:
+                    self.log.warning(f"{os.path.basename(str(path))}: {line}")
+
+    def sketch_one(self, path, out):
+        """Sketch the FASTA at `path` to the sketch file `out`.
+
+        :returns: None, or mash's error message if it failed
+        """
+        out = str(out)
+        prefix = (out[:-4] if out.endswith(".msh") else out) + ".tmp"
+        code, stderr = self.run([path, "-o", prefix])
+        found = messages(stderr, [path])
+        self.warn(found)
+        if code == 0 and os.path.isfile(prefix + ".msh"):
+            os.replace(prefix + ".msh", out)
+            return None
+        if os.path.isfile(prefix + ".msh"):
+            os.remove(prefix + ".msh")
+        return "; ".join(found.get(path, [])) or last_line(stderr)
+
+    def sketch_each(self, outputs):
+        """Sketch every FASTA in the dict `outputs` to its sketch file, with
+        `threads` mash processes at a time.
+
+        :returns: Dict of failed FASTAs to error messages
+        """
+        with ThreadPoolExecutor(self.threads) as executor:
+            errors = executor.map(lambda i: self.sketch_one(*i), outputs.items())
+            return {path: error for path, error in zip(outputs, errors) if error}
+
+
+def paste(sketches, out):
+    """Paste the sketch files `sketches` into `out` with mash paste -l.
+
+    :returns: None, or mash's error message if it failed
+    """
+    out = os.path.abspath(str(out))
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(out)) as tmp:
+        list_ = write_list(sketches, os.path.join(tmp, "sketches.txt"))
+        prefix = os.path.join(tmp, "combined")
+        cmd = ["mash", "paste", "-l", prefix, list_]
+        try:
+            proc = subprocess.run(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+            )
+        except OSError as e:
+            return str(e)
+        if proc.returncode != 0 or not os.path.isfile(prefix + ".msh"):
+            return last_line(proc.stderr.decode(errors="replace"))
+        os.replace(prefix + ".msh", out)
+
+
+@attr.s
+class CombinedSketch(object):
+    """A combined sketch at `path` that is updated in place.
+
+    Member names and the size and mtime of their sketches are kept in
+    `path`.txt. An update only pastes the current sketch with the new members.
+    The sketch is rebuilt if a member is gone or its sketch changed.
+
+    :param path: Path to the combined sketch, e.g. qc/all.msh
+    """
+
+    path = attr.ib(converter=Path)
+    log = Logger("CombinedSketch")
+
+    def __attrs_post_init__(self):
+        self.members_path = self.path.with_suffix(".txt")
+
+    @property
+    def members(self):
+        """Dict of member names to the signature of their sketch."""
+        if not self.path.is_file() or not self.members_path.is_file():
+            return {}
+        with self.members_path.open() as f:
+            return dict(line.rstrip("\n").split("\t") for line in f if line.strip())
+
+    def update(self, inputs):
+        """Make the combined sketch hold exactly the members in `inputs`, a dict
+        of names to sketch files.
+
+        :returns: Dict of names that failed to paste to error messages
+        """
+        inputs = {name: str(path) for name, path in inputs.items()}
+        signatures = {name: signature(path) for name, path in inputs.items()}
+        members = self.members
+        if any(signatures.get(name) != sig for name, sig in members.items()):
+            self.log.info(f"Rebuilding {self.path.name}")
+            members = {}
+        if not inputs:
+            for path in [self.path, self.members_path]:
+                if path.is_file():
+                    path.unlink()
+            return {}
+        new = [name for name in inputs if name not in members]
+        if not new:
+            return {}
+        sketches = [inputs[i] for i in new]
+        if members:
+            sketches.insert(0, str(self.path))
+        error = paste(sketches, self.path)
+        if error is not None:
+            return {name: error for name in new}
+        members.update({i: signatures[i] for i in new})
+        with self.members_path.open("w") as f:
+            f.write("".join("{}\t{}\n".format(*i) for i in members.items()))
+        self.log.info(f"Added {len(new)} sketches to {self.path.name}")
+        return {}
@@ -2,17 +2,21 @@ import os
 import re
 import pickle
 import functools
+from collections import Counter
 
 import logbook
 
 from pathlib import Path
-from subprocess import DEVNULL, Popen
 from pathos.multiprocessing import ProcessingPool
 
 import pandas as pd
 
 from ete3 import Tree
-from genbankqc import config
+from genbankqc import checkpoint, config, events, filtering, logs, phylogeny
+from genbankqc import profiling
+from genbankqc.atomic import atomic_path, atomic_write
+from genbankqc.cache import open_artifact_cache
+from genbankqc.sketch import CombinedSketch, Sketcher
 import genbankqc.genome as genome
 
 
@@ -26,6 +30,12 @@ class Species:
         mash=3.0,
         assembly_summary=None,
         metadata=None,
+        profile=None,
+        cache=None,
+        memory=4.0,
+        results=None,
+        hours=None,
+        tree_rebuild=0.1,
     ):
         """Represents a collection of genomes in `path`
 
@@ -35,6 +45,16 @@ class Species:
         :param assembly_size: Acceptable deviations from median assembly size
         :param mash: Acceptable deviations from median MASH distances
         :param assembly_summary: a pandas DataFrame with assembly summary information
+        :param profile: Dump cProfile stats for QC stages slower than this many seconds
+        :param cache: Directory of a `cache.ArtifactCache` to share sketches and
+        stats with other species, usually .cache in the GenBank mirror
+        :param memory: Memory budget in GiB, see `planner.Planner`
+        :param results: Path to a `results.ResultsDB` to record QC results in,
+        usually metadata/qc_results.db in the GenBank mirror
+        :param hours: Time budget in hours for MASH distances. Distances of
+        larger species are estimated from a sample of genomes.
+        :param tree_rebuild: Fraction of genomes that may be added or removed
+        before the tree is rebuilt instead of updated, 0 to always rebuild
         """
         self.path = os.path.abspath(path)
         self.deviation_values = [max_unknowns, contigs, assembly_size, mash]
@@ -47,6 +67,14 @@ class Species:
             os.mkdir(self.qc_results_dir)
         self.name = os.path.basename(os.path.normpath(path))
         self.log = logbook.Logger(self.name)
+        self.profiler = profiling.Profiler(self.paths.logs, self.name, profile)
+        self.cache_root = None if cache is None else os.path.abspath(cache)
+        self.cache = open_artifact_cache(self.cache_root)
+        self.memory = memory
+        self.hours = hours
+        self.tree_rebuild = tree_rebuild
+        self._plan = None
+        self.results_path = None if results is None else os.path.abspath(results)
         self.max_unknowns = max_unknowns
         self.contigs = contigs
         self.assembly_size = assembly_size
@@ -62,10 +90,15 @@ class Species:
         self.summary_path = os.path.join(self.qc_results_dir, "qc_summary.txt")
         self.allowed_path = os.path.join(self.qc_results_dir, "allowed.p")
         self.paste_file = os.path.join(self.qc_dir, "all.msh")
+        self.distance_dir = os.path.join(self.qc_dir, "distance")
+        self.sample_dir = os.path.join(self.qc_dir, "distance_sample")
+        self.journal_path = os.path.join(self.qc_dir, "journal.jsonl")
         # Figure out if defining these as None is necessary
         self.tree = None
         self.stats = None
         self.dmx = None
+        self.dmx_mean = None
+        self.sketch_errors = {}
         if os.path.isfile(self.stats_path):
             self.stats = pd.read_csv(self.stats_path, index_col=0)
         if os.path.isfile(self.nw_path):
@@ -77,6 +110,8 @@ class Species:
                 self.dmx = pd.read_csv(self.dmx_path, index_col=0, sep="\t")
             except pd.errors.EmptyDataError:
                 self.log.exception("Failed to read distance matrix")
+        else:
+            self.load_distances()
         self.metadata_path = os.path.join(
             self.qc_dir, "{}_metadata.csv".format(self.name)
         )
@@ -98,9 +133,7 @@ class Species:
             "distance": "purple",
             "assembly_size": "orange",
         }
-        self.genomes = [
-            genome.Genome(path, self.assembly_summary) for path in self.genome_paths
-        ]
+        self.table = genome.GenomeTable.from_directory(self.path, self.assembly_summary)
 
     def __str__(self):
         self.message = [
@@ -121,7 +154,13 @@ class Species:
                     self.stats.index.tolist()
                 )
                 assert os.path.isfile(self.allowed_path)
-                self.log.info("Already complete")
+                events.emit(
+                    self.log,
+                    "species_skipped",
+                    "Already complete",
+                    species=self.name,
+                    reason="already complete",
+                )
             except (AttributeError, AssertionError):
                 f(self)
 
@@ -129,7 +168,7 @@ class Species:
 
     def tree_complete(self):
         try:
-            leaf_names = [re.sub(".fasta", "", i) for i in self.tree.get_leaf_names()]
+            leaf_names = [phylogeny.genome_name(i) for i in self.tree.get_leaf_names()]
             assert (
                 sorted(leaf_names)
                 == sorted(self.stats.index.tolist())
@@ -140,22 +179,23 @@ class Species:
             return False
 
     @property
-    def genome_paths(self, ext="fasta"):
-        """Returns a generator for every file ending with `ext`
+    def genomes(self):
+        """`Genome` objects of every FASTA, made as they are accessed. Use
+        `self.table` for names, paths and other columns of all genomes."""
+        return self.table.genomes
 
-        :param ext: File extension of genomes in species directory
-        :returns: Generator of Genome objects for all genomes in species dir
-        :rtype: generator
+    @property
+    def genome_paths(self):
+        """Returns paths to every FASTA in the species directory,
+        including gzip and bgzip compressed ones (see `fasta.EXTENSIONS`).
+
+        :returns: Array of paths to all genomes in species dir
         """
-        return [
-            os.path.join(self.path, genome)
-            for genome in os.listdir(self.path)
-            if genome.endswith(ext)
-        ]
+        return self.table.paths
 
     @property
     def total_genomes(self):
-        return len(list(self.genomes))
+        return len(self.table)
 
     @property
     def sketches(self):
@@ -167,8 +207,7 @@ class Species:
 
     @property
     def genome_names(self):
-        ids = [i.name for i in self.genomes]
-        return pd.Index(ids)
+        return self.table.index
 
     @property
     def biosample_ids(self):
@@ -178,38 +217,114 @@ class Species:
     # may be redundant. see genome_names attrib
     @property
     def accession_ids(self):
-        ids = [i.accession_id for i in self.genomes if i.accession_id is not None]
-        return ids
+        return self.table.accessions
 
+    @profiling.stage
     def mash_paste(self):
-        if os.path.isfile(self.paste_file):
-            os.remove(self.paste_file)
-        sketches = os.path.join(self.qc_dir, "*msh")
-        cmd = "mash paste {} {}".format(self.paste_file, sketches)
-        Popen(cmd, shell="True", stderr=DEVNULL).wait()
+        """Add new genome sketches to all.msh, see `sketch.CombinedSketch`"""
+        sketches = {
+            i.name: i.sketch_file for i in self.table if os.path.isfile(i.sketch_file)
+        }
+        failures = CombinedSketch(self.paste_file).update(sketches)
+        for name, error in failures.items():
+            self.log.error(f"MASH paste failed for {name}: {error}")
         if not os.path.isfile(self.paste_file):
             self.log.error("MASH paste failed")
             self.paste_file = None
 
+    @property
+    def plan(self):
+        """The `planner.Plan` of this species, made on first use."""
+        if self._plan is None:
+            from genbankqc.planner import Planner, genome_bytes
+
+            seconds = None if self.hours is None else self.hours * 3600
+            planner = Planner(int(self.memory * 1024 ** 3), seconds)
+            sizes = zip(self.table.paths, self.table.sizes)
+            self._plan = planner.plan([genome_bytes(i, int(j)) for i, j in sizes])
+            self._plan.log(self.log)
+        return self._plan
+
+    @profiling.stage
     def mash_dist(self):
-        from multiprocessing import cpu_count
-
-        ncpus = cpu_count() - 2
-        cmd = "mash dist -p {} -t '{}' '{}' > '{}'".format(
-            ncpus, self.paste_file, self.paste_file, self.dmx_path
-        )
-        Popen(cmd, shell="True", stderr=DEVNULL).wait()
-        self.dmx = pd.read_csv(self.dmx_path, index_col=0, sep="\t")
-        # Make distance matrix more readable
-        names = [os.path.splitext(i)[0].split("/")[-1] for i in self.dmx.index]
-        self.dmx.index = names
-        self.dmx.columns = names
-        self.dmx.to_csv(self.dmx_path, sep="\t")
-
+        """Compute MASH distances between all sketched genomes as planned.
+        Dense and blocked plans compute all pairs in blocks that fit in the
+        memory budget, see `distance.BlockedDistance`. dmx.csv is only written
+        if the whole matrix fits in the budget too. Sampled plans estimate mean
+        distances from a sample of genomes, see `distance.SampledDistance`."""
+        import shutil
+        from genbankqc.distance import BlockedDistance, SampledDistance
+
+        genomes = [i for i in self.table if os.path.isfile(i.sketch_file)]
+        names = [i.name for i in genomes]
+        sketches = [i.sketch_file for i in genomes]
+        memory = int(self.memory * 1024 ** 3)
+        step = self.plan["distances"]
+        if step.strategy == "sampled":
+            shutil.rmtree(self.distance_dir, ignore_errors=True)
+            engine = SampledDistance(
+                sketches, names, self.sample_dir, step.params["sample"], memory
+            )
+            matrix = engine.run()
+            self.use_sample(names, engine.sampled, matrix)
+            if os.path.isfile(self.dmx_path):
+                os.remove(self.dmx_path)
+            return
+        shutil.rmtree(self.sample_dir, ignore_errors=True)
+        engine = BlockedDistance(sketches, names, self.distance_dir, memory=memory)
+        matrix = engine.run()
+        self.dmx = pd.DataFrame(matrix, index=names, columns=names, copy=False)
+        self.dmx_mean = pd.Series(engine.row_means(matrix), index=names)
+        if engine.fits_csv():
+            with atomic_write(self.dmx_path) as f:
+                self.dmx.to_csv(f, sep="\t")
+        elif os.path.isfile(self.dmx_path):
+            os.remove(self.dmx_path)
+
+    def use_sample(self, names, sampled, matrix):
+        """Use estimated mean distances and the distances between sampled
+        genomes from a `distance.SampledDistance` matrix."""
+        from genbankqc.distance import SampledDistance, row_means
+
+        sample = [names[i] for i in sampled]
+        dmx = SampledDistance.sample_matrix(matrix, sampled)
+        self.dmx = pd.DataFrame(dmx, index=sample, columns=sample)
+        means = row_means(matrix, int(self.memory * 1024 ** 3))
+        self.dmx_mean = pd.Series(means, index=names)
+
+    def load_distances(self):
+        """Use the on disk matrix of a complete blocked or sampled distance run."""
+        from genbankqc.distance import BlockedDistance, SampledDistance, row_means
+
+        loaded = BlockedDistance.load(self.distance_dir)
+        if loaded is not None:
+            names, matrix = loaded
+            self.dmx = pd.DataFrame(matrix, index=names, columns=names, copy=False)
+            means = row_means(matrix, int(self.memory * 1024 ** 3))
+            self.dmx_mean = pd.Series(means, index=names)
+            return
+        loaded = SampledDistance.load(self.sample_dir)
+        if loaded is not None:
+            self.use_sample(*loaded)
+
+    @profiling.stage
     def mash_sketch(self):
-        """Sketch all genomes"""
-        with ProcessingPool() as pool:
-            pool.map(genome.sketch_genome, self.genome_paths)
+        """Sketch all genomes without a sketch, one mash process per CPU at a
+        time. mash's errors for failed genomes are kept in `self.sketch_errors`
+        and reported with them."""
+        outputs = {
+            i.path: i.sketch_file
+            for i in self.table
+            if not os.path.isfile(i.sketch_file)
+        }
+        sketcher = Sketcher()
+        if self.cache is not None:
+            statuses, self.sketch_errors = self.cache.sketch_many(outputs, sketcher)
+            self.cache_report("sketch", statuses.values())
+        else:
+            self.sketch_errors = sketcher.sketch_each(outputs)
+        for path, error in self.sketch_errors.items():
+            self.log.error(f"Failed to sketch {os.path.basename(path)}: {error}")
 
     def run_mash(self):
         try:
@@ -225,38 +340,98 @@ class Species:
         except Exception:
             self.log.exception("mash dist failed")
 
+    def distance_rows(self, names):
+        """Distances from the genomes `names` to all genomes. Only their rows
+        are read from a memory mapped `self.dmx`."""
+        return self.dmx.iloc[self.dmx.index.get_indexer(names)]
+
+    @profiling.stage
     def get_tree(self):
-        if not self.tree_complete():
-            from ete3.coretype.tree import TreeError
-            import numpy as np
-            from skbio.tree import TreeNode
-            from scipy.cluster.hierarchy import weighted
-
-            ids = ["{}.fasta".format(i) for i in self.dmx.index.tolist()]
-            triu = np.triu(self.dmx.as_matrix())
-            hclust = weighted(triu)
-            t = TreeNode.from_linkage_matrix(hclust, ids)
-            nw = t.__str__().replace("'", "")
-            self.tree = Tree(nw)
-            try:
-                # midpoint root tree
-                self.tree.set_outgroup(self.tree.get_midpoint_outgroup())
-            except TreeError:
-                self.log.error("Unable to midpoint root tree")
-            self.tree.write(outfile=self.nw_path)
+        """Build a tree by weighted linkage of the distances. Genomes are
+        sampled if the plan says that all of them don't fit in memory.
+
+        An existing tree of all genomes is updated instead if at most
+        `tree_rebuild` of the genomes were added or removed since, see
+        `phylogeny.update`."""
+        if self.tree_complete():
+            return
+        if self.tree is not None and self.plan["tree"].strategy == "dense":
+            names = self.dmx.index.tolist()
+            tree = phylogeny.update(
+                self.tree, names, self.distance_rows, self.tree_rebuild
+            )
+            if tree is not None:
+                self.log.info("Updated the tree with new and removed genomes")
+                self.tree = tree
+                with atomic_write(self.nw_path) as f:
+                    f.write(self.tree.write())
+                return
+        import numpy as np
+        from ete3.coretype.tree import TreeError
+        from skbio.tree import TreeNode
+        from scipy.cluster.hierarchy import weighted
+        from scipy.spatial.distance import squareform
+
+        dmx = self.dmx
+        leaves = self.plan["tree"].params["leaves"]
+        if len(dmx) > leaves:
+            rng = np.random.RandomState(0)
+            keep = np.sort(rng.choice(len(dmx), leaves, replace=False))
+            dmx = dmx.iloc[keep, keep]
+            self.log.info(f"Building a tree of {leaves} sampled genomes")
+        ids = [phylogeny.leaf_name(i) for i in dmx.index.tolist()]
+        # Only the condensed matrix is converted to float64 for the linkage
+        condensed = squareform(dmx.values, checks=False).astype(float)
+        hclust = weighted(condensed)
+        t = TreeNode.from_linkage_matrix(hclust, ids)
+        nw = t.__str__().replace("'", "")
+        self.tree = Tree(nw)
+        try:
+            # midpoint root tree
+            self.tree.set_outgroup(self.tree.get_midpoint_outgroup())
+        except TreeError:
+            self.log.error("Unable to midpoint root tree")
+        with atomic_write(self.nw_path) as f:
+            f.write(self.tree.write())
 
     @property
     def stats_files(self):
         return Path(self.qc_dir).glob("GCA*csv")
 
+    @profiling.stage
     def get_stats(self):
         """Get stats for all genomes. Concat the results into a DataFrame"""
         # pool.map needs an arg for each function that will be run
-        dmx_mean = [self.dmx.mean()] * len(self.genome_paths)
-        with ProcessingPool() as pool:
-            results = pool.map(genome.mp_stats, self.genome_paths, dmx_mean)
-        self.stats = pd.concat(results)
-        self.stats.to_csv(self.stats_path)
+        paths = self.genome_paths
+        if self.dmx_mean is None:
+            self.dmx_mean = self.dmx.mean()
+        dmx_mean = [self.dmx_mean] * len(paths)
+        cache_roots = [self.cache_root] * len(paths)
+        workers = self.plan["stats"].params["workers"]
+        # Workers send their records to the listener, see `logs`
+        logs.listen()
+        with ProcessingPool(nodes=workers) as pool:
+            results = pool.map(genome.mp_stats, paths, dmx_mean, cache_roots)
+        logs.flush()
+        self.stats = pd.concat([stats for stats, _ in results])
+        with atomic_write(self.stats_path) as f:
+            self.stats.to_csv(f)
+        self.cache_report("stats", [status for _, status in results])
+
+    def cache_report(self, kind, statuses):
+        """Log the artifact cache hit rate of `kind` from the statuses returned by
+        pool workers and add it to the current profiler record."""
+        if self.cache is None:
+            return
+        counts = Counter(statuses)
+        hits, misses = counts["hit"], counts["miss"]
+        rate = hits / (hits + misses) if hits + misses else 0
+        self.log.info(
+            f"{kind} cache: {hits} hits, {misses} misses, {rate:.1%} hit rate"
+        )
+        self.profiler.note(
+            **{kind + "_cache_hits": hits, kind + "_cache_misses": misses}
+        )
 
     def MAD(self, df, col):
         """Get the median absolute deviation for col"""
@@ -421,14 +596,23 @@ class Species:
             ts.legend.add_face(cf, column=i)
         for f in file_types:
             out_tree = os.path.join(self.qc_results_dir, "tree.{}".format(f))
-            self.tree.render(out_tree, tree_style=ts)
+            with atomic_path(out_tree) as tmp:
+                self.tree.render(tmp, tree_style=ts)
 
+    @profiling.stage
     def color_tree(self):
         from ete3 import NodeStyle
 
+        if self.plan["render"].strategy == "skip":
+            self.log.info("Not rendering a tree this large")
+            return
         self.base_node_style()
         for failed_genome in self.failed_report.index:
-            n = self.tree.get_leaves_by_name(failed_genome + ".fasta").pop()
+            leaves = self.tree.get_leaves_by_name(failed_genome + ".fasta")
+            if not leaves:
+                # Not in a tree of sampled genomes
+                continue
+            n = leaves.pop()
             nstyle = NodeStyle()
             nstyle["fgcolor"] = self.colors[
                 self.failed_report.loc[failed_genome, "criteria"]
@@ -437,80 +621,156 @@ class Species:
             n.set_style(nstyle)
         self.style_and_render_tree()
 
+    @profiling.stage
     def filter(self):
         self.filter_unknown_bases()
         self.filter_contigs("contigs")
         self.filter_MAD_range("assembly_size")
         self.filter_MAD_upper("distance")
-        with open(self.allowed_path, "wb") as p:
+        with atomic_write(self.allowed_path, "wb") as p:
             pickle.dump(self.allowed, p)
         self.summary()
         self.write_failed_report()
+        self.write_results()
 
     def write_failed_report(self):
         from itertools import chain
 
-        if os.path.isfile(self.failed_path):
-            os.remove(self.failed_path)
         ixs = chain.from_iterable([i for i in self.failed.values()])
         self.failed_report = pd.DataFrame(index=ixs, columns=["criteria"])
         for criteria in self.failed.keys():
             if type(self.failed[criteria]) == pd.Index:
                 self.failed_report.loc[self.failed[criteria], "criteria"] = criteria
-        self.failed_report.to_csv(self.failed_path)
+        with atomic_write(self.failed_path) as f:
+            self.failed_report.to_csv(f)
+
+    def write_results(self):
+        """Record the status of every genome in the results database"""
+        if self.results_path is None:
+            return
+        from genbankqc.results import ResultsDB
+
+        failed = self.failed_report.criteria.dropna().to_dict()
+        thresholds = {
+            i: (self.allowed[i], self.tolerance[i], len(self.failed[i]))
+            for i in self.criteria
+        }
+        results = ResultsDB(self.results_path)
+        try:
+            results.put_species(self.name, self.label, self.stats, failed, thresholds)
+        finally:
+            results.close()
 
     def summary(self):
-        summary = [
-            self.name,
-            "Unknown Bases",
-            "Allowed: {}".format(self.allowed["unknowns"]),
-            "Tolerance: {}".format(self.tolerance["unknowns"]),
-            "Filtered: {}".format(len(self.failed["unknowns"])),
-            "\n",
-            "Contigs",
-            "Allowed: {}".format(self.allowed["contigs"]),
-            "Tolerance: {}".format(self.tolerance["contigs"]),
-            "Filtered: {}".format(len(self.failed["contigs"])),
-            "\n",
-            "Assembly Size",
-            "Allowed: {}".format(self.allowed["assembly_size"]),
-            "Tolerance: {}".format(self.tolerance["assembly_size"]),
-            "Filtered: {}".format(len(self.failed["assembly_size"])),
-            "\n",
-            "MASH",
-            "Allowed: {}".format(self.allowed["distance"]),
-            "Tolerance: {}".format(self.tolerance["distance"]),
-            "Filtered: {}".format(len(self.failed["distance"])),
-            "\n",
-        ]
-        summary = "\n".join(summary)
-        with open(os.path.join(self.summary_path), "w") as f:
+        filtered = {i: len(self.failed[i]) for i in self.criteria}
+        summary = filtering.summary(self.name, self.allowed, self.tolerance, filtered)
+        with atomic_write(self.summary_path) as f:
             f.write(summary)
         return summary
 
+    @profiling.stage
     def link_genomes(self):
         if not os.path.exists(self.passed_dir):
             os.mkdir(self.passed_dir)
+        paths = dict(zip(self.table.names, self.table.paths))
         for passed_genome in self.passed.index:
-            fname = "{}.fasta".format(passed_genome)
-            src = os.path.join(self.path, fname)
-            dst = os.path.join(self.passed_dir, fname)
+            src = paths[passed_genome]
+            dst = os.path.join(self.passed_dir, os.path.basename(src))
             try:
                 os.link(src, dst)
             except FileExistsError:
                 continue
 
+    def stages(self):
+        """QC stages in order as (name, fingerprint, outputs). A fingerprint
+        chains those of the stages the stage depends on, so changed genomes
+        rerun everything and changed tolerances only rerun filtering."""
+        fp = checkpoint.fingerprint
+        sketch = fp("mash_sketch", *sorted(self.genome_paths))
+        step = self.plan["distances"]
+        dist = fp("mash_dist", sketch, step.strategy, step.params)
+        sampled = step.strategy == "sampled"
+        distances = self.sample_dir if sampled else self.distance_dir
+        stats = fp("get_stats", dist)
+        filter_ = fp("filter", stats, self.label)
+        filter_outputs = [self.allowed_path, self.failed_path, self.summary_path]
+        rendered = [] if self.plan["render"].strategy == "skip" else [self.tree_img]
+        return [
+            ("mash_sketch", sketch, self.table.sketch_files),
+            ("mash_paste", fp("mash_paste", sketch), [self.paste_file]),
+            ("mash_dist", dist, [os.path.join(distances, "manifest.json")]),
+            ("get_stats", stats, [self.stats_path]),
+            ("filter", filter_, filter_outputs),
+            ("link_genomes", fp("link_genomes", filter_), [self.passed_dir]),
+            ("get_tree", fp("get_tree", dist), [self.nw_path]),
+            ("color_tree", fp("color_tree", dist, filter_), rendered),
+        ]
+
+    def run_stages(self):
+        """Run the QC stages that an earlier, possibly interrupted, run didn't
+        complete with the same inputs. Stages are recorded in the journal once
+        all their outputs exist. MASH stages that fail are logged and the
+        remaining stages still run, like in `run_mash`."""
+        journal = checkpoint.Journal(self.journal_path)
+        for name, fingerprint, outputs in self.stages():
+            if journal.done(name, fingerprint):
+                self.log.info(f"Skipping {name}, already done")
+                if name == "filter":
+                    self.load_filter()
+                continue
+            try:
+                getattr(self, name)()
+            except Exception:
+                if not name.startswith("mash"):
+                    raise
+                self.log.exception(f"{name.replace('_', ' ')} failed")
+                continue
+            if all(os.path.exists(str(i)) for i in outputs):
+                journal.record(name, fingerprint, outputs)
+
+    def load_filter(self):
+        """Restore the results of a completed `filter` from its files."""
+        with open(self.allowed_path, "rb") as f:
+            self.allowed = pickle.load(f)
+        self.failed_report = pd.read_csv(self.failed_path, index_col=0)
+        self.passed = self.stats.drop(self.failed_report.index, errors="ignore")
+
     @assess
     def qc(self):
         if self.total_genomes > 10:
-            self.run_mash()
-            self.get_stats()
-            self.filter()
-            self.link_genomes()
-            self.get_tree()
-            self.color_tree()
-            self.log.info("QC finished")
+            events.emit(
+                self.log,
+                "species_started",
+                "QC started",
+                species=self.name,
+                genomes=self.total_genomes,
+            )
+            with self.profiler.run(
+                label=self.label, genomes=self.total_genomes
+            ) as record:
+                self.profiler.note(plan=self.plan.summary())
+                self.run_stages()
+            if self.cache is not None:
+                self.cache.evict()
+            events.emit(
+                self.log,
+                "species_complete",
+                "QC finished",
+                species=self.name,
+                genomes=self.total_genomes,
+                passed=len(self.passed),
+                wall=record["wall"],
+            )
             self.report()
+        else:
+            events.emit(
+                self.log,
+                "species_skipped",
+                "Not enough genomes",
+                species=self.name,
+                reason="not enough genomes",
+                genomes=self.total_genomes,
+            )
 
     def report(self):
         try:
@@ -518,23 +778,31 @@ class Species:
                 self.total_genomes == self.total_sketches == len(list(self.stats_files))
             )
         except AssertionError:
-            from itertools import combinations
-
             self.log.error("File counts do not match up.")
             self.log.error(f"{self.total_genomes} total .fasta files")
             self.log.error(f"{self.total_sketches} total sketch .msh files")
             self.log.error(f"{len(list(self.stats_files))} total stats .csv files")
             sketches = [genome.Genome.id_(i.as_posix()) for i in self.sketches]
             stats = [genome.Genome.id_(i.as_posix()) for i in self.stats_files]
-            genome_ids = [i.accession_id for i in self.genomes]
-            ids = [genome_ids, sketches, stats]
-            for a, b in combinations(ids, 2):
-                diff = set(a) - set(b)
-                if bool(diff):
-                    for i in diff:
-                        self.log.error(i)
+            genome_ids = self.accession_ids
+            errors = {
+                genome.Genome.id_(path): error
+                for path, error in self.sketch_errors.items()
+            }
+            for stage, done in [("mash_sketch", sketches), ("get_stats", stats)]:
+                for i in sorted(set(genome_ids) - set(done)):
+                    events.emit(
+                        self.log,
+                        "genome_failed",
+                        f"{i} failed in {stage}",
+                        level=logbook.ERROR,
+                        species=self.name,
+                        genome=i,
+                        stage=stage,
+                        error=errors.get(i) if stage == "mash_sketch" else None,
+                    )
         try:
-            assert Path(self.dmx_path).stat().st_size  # Check if dmx is empty
+            assert self.dmx is not None and self.dmx.size  # Check if dmx is empty
         except AssertionError:
             self.log.error("Distance matrix is empty")
         try:
@@ -542,9 +810,17 @@ class Species:
         except AssertionError:
             self.log.error("Passed directory is empty")
 
-    def select_metadata(self, metadata):
-        try:
-            self.metadata = metadata.joined.loc[self.biosample_ids]
-            self.metadata.to_csv(self.metadata_path)
-        except KeyError:
-            self.log.exception("Metadata failed")
+    def get_metadata(self, client=None):
+        """Fetch metadata for all genomes with one batched `entrez.MetadataClient`.
+        Records in the GenBank mirror's metadata cache are used first."""
+        from genbankqc.entrez import MetadataClient
+
+        if client is None:
+            client = MetadataClient.for_mirror(os.path.dirname(self.path))
+        client.fill(self.genomes)
+        if client.cache is not None:
+            client.cache.report()
+        metadata = [dict(i.metadata) for i in self.genomes]
+        self.metadata = pd.DataFrame(metadata).set_index("accession")
+        with atomic_write(self.metadata_path) as f:
+            self.metadata.to_csv(f)
@@ -0,0 +1,228 @@
+"""Compact NCBI taxonomy built from taxdump.tar.gz.
+
+nodes.dmp, names.dmp and merged.dmp are parsed into arrays indexed by taxid:
+the parent, a rank code and the depth of every node, and the offset of its
+scientific name in one UTF-8 blob. Merged taxids map to their current taxid.
+The arrays are cached in a .npz file next to the dump that loads in well under
+a second. Lookups take arrays of taxids and walk all of them up the tree at
+once, one step per level, so the cost grows with the depth of the tree rather
+than the number of taxids.
+"""
+import os
+import csv
+import shutil
+import tarfile
+import urllib.request
+from pathlib import Path
+
+import attr
+import numpy as np
+from logbook import Logger
+
+from genbankqc.atomic import atomic_path, atomic_write
+from genbankqc.changes import species_directory
+
+ROOT = 1
+
+
+def read_dmp(f, columns):
+    """Read `columns` of a .dmp file, fields separated by tab, pipe, tab."""
+    import pandas as pd
+
+    # Every other column of a tab separated read is a pipe
+    return pd.read_csv(
+        f,
+        sep="\t",
+        header=None,
+        usecols=[2 * i for i in columns],
+        quoting=csv.QUOTE_NONE,
+        dtype=str,
+        keep_default_na=False,
+    )
+
+
+@attr.s
+class Taxonomy(object):
+    """Array tables of the NCBI taxonomy.
+
+    :param parent: Parent taxid of every taxid, 0 for taxids not in the dump
+    :param rank: Rank code of every taxid, an index into `ranks`
+    :param ranks: Rank names
+    :param names: Scientific names as one UTF-8 encoded blob
+    :param offsets: Start of the name of every taxid in `names` and its end
+    at the next index
+    :param merged: Current taxid of every taxid, which differs from it for
+    merged taxids
+    """
+
+    parent = attr.ib()
+    rank = attr.ib()
+    ranks = attr.ib()
+    names = attr.ib()
+    offsets = attr.ib()
+    merged = attr.ib()
+    depth = attr.ib(default=None)
+    log = Logger("Taxonomy")
+
+    def __attrs_post_init__(self):
+        if self.depth is None:
+            self.depth = self._depth()
+        self.ranks = [str(i) for i in self.ranks]
+
+    @classmethod
+    def from_taxdump(cls, path):
+        """Parse the nodes, names and merged taxids of `taxdump.tar.gz`."""
+        with tarfile.open(str(path)) as tar:
+            nodes = read_dmp(tar.extractfile("nodes.dmp"), [0, 1, 2])
+            names = read_dmp(tar.extractfile("names.dmp"), [0, 1, 3])
+            merged = read_dmp(tar.extractfile("merged.dmp"), [0, 1])
+        taxids = nodes[0].astype(np.int64).values
+        size = max(taxids.max(), merged[0].astype(np.int64).max()) + 1
+        parent = np.zeros(size, dtype=np.int32)
+        parent[taxids] = nodes[2].astype(np.int32).values
+        ranks, codes = np.unique(nodes[4].values, return_inverse=True)
+        rank = np.zeros(size, dtype=np.uint8)
+        rank[taxids] = codes + 1
+        scientific = names[names[6] == "scientific name"]
+        lengths = np.zeros(size, dtype=np.int64)
+        encoded = [i.encode() for i in scientific[2]]
+        name_taxids = scientific[0].astype(np.int64).values
+        lengths[name_taxids] = [len(i) for i in encoded]
+        offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        blob = bytearray(offsets[-1])
+        for taxid, name in zip(name_taxids, encoded):
+            blob[offsets[taxid] : offsets[taxid + 1]] = name
+        current = np.arange(size, dtype=np.int32)
+        current[merged[0].astype(np.int64).values] = merged[2].astype(np.int32).values
+        return cls(
+            parent,
+            rank,
+            ["unknown"] + list(ranks),
+            np.frombuffer(bytes(blob), dtype=np.uint8),
+            offsets,
+            current,
+        )
+
+    @classmethod
+    def load(cls, taxdump, cache=None):
+        """Load the taxonomy from `cache`, or parse `taxdump` and write `cache`
+        if it's missing or older than `taxdump`.
+
+        :param cache: Path of the .npz cache, taxonomy.npz next to `taxdump` by
+        default
+        """
+        taxdump = Path(taxdump)
+        cache = Path(cache or taxdump.with_name("taxonomy.npz"))
+        if cache.is_file() and cache.stat().st_mtime >= taxdump.stat().st_mtime:
+            with np.load(str(cache)) as arrays:
+                return cls(**{k: arrays[k] for k in arrays.files})
+        taxonomy = cls.from_taxdump(taxdump)
+        taxonomy.save(cache)
+        cls.log.info(f"Cached taxonomy of {taxdump} in {cache}")
+        return taxonomy
+
+    def save(self, path):
+        with atomic_path(path) as tmp:
+            np.savez(tmp, **{k: getattr(self, k) for k in attr.fields_dict(Taxonomy)})
+
+    def __len__(self):
+        return int(np.count_nonzero(self.rank))
+
+    def _depth(self):
+        """Number of steps from every taxid to the root."""
+        depth = np.zeros(len(self.parent), dtype=np.int16)
+        current = np.arange(len(self.parent), dtype=np.int32)
+        active = (current != ROOT) & (self.rank != 0)
+        while active.any():
+            depth[active] += 1
+            current[active] = self.parent[current[active]]
+            active[active] = current[active] > ROOT
+        return depth
+
+    def resolve(self, taxids):
+        """Current taxids of `taxids`, with merged taxids replaced and unknown
+        ones as 0."""
+        taxids = np.asarray(taxids, dtype=np.int64)
+        known = (taxids > 0) & (taxids < len(self.merged))
+        resolved = np.zeros(taxids.shape, dtype=np.int32)
+        resolved[known] = self.merged[taxids[known]]
+        resolved[self.rank[resolved] == 0] = 0
+        return resolved
+
+    def name(self, taxid):
+        """Scientific name of `taxid`, or None if it's unknown."""
+        taxid = int(self.resolve([taxid])[0])
+        if not taxid:
+            return None
+        start, end = self.offsets[taxid], self.offsets[taxid + 1]
+        return bytes(self.names[start:end]).decode()
+
+    def name_of(self, taxids):
+        """Scientific names of `taxids`, names of unique taxids are decoded once."""
+        unique, inverse = np.unique(self.resolve(taxids), return_inverse=True)
+        names = np.array([self.name(i) for i in unique], dtype=object)
+        return names[inverse]
+
+    def lineage(self, taxid):
+        """Taxids from `taxid` up to the root."""
+        taxid = int(self.resolve([taxid])[0])
+        lineage = []
+        while taxid > 0:
+            lineage.append(taxid)
+            if taxid == ROOT:
+                break
+            taxid = int(self.parent[taxid])
+        return lineage
+
+    def ancestor(self, taxids, rank):
+        """Ancestors of `rank`, e.g. "genus", of every taxid in `taxids`, or 0 for
+        taxids without one. A taxid of `rank` is its own ancestor."""
+        code = self.ranks.index(rank)
+        current = self.resolve(taxids)
+        active = (current > ROOT) & (self.rank[current] != code)
+        while active.any():
+            current[active] = self.parent[current[active]]
+            active[active] = (current[active] > ROOT) & (
+                self.rank[current[active]] != code
+            )
+        current[self.rank[current] != code] = 0
+        return current
+
+    def lca(self, a, b):
+        """Lowest common ancestors of the taxids in `a` and `b`, pairwise."""
+        a, b = self.resolve(a), self.resolve(b)
+        unknown = (a == 0) | (b == 0)
+        a[unknown] = b[unknown] = ROOT
+        # Lift the deeper taxid of every pair to the depth of the other
+        for x, y in [(a, b), (b, a)]:
+            deeper = self.depth[x] > self.depth[y]
+            while deeper.any():
+                x[deeper] = self.parent[x[deeper]]
+                deeper[deeper] = self.depth[x[deeper]] > self.depth[y[deeper]]
+        differ = a != b
+        while differ.any():
+            a[differ] = self.parent[a[differ]]
+            b[differ] = self.parent[b[differ]]
+            differ[differ] = a[differ] != b[differ]
+        a[unknown] = 0
+        return a
+
+    def species_directories(self, taxids):
+        """Species directory names, e.g. Buchnera_aphidicola, of the species of
+        `taxids`, or None for taxids without a species."""
+        species = self.ancestor(taxids, "species")
+        names = self.name_of(species)
+        unique, inverse = np.unique(names.astype(str), return_inverse=True)
+        directories = np.array([species_directory(i) for i in unique], dtype=object)
+        directories = directories[inverse]
+        directories[species == 0] = None
+        return directories
+
+
+def download(url, path):
+    """Download `url` to `path` atomically."""
+    with urllib.request.urlopen(url, timeout=300) as response:
+        with atomic_write(path, "wb") as f:
+            shutil.copyfileobj(response, f)
+    return os.path.getsize(path)
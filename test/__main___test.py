@@ -1,4 +1,9 @@
 import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
 
 import pytest
 from click.testing import CliRunner
@@ -47,3 +52,46 @@ def test_genome(genbank, genome):
     runner = CliRunner()
     result = runner.invoke(cli, [genbank.root.as_posix(), "genome", genome.path])
     assert result.exit_code == 0
+
+
+HEAVY_MODULES = ["pandas", "numpy", "ete3", "Bio", "pathos", "skbio", "scipy"]
+
+
+def imported_modules(code):
+    code = "import sys\n{}\nprint(' '.join(sys.modules))".format(code)
+    output = subprocess.run(
+        [sys.executable, "-c", code], stdout=subprocess.PIPE, check=True
+    ).stdout
+    return {i.split(".")[0] for i in output.decode().split()}
+
+
+def test_lazy_imports():
+    modules = imported_modules("import genbankqc.__main__")
+    assert not modules.intersection(HEAVY_MODULES)
+    modules = imported_modules("from genbankqc import Genbank")
+    assert not modules.intersection(HEAVY_MODULES)
+    modules = imported_modules("from genbankqc import Species")
+    assert "pandas" in modules
+
+
+def startup_time(*args, repeat=3):
+    """Best wall time of `python -m genbankqc *args` minus interpreter startup."""
+
+    def best(cmd):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    baseline = best([sys.executable, "-c", "pass"])
+    return best([sys.executable, "-m", "genbankqc"] + list(args)) - baseline
+
+
+# Generous targets; a regression to eager imports takes well over a second
+@pytest.mark.parametrize("command", [["--help"], ["info"]])
+def test_startup_time(command):
+    tmp = tempfile.mkdtemp()
+    assert startup_time(*command, tmp) < 0.75
+    shutil.rmtree(tmp)
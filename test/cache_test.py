@@ -0,0 +1,153 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from genbankqc import Genome
+from genbankqc.cache import DAY, ArtifactCache, MetadataCache, open_metadata_cache
+from genbankqc.entrez import Client, MetadataClient
+
+
+@pytest.fixture()
+def cache():
+    tmp = Path(tempfile.mkdtemp())
+    cache = MetadataCache(tmp / "cache.sqlite", ttl=DAY)
+    yield cache
+    cache.close()
+    shutil.rmtree(tmp)
+
+
+def test_put_get(cache):
+    records = {"SAMN1": {"BioSample": "SAMN1", "strain": "K-12"}, "SAMN2": {}}
+    cache.put_many("biosample", records)
+    found = cache.get_many("biosample", ["SAMN1", "SAMN2", "SAMN3"])
+    assert found == records
+    assert cache.stats["biosample"] == {"hits": 2, "misses": 1, "expired": 0}
+    assert ("biosample", "SAMN1") in cache
+    assert ("sra", "SAMN1") not in cache
+
+
+def test_ttl(cache):
+    cache.put_many("sra", {"SAMN1": ["SRR1"]}, now=0)
+    cache.put_many("sra", {"SAMN2": ["SRR2"]}, now=0, ttl=10 * DAY)
+    found = cache.get_many("sra", ["SAMN1", "SAMN2"], now=2 * DAY)
+    assert found == {"SAMN2": ["SRR2"]}
+    assert cache.stats["sra"]["expired"] == 1
+    cache.purge(now=2 * DAY)
+    assert cache.get_many("sra", ["SAMN1"], now=0) == {}
+
+
+def test_persistent(cache):
+    cache.put_many("biosample", {"SAMN1": {"strain": "K-12"}})
+    reopened = MetadataCache(cache.path)
+    assert reopened.get_many("biosample", ["SAMN1"]) == {"SAMN1": {"strain": "K-12"}}
+    reopened.close()
+
+
+def test_close(cache):
+    with MetadataCache(cache.path) as reopened:
+        reopened.put_many("sra", {"SAMN1": []})
+    with pytest.raises(sqlite3.ProgrammingError):
+        reopened.get_many("sra", ["SAMN1"])
+    shared = open_metadata_cache(cache.path)
+    assert open_metadata_cache(cache.path) is shared
+    shared.close()
+    reopened = open_metadata_cache(cache.path)
+    assert reopened is not shared
+    assert reopened.get_many("sra", ["SAMN1"]) == {"SAMN1": []}
+    reopened.close()
+
+
+def test_many(cache):
+    records = {"SAMN{}".format(i): {} for i in range(2000)}
+    cache.put_many("biosample", records)
+    assert len(cache.get_many("biosample", records)) == 2000
+
+
+def test_report(cache):
+    cache.get_many("biosample", ["SAMN1"])
+    report = cache.report()
+    assert "biosample cache: 0 hits, 1 misses" in report
+
+
+def test_read_through(cache, fake_entrez):
+    accessions = list(fake_entrez.db["biosample"])[:5]
+    client = MetadataClient(Client(base_url=fake_entrez.url), cache=cache)
+    records = client.biosamples(accessions)
+    runs = client.sra_runs({i: records[i]["SRA"] for i in records})
+    requests = len(fake_entrez.requests)
+    assert requests
+    # A new client only reads from the cache
+    client = MetadataClient(Client(base_url=fake_entrez.url), cache=cache)
+    assert client.biosamples(accessions) == records
+    assert client.sra_runs({i: records[i]["SRA"] for i in records}) == runs
+    assert len(fake_entrez.requests) == requests
+    assert cache.stats["biosample"]["hits"] == 5
+
+
+FAKE_MASH = """#!/bin/sh
+# mash sketch FASTA -o OUT: record the sketched name like mash does
+echo "$2" > "$4.msh"
+"""
+
+
+@pytest.fixture()
+def artifacts(fake_mash):
+    tmp = Path(tempfile.mkdtemp())
+    fake_mash(FAKE_MASH, tmp)
+    for species in ["A", "B"]:
+        (tmp / species / "qc").mkdir(parents=True)
+    fasta = ">contig_0\nACGTNNACGT\n"
+    (tmp / "A" / "GCA_000000001.1_x.fasta").write_text(fasta)
+    (tmp / "B" / "GCA_000000001.2_x.fasta").write_text(fasta)
+    (tmp / "B" / "GCA_000000002.1_y.fasta").write_text(">contig_0\nACGT\n")
+    cache = ArtifactCache(tmp / ".cache")
+    yield tmp, cache
+    cache.close()
+    shutil.rmtree(tmp)
+
+
+def test_artifact_sketch(artifacts):
+    tmp, cache = artifacts
+    old = tmp / "A" / "GCA_000000001.1_x.fasta"
+    new = tmp / "B" / "GCA_000000001.2_x.fasta"
+    assert cache.digest(old) == cache.digest(new)
+    assert cache.sketch(old, tmp / "A" / "qc" / "old.msh") == "miss"
+    # The re-versioned genome in another species reuses the sketch
+    assert cache.sketch(new, tmp / "B" / "qc" / "new.msh") == "hit"
+    assert os.path.samefile(tmp / "A" / "qc" / "old.msh", tmp / "B" / "qc" / "new.msh")
+    name = (tmp / "B" / "qc" / "new.msh").read_text().strip()
+    assert os.path.basename(name) == cache.digest(old) + ".fasta"
+    assert "sketch cache: 1 hits, 1 misses, 50.0% hit rate" in cache.report()
+
+
+def test_artifact_stats(artifacts):
+    import pandas as pd
+
+    tmp, cache = artifacts
+    dmx_mean = pd.Series({"GCA_000000001.1_x": 0.1, "GCA_000000001.2_x": 0.2})
+    old = Genome(str(tmp / "A" / "GCA_000000001.1_x.fasta"))
+    assert old.get_stats(dmx_mean, cache) == "miss"
+    new = Genome(str(tmp / "B" / "GCA_000000001.2_x.fasta"))
+    assert new.get_stats(dmx_mean, cache) == "hit"
+    assert new.stats.loc["GCA_000000001.2_x", "unknowns"] == 2
+    assert new.stats.loc["GCA_000000001.2_x", "distance"] == 0.2
+    assert new.get_stats(dmx_mean, cache) == "exists"
+
+
+def test_artifact_evict(artifacts):
+    tmp, cache = artifacts
+    a = tmp / "A" / "GCA_000000001.1_x.fasta"
+    b = tmp / "B" / "GCA_000000002.1_y.fasta"
+    cache.sketch(a, tmp / "A" / "qc" / "a.msh")
+    cache.sketch(b, tmp / "B" / "qc" / "b.msh")
+    cache.sketch(a, tmp / "A" / "qc" / "a.msh")  # a is now most recently used
+    cache.max_size = os.path.getsize(cache.sketch_path(cache.digest(a)))
+    assert cache.evict() == 1
+    assert cache.sketch_path(cache.digest(a)).exists()
+    assert not cache.sketch_path(cache.digest(b)).exists()
+    # Linked sketches survive eviction
+    assert (tmp / "B" / "qc" / "b.msh").exists()
@@ -0,0 +1,249 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from genbankqc import AssemblySummary, Genbank
+from genbankqc.changes import ChangeLog, ChangeSet, diff
+
+HEADER = "# assembly_accession\tspecies_taxid\torganism_name\tversion_status\n"
+
+
+def summary_text(rows):
+    lines = ["\t".join(map(str, i)) + "\n" for i in rows]
+    return "#   See README\n" + HEADER + "".join(lines)
+
+
+OLD = [
+    ("GCA_000000001.1", 1, "Genus one str. A", "latest"),
+    ("GCA_000000002.1", 1, "Genus one str. B", "latest"),
+    ("GCA_000000003.1", 2, "Genus two", "latest"),
+]
+NEW = [
+    ("GCA_000000001.1", 1, "Genus one str. A", "latest"),
+    ("GCA_000000002.2", 1, "Genus one str. B", "latest"),
+    ("GCA_000000003.1", 2, "Genus two", "suppressed"),
+    ("GCA_000000004.1", 3, "Genus three", "latest"),
+]
+
+
+def frame(rows):
+    df = pd.DataFrame(rows, columns=HEADER.strip().split("\t"))
+    return df.set_index("# assembly_accession")
+
+
+def test_diff():
+    changes = diff(frame(OLD), frame(NEW))
+    assert changes.accessions("added") == ["GCA_000000004.1"]
+    assert changes.accessions("replaced") == ["GCA_000000002.2"]
+    assert changes.accessions("suppressed") == ["GCA_000000003.1"]
+    assert changes.stale == {"GCA_000000002.1", "GCA_000000003.1"}
+    assert changes.species == {"Genus_one", "Genus_two", "Genus_three"}
+    assert changes.by_taxid()[1] == {"replaced": ["GCA_000000002.2"]}
+    assert changes.by_species()["Genus_three"] == {"added": ["GCA_000000004.1"]}
+    assert not diff(frame(NEW), frame(NEW))
+
+
+@pytest.fixture()
+def tmp():
+    tmp = Path(tempfile.mkdtemp())
+    yield tmp
+    shutil.rmtree(tmp)
+
+
+def test_changelog(tmp):
+    log = ChangeLog(tmp / "assembly_changes.jsonl")
+    log.append(diff(frame(OLD), frame(NEW)))
+    changes, mark = log.pending("qc")
+    assert changes is None
+    log.consume("qc", mark)
+    assert len(log.pending("qc")[0]) == 0
+    log.append(ChangeSet([{"change": "added", "species": "Genus_four"}]))
+    changes, mark = log.pending("qc")
+    assert changes.species == {"Genus_four"}
+    # Changes appended after `pending` are still pending after `consume`
+    log.append(ChangeSet([{"change": "added", "species": "Genus_five"}]))
+    log.consume("qc", mark)
+    assert log.pending("qc")[0].species == {"Genus_five"}
+    log.append(None)
+    assert log.pending("qc")[0] is None
+
+
+def serve_summary(self):
+    """Serve `server.summary` with its version as ETag."""
+    self.server.requests += 1
+    etag = '"{}"'.format(self.server.version)
+    if self.headers.get("If-None-Match") == etag:
+        self.send_response(304)
+        self.end_headers()
+        return
+    body = self.server.summary.encode()
+    self.send_response(200)
+    self.send_header("ETag", etag)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+@pytest.fixture()
+def server(http_server):
+    server = http_server(do_GET=serve_summary)
+    server.requests = 0
+    server.version = 1
+    server.summary = summary_text(OLD)
+    server.url += "/assembly_summary.txt"
+    return server
+
+
+def test_conditional_update(tmp, server):
+    summary = AssemblySummary(tmp, url=server.url)
+    assert summary.changes is None
+    assert summary.ids == [i[0] for i in OLD]
+    assert AssemblySummary(tmp, update=False).ids == summary.ids
+    summary = AssemblySummary(tmp, url=server.url)
+    assert len(summary.changes) == 0
+    assert summary.ids == [i[0] for i in OLD]
+    server.version, server.summary = 2, summary_text(NEW)
+    summary = AssemblySummary(tmp, url=server.url)
+    assert summary.changes.accessions("replaced") == ["GCA_000000002.2"]
+    assert len(summary.changelog.entries()) == 2
+    assert server.requests == 3
+
+
+def test_update_retry_logs_once(tmp, server, monkeypatch):
+    import os
+
+    AssemblySummary(tmp, url=server.url)
+    server.version, server.summary = 2, summary_text(NEW)
+    replace = os.replace
+    failures = [OSError("disk full")]
+
+    def flaky_replace(src, dst):
+        if str(dst).endswith("assembly_summary.txt") and failures:
+            raise failures.pop()
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", flaky_replace)
+    summary = AssemblySummary(tmp, url=server.url)
+    assert summary.changes.accessions("added") == ["GCA_000000004.1"]
+    assert len(summary.changelog.entries()) == 2
+
+
+def test_file_update(tmp):
+    source = tmp / "source.txt"
+    source.write_text(summary_text(OLD))
+    metadata = tmp / "metadata"
+    metadata.mkdir()
+    AssemblySummary(metadata, url=source.as_uri())
+    mtime = (metadata / "assembly_summary.txt").stat().st_mtime_ns
+    # Unchanged size and modification time
+    assert len(AssemblySummary(metadata, url=source.as_uri()).changes) == 0
+    assert (metadata / "assembly_summary.txt").stat().st_mtime_ns == mtime
+    source.write_text(summary_text(NEW))
+    changes = AssemblySummary(metadata, url=source.as_uri()).changes
+    assert changes.accessions("added") == ["GCA_000000004.1"]
+
+
+def test_prune(tmp):
+    genbank = Genbank(tmp)
+    for name, accessions in [
+        ("Genus_one", ["GCA_000000001.1", "GCA_000000002.1"]),
+        # Named by another tool, not after the organism name
+        ("Genus_two_other", ["GCA_000000003.1"]),
+        ("Genus_six", ["GCA_000000006.1"]),
+    ]:
+        (tmp / name).mkdir()
+        for accession in accessions:
+            (tmp / name / (accession + "_x.fasta")).write_text(">contig\nACGT\n")
+    six = [("GCA_000000006.1", 6, "Genus six", "latest")]
+    source = tmp / "source.txt"
+    source.write_text(summary_text(OLD + six))
+    genbank.prune(AssemblySummary(genbank.paths.metadata, url=source.as_uri()))
+    source.write_text(summary_text(NEW + six))
+    (tmp / "Genus_six" / "GCA_000000007.1_x.fasta").write_text(">contig\nACGT\n")
+    (tmp / "Genus_one" / "qc").mkdir()
+    (tmp / "Genus_one" / "qc" / "GCA_000000002.1_x.msh").write_text("")
+    # Partial downloads are left to the fetcher
+    (tmp / "Genus_one" / "GCA_000000002.1_x.fna.gz.part").write_text("")
+    genbank.prune(AssemblySummary(genbank.paths.metadata, url=source.as_uri()))
+    names = sorted(i.name for i in (tmp / "Genus_one").iterdir())
+    assert names == ["GCA_000000001.1_x.fasta", "GCA_000000002.1_x.fna.gz.part", "qc"]
+    assert not list((tmp / "Genus_one" / "qc").iterdir())
+    assert not list((tmp / "Genus_two_other").iterdir())
+    # Only species with changes are searched
+    assert (tmp / "Genus_six" / "GCA_000000007.1_x.fasta").is_file()
+
+
+class FailingSpecies(object):
+    def __init__(self, path, fail):
+        self.name = path.name
+        self.path = path
+        self.fail = fail
+
+        self.runs = 0
+
+    def qc(self):
+        self.runs += 1
+        if self.fail:
+            raise RuntimeError("QC crashed")
+
+
+def test_qc_keeps_failed_changes_pending(tmp, monkeypatch):
+    genbank = Genbank(tmp)
+    genbank.changelog.consume("qc", 0)
+    record = {"change": "added", "accession": "GCA_000000001.1", "species": "Genus_one"}
+    genbank.changelog.append(ChangeSet([record]))
+    monkeypatch.setattr(genbank, "prune", lambda: None)
+    (tmp / "Genus_one" / ".logs").mkdir(parents=True)
+    species = [FailingSpecies(tmp / "Genus_one", True)]
+    monkeypatch.setattr(genbank, "species", lambda **kwargs: species)
+    genbank.qc()
+    assert genbank.changelog.pending("qc")[0].species == {"Genus_one"}
+    species[0].fail = False
+    genbank.qc()
+    assert not genbank.changelog.pending("qc")[0].species
+    # Species are still QC'd without pending changes
+    genbank.qc()
+    assert species[0].runs == 3
+
+
+def test_species_with_changes_first(tmp):
+    for name in ["Genus_one", "Genus_two", "Genus_three"]:
+        (tmp / name).mkdir()
+        for i in range(10):
+            (tmp / name / "GCA_{:09d}.1_x.fasta".format(i)).write_text(">c\nACGT\n")
+    genbank = Genbank(tmp)
+    names = [i.name for i in genbank.species(first={"Genus_two"})]
+    assert names[0] == "Genus_two"
+    assert sorted(names) == ["Genus_one", "Genus_three", "Genus_two"]
+
+
+class Joined(object):
+    def __init__(self, accessions):
+        self.joined = pd.DataFrame({"# assembly_accession": accessions})
+
+    def partition(self, species):
+        from genbankqc.metadata import partition
+
+        return partition(self.joined, species)
+
+
+def test_species_metadata(tmp):
+    accessions = ["GCA_{:09d}.1".format(i) for i in range(21)]
+    for name, ids in [("Unnamed_dir", accessions[:10]), ("Genus_b", accessions[10:20])]:
+        (tmp / name).mkdir()
+        for accession in ids:
+            (tmp / name / (accession + "_x.fasta")).write_text(">c\nACGT\n")
+    genbank = Genbank(tmp)
+    metadata = Joined(accessions)
+    assert len(genbank.species_metadata(metadata)) == 2
+    assert not genbank.species_metadata(metadata)
+    # Changes are found by accession, whatever the directory is named
+    record = {"change": "added", "accession": accessions[3], "species": "Genus_one"}
+    genbank.changelog.append(ChangeSet([record]))
+    assert list(genbank.species_metadata(metadata)) == [tmp / "Unnamed_dir"]
+    # Genomes added without a change, e.g. by other download tools
+    (tmp / "Genus_b" / (accessions[20] + "_x.fasta")).write_text(">c\nACGT\n")
+    assert list(genbank.species_metadata(metadata)) == [tmp / "Genus_b"]
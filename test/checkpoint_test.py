@@ -0,0 +1,122 @@
+import os
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from genbankqc import Species
+from genbankqc.atomic import atomic_path, atomic_write
+from genbankqc.checkpoint import Journal, fingerprint
+
+
+@pytest.fixture()
+def tmp():
+    tmp = Path(tempfile.mkdtemp())
+    yield tmp
+    shutil.rmtree(tmp)
+
+
+def test_atomic_write(tmp):
+    path = tmp / "stats.csv"
+    path.write_text("old")
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as f:
+            f.write("partial")
+            raise RuntimeError
+    assert path.read_text() == "old"
+    with atomic_write(path) as f:
+        f.write("new")
+    assert path.read_text() == "new"
+    assert os.listdir(tmp) == ["stats.csv"]
+
+
+def test_atomic_path_threads(tmp):
+    path = tmp / "tree.svg"
+
+    def write(i):
+        with atomic_path(path) as tmp_path:
+            assert tmp_path.endswith(".svg")
+            with open(tmp_path, "w") as f:
+                f.write(str(i))
+        return i
+
+    with ThreadPoolExecutor(4) as executor:
+        assert sorted(executor.map(write, range(8))) == list(range(8))
+    assert path.read_text() in {str(i) for i in range(8)}
+    assert os.listdir(tmp) == ["tree.svg"]
+
+
+def test_journal(tmp):
+    output = tmp / "tree.nw"
+    output.write_text("();")
+    journal = Journal(tmp / "journal.jsonl")
+    journal.record("get_tree", "a", [output])
+    journal.record("filter", "b")
+    assert journal.done("get_tree", "a")
+    assert not journal.done("get_tree", "b")
+    with journal.path.open("a") as f:
+        f.write('{"stage": "get_stats", "finger')
+    assert not journal.done("get_stats", "c")
+    output.unlink()
+    assert not journal.done("get_tree", "a")
+    assert fingerprint(output, 1) == fingerprint(output, 1) != fingerprint(output, 2)
+
+
+def write_output(path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.name == "allowed.p":
+        with path.open("wb") as f:
+            pickle.dump({"unknowns": 200}, f)
+    elif path.name in ["failed.csv", "stats.csv"]:
+        path.write_text("genome,criteria\nGCA_000000000.1_x,contigs\n")
+    elif path.name == "passed":
+        path.mkdir(exist_ok=True)
+    elif path.name == "tree.nw":
+        path.write_text("(GCA_000000000.1_x.fasta:1);")
+    else:
+        path.write_text("done")
+
+
+def run(path, fail=None, **kwargs):
+    """Run the QC stages of a new Species with stages that only write their
+    outputs and return the names of the stages run."""
+    species = Species(str(path), **kwargs)
+    calls = []
+    for name, _, outputs in species.stages():
+
+        def stage(name=name, outputs=outputs):
+            calls.append(name)
+            if name == fail:
+                raise RuntimeError(name)
+            for output in outputs:
+                write_output(output)
+
+        setattr(species, name, stage)
+    try:
+        species.run_stages()
+    except RuntimeError:
+        pass
+    return calls
+
+
+def test_resume(tmp):
+    path = tmp / "Species_name"
+    (path / "qc").mkdir(parents=True)
+    for i in range(11):
+        (path / "GCA_{:09d}.1_x.fasta".format(i)).write_text(">contig\nACGT\n")
+    stages = [i[0] for i in Species(str(path)).stages()]
+    assert run(path, fail="get_tree") == stages[:-1]
+    assert run(path) == ["get_tree", "color_tree"]
+    assert run(path) == []
+    # Failed MASH stages don't stop later stages but rerun next time
+    (path / "qc" / "all.msh").unlink()
+    assert run(path, fail="mash_paste") == ["mash_paste"]
+    assert run(path) == ["mash_paste"]
+    # New tolerances only rerun filtering and what depends on it
+    assert run(path, mash=2.0) == ["filter", "link_genomes", "color_tree"]
+    (path / "GCA_000000011.1_x.fasta").write_text(">contig\nACGT\n")
+    assert run(path) == stages
@@ -1,7 +1,13 @@
-import os.path
+import re
+import os
+import sys
 import shutil
 import tempfile
+import threading
+import http.server
+import urllib.parse
 from pathlib import Path
+from xml.sax.saxutils import escape
 
 import pytest
 import pandas as pd
@@ -61,3 +67,126 @@ def metadata():
     metadata = Metadata(temp, "inbox.asanchez@gmail.com", sample=1000)
     yield metadata
     shutil.rmtree(temp)
+
+
+@pytest.fixture()
+def fake_mash(monkeypatch):
+    """Install `script` as mash in `root`/bin, which is put first on PATH, and
+    return that directory. `{python}` in scripts is the path of this Python, so
+    braces in Python scripts have to be doubled."""
+
+    def install(script, root):
+        bin_ = Path(root) / "bin"
+        bin_.mkdir()
+        (bin_ / "mash").write_text(script.format(python=sys.executable))
+        (bin_ / "mash").chmod(0o755)
+        monkeypatch.setenv("PATH", "{}:{}".format(bin_, os.environ["PATH"]))
+        return bin_
+
+    return install
+
+
+class QuietHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def http_server():
+    """Start local HTTP servers in threads. Servers are made with a handler
+    class, `QuietHandler` by default, and the attributes to override on it,
+    like a `do_GET` method that answers from attributes of `self.server`.
+    They have their root URL in `url`."""
+    servers = []
+
+    def serve(handler=QuietHandler, **attributes):
+        handler = type(handler.__name__, (handler,), attributes)
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.url = "http://127.0.0.1:{}".format(server.server_port)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        servers.append(server)
+        return server
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+class FakeEntrez(QuietHandler):
+    """Answers esearch, esummary and docsum efetch requests for the records in
+    `server.db`."""
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        params = {
+            k: v[0] for k, v in urllib.parse.parse_qs(self.rfile.read(length)).items()
+        }
+        params = {k.decode(): v.decode() for k, v in params.items()}
+        util = self.path.rsplit("/", 1)[-1].replace(".fcgi", "")
+        self.server.requests.append((util, params))
+        records = self.server.db[params["db"]]
+        if util == "esearch":
+            ids = re.findall(r"[A-Z]+[0-9]+", params["term"])
+            ids = [i for i in ids if i in records]
+            self.server.history.append(ids)
+            body = (
+                "<eSearchResult><Count>{}</Count><RetMax>0</RetMax>"
+                "<QueryKey>1</QueryKey><WebEnv>{}</WebEnv></eSearchResult>"
+            ).format(len(ids), len(self.server.history) - 1)
+        elif util in ["esummary", "efetch"]:
+            ids = self.server.history[int(params["WebEnv"])]
+            start = int(params.get("retstart", 0))
+            ids = ids[start : start + int(params.get("retmax", 20))]
+            docs = "".join(records[i] for i in ids)
+            body = (
+                '<?xml version="1.0" encoding="UTF-8" ?><eSummaryResult>'
+                '<DocumentSummarySet status="OK">{}</DocumentSummarySet>'
+                "</eSummaryResult>"
+            ).format(docs)
+        else:
+            self.send_error(404)
+            return
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def biosample_docsum(accession, sra_id, strain):
+    biosample = (
+        '<BioSample accession="{0}"><Ids><Id db="BioSample">{0}</Id>'
+        '<Id db="SRA">{1}</Id></Ids><Attributes>'
+        '<Attribute harmonized_name="strain">{2}</Attribute>'
+        "</Attributes></BioSample>"
+    ).format(accession, sra_id, strain)
+    return "<DocumentSummary><SampleData>{}</SampleData></DocumentSummary>".format(
+        escape(biosample)
+    )
+
+
+def sra_docsum(biosample, runs):
+    exp_xml = "<Summary></Summary><Biosample>{}</Biosample>".format(biosample)
+    runs = "".join('<Run acc="{}" is_public="true"/>'.format(i) for i in runs)
+    doc = "<DocumentSummary><ExpXml>{}</ExpXml><Runs>{}</Runs></DocumentSummary>"
+    return doc.format(escape(exp_xml), escape(runs))
+
+
+@pytest.fixture()
+def fake_entrez(http_server):
+    """A local stand-in for the E-utilities with BioSample and SRA records for
+    the genomes in the assembly summary. Requests are recorded in `requests`."""
+    server = http_server(FakeEntrez)
+    server.requests = []
+    server.history = []
+    server.db = {"biosample": {}, "sra": {}}
+    for i, biosample in enumerate(assembly_summary.biosample.dropna().unique()):
+        sra_id = "SRS{:06d}".format(i)
+        server.db["biosample"][biosample] = biosample_docsum(biosample, sra_id, i)
+        runs = ["SRR{:06d}{}".format(i, j) for j in range(i % 3)]
+        server.db["sra"][sra_id] = sra_docsum(biosample, runs)
+    server.url += "/entrez/eutils/"
+    return server
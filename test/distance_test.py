@@ -0,0 +1,143 @@
+import os
+import json
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from genbankqc.distance import BlockedDistance, SampledDistance
+
+# Sketches are JSON lists of (name, position) and distances are differences of
+# positions. Every call is logged to calls.txt next to the script.
+FAKE_MASH = """#!{python}
+import os, sys, json
+
+log = os.path.join(os.path.dirname(__file__), "calls.txt")
+with open(log, "a") as f:
+    f.write(" ".join(sys.argv[1:3]) + "\\n")
+
+def read_list(path):
+    sketches = []
+    for line in open(path).read().split():
+        sketches += json.load(open(line))
+    return sketches
+
+if sys.argv[1] == "paste":
+    prefix, list_ = sys.argv[3:5]
+    json.dump(read_list(list_), open(prefix + ".msh", "w"))
+elif sys.argv[1] == "dist":
+    ref, query = json.load(open(sys.argv[-2])), read_list(sys.argv[-1])
+    print("\\t".join(["#query"] + [name for name, _ in ref]))
+    for name, x in query:
+        print("\\t".join([name] + [str(abs(x - y)) for _, y in ref]))
+"""
+
+
+@pytest.fixture()
+def sketches(fake_mash):
+    tmp = Path(tempfile.mkdtemp())
+    fake_mash(FAKE_MASH, tmp)
+    positions = np.random.RandomState(0).random_sample(10)
+    paths, names = [], []
+    for i, x in enumerate(positions):
+        name = "GCA_{:09d}.1".format(i)
+        path = tmp / (name + ".msh")
+        path.write_text(json.dumps([[name, x]]))
+        paths.append(path)
+        names.append(name)
+    expected = np.abs(positions[:, None] - positions[None, :])
+    yield tmp, paths, names, expected
+    shutil.rmtree(tmp)
+
+
+def calls(tmp):
+    with open(tmp / "bin" / "calls.txt") as f:
+        return [line.split()[0] for line in f]
+
+
+def engine(tmp, paths, names):
+    # Room for one 3x3 tile per worker: 4 blocks and 10 upper triangle pairs
+    memory = 2 * 32 * 3**2
+    return BlockedDistance(paths, names, tmp / "distance", memory=memory, workers=2)
+
+
+def test_blocks(sketches):
+    tmp, paths, names, expected = sketches
+    distance = engine(tmp, paths, names)
+    assert distance.block_size == 3
+    matrix = distance.run()
+    assert np.allclose(matrix, expected, atol=1e-6)
+    assert np.allclose(distance.row_means(matrix), expected.mean(axis=1))
+    assert calls(tmp).count("dist") == 10
+    assert calls(tmp).count("paste") == 4
+    assert not distance.fits_csv()
+    loaded_names, loaded = BlockedDistance.load(tmp / "distance")
+    assert loaded_names == names
+    assert np.allclose(loaded, expected, atol=1e-6)
+
+
+def test_resume(sketches):
+    tmp, paths, names, expected = sketches
+    engine(tmp, paths, names).run()
+    journal = tmp / "distance" / "done.txt"
+    lines = journal.read_text().splitlines()
+    # Pretend the run stopped after four pairs, halfway through the fifth line
+    journal.write_text("\n".join(lines[:4]) + "\n" + lines[4][:1])
+    assert BlockedDistance.load(tmp / "distance") is None
+    os.remove(tmp / "bin" / "calls.txt")
+    matrix = engine(tmp, paths, names).run()
+    assert calls(tmp).count("dist") == 6
+    assert np.allclose(matrix, expected, atol=1e-6)
+
+
+def test_changed_genomes(sketches):
+    tmp, paths, names, expected = sketches
+    engine(tmp, paths, names).run()
+    os.remove(tmp / "bin" / "calls.txt")
+    matrix = engine(tmp, paths[1:], names[1:]).run()
+    assert calls(tmp).count("dist") == 6
+    assert np.allclose(matrix, expected[1:, 1:], atol=1e-6)
+
+
+def test_sampled(sketches):
+    tmp, paths, names, expected = sketches
+    distance = SampledDistance(
+        paths, names, tmp / "sample", sample=4, memory=2 * 32 * 4 * 3, workers=2
+    )
+    assert len(distance.blocks) == 4
+    matrix = distance.run()
+    assert matrix.shape == (10, 4)
+    assert np.allclose(matrix, expected[:, distance.sampled], atol=1e-6)
+    assert np.allclose(
+        distance.row_means(matrix), expected[:, distance.sampled].mean(axis=1)
+    )
+    loaded_names, sampled, loaded = SampledDistance.load(tmp / "sample")
+    assert loaded_names == names
+    assert np.array_equal(sampled, distance.sampled)
+    sample = SampledDistance.sample_matrix(loaded, sampled)
+    assert np.allclose(sample, expected[np.ix_(sampled, sampled)], atol=1e-6)
+
+
+def test_sampled_resume(sketches):
+    tmp, paths, names, expected = sketches
+
+    def sampled():
+        memory = 2 * 32 * 4 * 3
+        return SampledDistance(
+            paths, names, tmp / "sample", sample=4, memory=memory, workers=2
+        )
+
+    sampled().run()
+    journal = tmp / "sample" / "done.txt"
+    lines = journal.read_text().splitlines()
+    # Pretend the run stopped after two blocks, halfway through the third line
+    journal.write_text("\n".join(lines[:2]) + "\n" + lines[2][:1])
+    assert SampledDistance.load(tmp / "sample") is None
+    os.remove(tmp / "bin" / "calls.txt")
+    distance = sampled()
+    matrix = distance.run()
+    assert calls(tmp) == ["dist", "dist"]
+    assert np.allclose(matrix, expected[:, distance.sampled], atol=1e-6)
+    assert SampledDistance.load(tmp / "sample") is not None
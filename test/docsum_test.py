@@ -0,0 +1,145 @@
+import gc
+import io
+import weakref
+from xml.sax.saxutils import escape
+
+import pandas as pd
+
+from genbankqc import Genome
+from genbankqc.docsum import BioSampleParser, SRARunsParser, _iterdocs
+
+BIOSAMPLE = (
+    '<BioSample access="public" accession="{acc}">'
+    "<Ids>"
+    '<Id db="BioSample" is_primary="1">{acc}</Id>'
+    '<Id db="SRA">{sra}</Id>'
+    "</Ids>"
+    "<Attributes>"
+    '<Attribute attribute_name="strain" harmonized_name="strain">{strain}</Attribute>'
+    '<Attribute attribute_name="host" harmonized_name="host">Homo sapiens</Attribute>'
+    '<Attribute attribute_name="note">ignored</Attribute>'
+    "</Attributes>"
+    "</BioSample>"
+)
+
+
+def biosample(acc, sra="SRS000001", strain="K-12"):
+    return BIOSAMPLE.format(acc=acc, sra=sra, strain=strain)
+
+
+def docsum_expanded(accessions):
+    docs = "".join(
+        "<DocumentSummary><SampleData>{}</SampleData></DocumentSummary>".format(
+            biosample(acc)
+        )
+        for acc in accessions
+    )
+    return "<DocumentSummarySet>{}</DocumentSummarySet>".format(docs)
+
+
+def docsum_escaped(accessions):
+    docs = "".join(
+        '<DocumentSummary uid="{}"><SampleData>{}</SampleData></DocumentSummary>'.format(
+            i, escape(biosample(acc))
+        )
+        for i, acc in enumerate(accessions)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" ?>'
+        '<eSummaryResult><DocumentSummarySet status="OK">{}'
+        "</DocumentSummarySet></eSummaryResult>".format(docs)
+    )
+
+
+def test_parse_string_expanded():
+    parser = BioSampleParser()
+    parser.parse_string(docsum_expanded(["SAMN1", "SAMN2"]))
+    records = list(parser.records())
+    assert len(records) == 2
+    assert records[0]["BioSample"] == "SAMN1"
+    assert records[0]["SRA"] == "SRS000001"
+    assert records[0]["strain"] == "K-12"
+    assert records[0]["host"] == "Homo sapiens"
+    assert records[0]["serovar"] is None
+
+
+def test_iterparse_escaped():
+    parser = BioSampleParser(missing="missing")
+    accessions = ["SAMN{}".format(i) for i in range(50)]
+    xml = docsum_escaped(accessions).encode()
+    rows = list(parser.iterparse(io.BytesIO(xml)))
+    assert len(rows) == len(parser) == 50
+    assert parser.data[0] == accessions
+    assert rows[0][parser.columns.index("serovar")] == "missing"
+
+
+def test_iterdocs_releases_documents():
+    xml = docsum_escaped(["SAMN{}".format(i) for i in range(20)]).encode()
+    docs = []
+    for doc in _iterdocs(io.BytesIO(xml)):
+        docs.append(weakref.ref(doc))
+        del doc
+        gc.collect()
+        # Only the document being parsed is alive, not its predecessors
+        assert sum(i() is not None for i in docs[:-1]) == 0
+    assert len(docs) == 20
+
+
+def test_malformed_sample_data():
+    parser = BioSampleParser()
+    xml = (
+        "<DocumentSummarySet>"
+        "<DocumentSummary><SampleData>&lt;BioSample</SampleData></DocumentSummary>"
+        "<DocumentSummary><Title>No sample data</Title></DocumentSummary>"
+        "</DocumentSummarySet>"
+    )
+    assert parser.parse(io.StringIO(xml)) == 0
+    assert parser.errors == 2
+
+
+def test_to_frame():
+    parser = BioSampleParser()
+    parser.parse_string(docsum_expanded(["SAMN1", "SAMN2"]))
+    df = parser.to_frame()
+    assert isinstance(df, pd.DataFrame)
+    assert df.index.tolist() == ["SAMN1", "SAMN2"]
+    assert df.loc["SAMN2", "strain"] == "K-12"
+
+
+def test_genome_parse_biosample(genome):
+    genome, handler = genome
+    genome.xml["biosample"] = docsum_expanded(["SAMN02604091"])
+    genome.parse_biosample()
+    assert isinstance(genome, Genome)
+    assert genome.metadata["sra_id"] == "SRS000001"
+    assert genome.metadata["strain"] == "K-12"
+    assert genome.metadata["serovar"] == "missing"
+
+
+def sra_docsum(biosamples):
+    docs = "".join(
+        "<DocumentSummary><ExpXml>{}</ExpXml><Runs>{}</Runs></DocumentSummary>".format(
+            escape("<Biosample>{}</Biosample>".format(acc)),
+            escape('<Run acc="SRR{0}1"/><Run acc="SRR{0}2"/>'.format(i)),
+        )
+        for i, acc in enumerate(biosamples)
+    )
+    return (
+        "<eSummaryResult><DocumentSummarySet>{}"
+        "</DocumentSummarySet></eSummaryResult>".format(docs)
+    )
+
+
+def test_sra_parse_string():
+    parser = SRARunsParser()
+    assert parser.parse_string(sra_docsum([])) == []
+    records = parser.parse_string(sra_docsum(["SAMN1", "SAMN2"]))
+    assert records == [("SAMN1", ["SRR01", "SRR02"]), ("SAMN2", ["SRR11", "SRR12"])]
+    assert parser.runs["SAMN2"] == ["SRR11", "SRR12"]
+
+
+def test_genome_parse_sra(genome):
+    genome, handler = genome
+    genome.xml["sra"] = sra_docsum(["SAMN02604091", "SAMN02604092"])
+    genome.parse_sra()
+    assert genome.metadata["srr_accessions"] == "SRR01,SRR02,SRR11,SRR12"
@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+import pandas as pd
+
+from genbankqc import Genome
+from genbankqc import Species
+from genbankqc.entrez import Client, MetadataClient
+
+assembly_summary = pd.read_csv(
+    "test/resources/metadata/assembly_summary.txt", sep="\t", index_col=0
+)
+
+
+@pytest.fixture()
+def client(fake_entrez):
+    yield MetadataClient(Client(base_url=fake_entrez.url), chunk_size=4)
+
+
+@pytest.fixture()
+def species():
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, "Buchnera_aphidicola")
+    shutil.copytree("test/resources/Buchnera_aphidicola", path)
+    yield Species(path, assembly_summary=assembly_summary)
+    shutil.rmtree(tmp)
+
+
+def test_biosamples(client, fake_entrez):
+    accessions = list(fake_entrez.db["biosample"])[:10]
+    records = client.biosamples(accessions + ["missing"])
+    assert sorted(records) == sorted(accessions)
+    assert records[accessions[0]]["SRA"] == "SRS000000"
+    searches = [i for i in fake_entrez.requests if i[0] == "esearch"]
+    assert len(searches) == 3
+    # Known records are not requested again
+    client.biosamples(accessions)
+    assert len([i for i in fake_entrez.requests if i[0] == "esearch"]) == 3
+
+
+def test_sra_runs(client, fake_entrez):
+    biosamples = list(fake_entrez.db["biosample"])[:3]
+    sra_ids = {j: "SRS{:06d}".format(i) for i, j in enumerate(biosamples)}
+    runs = client.sra_runs(sra_ids)
+    assert runs[biosamples[0]] == []
+    assert runs[biosamples[2]] == ["SRR0000020", "SRR0000021"]
+
+
+def test_species_get_metadata(client, fake_entrez, species):
+    species.get_metadata(client)
+    assert os.path.isfile(species.metadata_path)
+    assert isinstance(species.metadata, pd.DataFrame)
+    assert len(species.metadata) == species.total_genomes
+    # Requests are batched per chunk of BioSamples, not per genome
+    biosamples = {i.metadata["biosample_id"] for i in species.genomes} - {"missing"}
+    chunks = -(-len(biosamples) // client.chunk_size)
+    utils = [i[0] for i in fake_entrez.requests]
+    assert utils.count("esearch") == 2 * chunks
+    genome = species.genomes[0]
+    if genome.metadata["biosample_id"] != "missing":
+        assert genome.metadata["sra_id"].startswith("SRS")
+        assert genome.metadata["strain"] != "missing"
+
+
+def test_genome_get_metadata(client, species):
+    path = os.path.join(
+        species.path,
+        "GCA_000007365.1_Buchnera_aphidicola_Sg_Schizaphis_graminum_Complete_Genome.fasta",
+    )
+    genome = Genome(path, assembly_summary)
+    genome.get_metadata(client)
+    assert genome.metadata["BioSample"] == "SAMN02604269"
+    assert genome.metadata["sra_id"] != "missing"
+
+
+def test_load(client, fake_entrez):
+    tmp = tempfile.mkdtemp()
+    csv = os.path.join(tmp, "metadata.csv")
+    df = pd.DataFrame(
+        {"SRA": ["SRS1"], "strain": ["K-12"], "runs": ["SRR1,SRR2"]},
+        index=pd.Index(["SAMN02604269"], name="biosample"),
+    )
+    df.to_csv(csv)
+    client.load(csv)
+    records = client.biosamples(["SAMN02604269"])
+    assert records["SAMN02604269"]["strain"] == "K-12"
+    assert client.sra_runs({"SAMN02604269": "SRS1"})["SAMN02604269"] == ["SRR1", "SRR2"]
+    assert not fake_entrez.requests
+    shutil.rmtree(tmp)
+
+
+def test_for_mirror_expires_records(fake_entrez):
+    from genbankqc.cache import DAY, MetadataCache
+
+    tmp = tempfile.mkdtemp()
+    metadata_dir = os.path.join(tmp, "metadata")
+    os.mkdir(metadata_dir)
+    biosample = list(fake_entrez.db["biosample"])[0]
+    df = pd.DataFrame(
+        {"SRA": ["SRS1"], "strain": ["stale"]},
+        index=pd.Index([biosample], name="biosample"),
+    )
+    df.to_csv(os.path.join(metadata_dir, "metadata.csv"))
+    cache = MetadataCache(os.path.join(metadata_dir, "cache.sqlite"), ttl=DAY)
+    cache.put_many("biosample", {biosample: {"BioSample": biosample}}, ttl=-1)
+    client = MetadataClient.for_mirror(tmp, client=Client(base_url=fake_entrez.url))
+    records = client.biosamples([biosample])
+    assert records[biosample]["strain"] != "stale"
+    assert fake_entrez.requests
+    assert MetadataClient.for_mirror(tmp).cache is client.cache
+    client.cache.close()
+    cache.close()
+    shutil.rmtree(tmp)
@@ -0,0 +1,88 @@
+import json
+import tempfile
+from pathlib import Path
+
+import logbook
+import pytest
+from click.testing import CliRunner
+
+from genbankqc import events
+from genbankqc.__main__ import cli
+
+
+@pytest.fixture()
+def mirror():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield Path(tmp)
+
+
+def write_events(path, rows):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def test_event_handler(mirror):
+    log = logbook.Logger("Test")
+    with logbook.TestHandler() as human:
+        with events.EventHandler(mirror).applicationbound():
+            log.info("Not an event")
+            events.emit(log, "species_started", "QC started", species="A", genomes=3)
+    (path,) = mirror.glob("events*.jsonl")
+    (line,) = path.read_text().splitlines()
+    event = json.loads(line)
+    assert event["event"] == "species_started"
+    assert event["species"] == "A"
+    assert event["genomes"] == 3
+    assert event["channel"] == "Test"
+    # Events also reach the human readable log
+    assert human.has_info("QC started")
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert events.percentile(values, 50) == 50
+    assert events.percentile(values, 99) == 99
+    assert events.percentile([3.0], 90) == 3.0
+
+
+def test_summary(mirror):
+    write_events(
+        mirror / ".logs" / "events-2019-01-01.jsonl",
+        [
+            {"event": "species_skipped", "species": "A", "reason": "not enough"},
+            {"event": "stage", "species": "B", "stage": "mash_dist", "wall": 2.0},
+            {"event": "species_complete", "species": "B", "wall": 5.0, "genomes": 20},
+        ],
+    )
+    write_events(
+        mirror / "C" / ".logs" / "events.jsonl",
+        [
+            {"event": "stage", "species": "C", "stage": "mash_dist", "wall": 4.0},
+            {"event": "species_complete", "species": "C", "wall": 9.0, "genomes": 40},
+            {"event": "species_complete", "species": "B", "wall": 1.0, "genomes": 20},
+        ],
+    )
+    with (mirror / ".logs" / "events.jsonl").open("w") as f:
+        f.write("not json\n")
+    files = list(events.event_files(mirror))
+    assert len(files) == 3
+    summary = events.Summary.from_files(files)
+    assert summary.counts["species_complete"] == 3
+    assert summary.reasons["not enough"] == 1
+    assert summary.malformed == 1
+    assert summary.percentiles()["mash_dist"] == {
+        "n": 2,
+        "p50": 2.0,
+        "p90": 4.0,
+        "p99": 4.0,
+        "max": 4.0,
+    }
+    assert summary.slowest(1) == [("C", 9.0, 40)]
+    assert summary.slowest()[1] == ("B", 5.0, 20)
+
+    result = CliRunner().invoke(cli, ["log-stats", mirror.as_posix(), "--top", "1"])
+    assert result.exit_code == 0
+    assert "mash_dist" in result.output
+    assert "Slowest species:" in result.output
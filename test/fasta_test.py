@@ -0,0 +1,78 @@
+import os
+import gzip
+import shutil
+import tempfile
+
+import pytest
+from Bio import bgzf
+
+from genbankqc import Genome, fasta
+
+SPECIES = "test/resources/Buchnera_aphidicola"
+NAME = "GCA_000521565.1_Buchnera_aphidicola_G002_Myzus_persicae_Complete_Genome"
+PLAIN = os.path.join(SPECIES, NAME + ".fasta")
+
+
+@pytest.fixture(scope="module")
+def compressed():
+    """The same genome as plain, gzip and bgzip FASTA."""
+    tmp = tempfile.mkdtemp()
+    with open(PLAIN, "rb") as f:
+        data = f.read()
+    paths = {"plain": os.path.join(tmp, NAME + ".fasta")}
+    shutil.copy(PLAIN, paths["plain"])
+    paths["gzip"] = os.path.join(tmp, NAME + ".fna.gz")
+    with gzip.open(paths["gzip"], "wb") as f:
+        f.write(data)
+    paths["bgzip"] = os.path.join(tmp, "GCA_000000001.1_bgzip.fasta.gz")
+    with bgzf.BgzfWriter(paths["bgzip"], "wb") as f:
+        f.write(data)
+    yield paths
+    shutil.rmtree(tmp)
+
+
+def test_split_name():
+    assert fasta.split_name("GCA_1.1_A.fasta") == ("GCA_1.1_A", ".fasta")
+    assert fasta.split_name("GCA_1.1_A.fna.gz") == ("GCA_1.1_A", ".fna.gz")
+    assert fasta.split_name("GCA_1.1_A.csv") == ("GCA_1.1_A.csv", None)
+    assert not fasta.is_fasta("GCA_1.1_A.msh")
+
+
+def test_is_bgzf(compressed):
+    assert fasta.is_bgzf(compressed["bgzip"])
+    assert not fasta.is_bgzf(compressed["gzip"])
+    assert not fasta.is_bgzf(compressed["plain"])
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_open_fasta(compressed, threads):
+    with open(PLAIN) as f:
+        expected = f.read()
+    for path in compressed.values():
+        with fasta.open_fasta(path, threads=threads) as f:
+            assert f.read() == expected
+
+
+def test_bgzf_crc(compressed):
+    path = compressed["bgzip"] + ".corrupt"
+    with open(compressed["bgzip"], "rb") as f:
+        data = bytearray(f.read())
+    # Corrupt the CRC32 of the first block
+    bsize = data[16] + (data[17] << 8)
+    data[bsize - 7] ^= 0xFF
+    with open(path, "wb") as f:
+        f.write(data)
+    with pytest.raises(ValueError):
+        with fasta.open_fasta(path) as f:
+            f.read()
+
+
+def test_compressed_genome(compressed):
+    genome = Genome(compressed["gzip"])
+    assert genome.name == NAME
+    assert genome.sketch_file.endswith(NAME + ".msh")
+    genome.get_contigs()
+    plain = Genome(compressed["plain"])
+    plain.get_contigs()
+    assert genome.count_contigs == plain.count_contigs
+    assert str(genome.contigs[0]) == str(plain.contigs[0])
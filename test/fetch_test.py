@@ -0,0 +1,123 @@
+import gzip
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from genbankqc import Genbank
+from genbankqc.fetch import Assembly, ChecksumError, Fetcher, assemblies
+
+
+def serve_files(self):
+    """Serve `server.files` and answer range requests."""
+    self.server.requests.append((self.path, self.headers.get("Range")))
+    body = self.server.files.get(self.path)
+    if body is None:
+        self.send_error(404)
+        return
+    status = 200
+    if self.headers.get("Range"):
+        status = 206
+        body = body[int(self.headers["Range"][6:-1]) :]
+    self.send_response(status)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+def add_assembly(files, accession, species):
+    name = "{}_ASM1v1".format(accession)
+    fasta = gzip.compress(">{}\nACGT\n".format(accession).encode())
+    md5 = hashlib.md5(fasta).hexdigest()
+    files["/{}/{}_genomic.fna.gz".format(name, name)] = fasta
+    files["/{}/md5checksums.txt".format(name)] = "{}  ./{}_genomic.fna.gz\n".format(
+        md5, name
+    ).encode()
+    return (accession, species, "latest", "/" + name)
+
+
+@pytest.fixture()
+def server(http_server):
+    server = http_server(do_GET=serve_files)
+    server.requests = []
+    server.files = {}
+    rows = [
+        add_assembly(
+            server.files, "GCA_{:09d}.1".format(i), "Genus one str. {}".format(i)
+        )
+        for i in range(10)
+    ]
+    rows += [add_assembly(server.files, "GCA_000000010.1", "Genus two")]
+    summary = pd.DataFrame(
+        [(i[0], i[1], i[2], server.url + i[3]) for i in rows],
+        columns=["# assembly_accession", "organism_name", "version_status", "ftp_path"],
+    )
+    server.summary = summary.set_index("# assembly_accession")
+    return server
+
+
+@pytest.fixture()
+def tmp():
+    tmp = Path(tempfile.mkdtemp())
+    yield tmp
+    shutil.rmtree(tmp)
+
+
+def test_assembly():
+    assembly = Assembly(
+        "GCA_000007365.1",
+        "Buchnera_aphidicola",
+        "ftp://ftp.ncbi.nlm.nih.gov/genomes/all/GCA/000/007/365/GCA_000007365.1_ASM736v1",
+    )
+    assert assembly.url == (
+        "https://ftp.ncbi.nlm.nih.gov/genomes/all/GCA/000/007/365/"
+        "GCA_000007365.1_ASM736v1/GCA_000007365.1_ASM736v1_genomic.fna.gz"
+    )
+
+
+def test_species(server, tmp):
+    fetcher = Fetcher(tmp, workers=4)
+    directories = list(fetcher.species(assemblies(server.summary)))
+    assert sorted(directories) == [tmp / "Genus_one", tmp / "Genus_two"]
+    assert len(list((tmp / "Genus_one").glob("*.fna.gz"))) == 10
+    assert fetcher.downloaded == 11
+    # Downloaded genomes are not requested again
+    requests = len(server.requests)
+    assert fetcher.run(assemblies(server.summary, {"Genus_two"})) == [tmp / "Genus_two"]
+    assert len(server.requests) == requests
+
+
+def test_resume(server, tmp):
+    fetcher = Fetcher(tmp)
+    assembly = next(assemblies(server.summary))
+    path = fetcher.path(assembly)
+    path.parent.mkdir()
+    fasta = server.files["/" + assembly.url.split("/", 3)[3]]
+    Path(str(path) + ".part").write_bytes(fasta[:10])
+    assert fetcher.fetch(assembly).read_bytes() == fasta
+    assert server.requests[-1][1] == "bytes=10-"
+    assert not Path(str(path) + ".part").exists()
+
+
+def test_checksum(server, tmp):
+    fetcher = Fetcher(tmp)
+    assembly = next(assemblies(server.summary))
+    checksums = "/" + assembly.checksums_url.split("/", 3)[3]
+    server.files[checksums] = b"0" * 32 + server.files[checksums][32:]
+    with pytest.raises(ChecksumError):
+        Fetcher.fetch.__wrapped__(fetcher, assembly)
+    assert not fetcher.path(assembly).exists()
+
+
+def test_genbank_fetch(server, tmp, monkeypatch):
+    qc = []
+    monkeypatch.setattr(Genbank, "qc_species", lambda self, i: qc.append(i.name))
+    genbank = Genbank(tmp)
+    summary = type("AssemblySummary", (), {"df": server.summary})
+    directories = genbank.fetch(summary, qc=True)
+    assert len(directories) == 2
+    # Genus_two has too few genomes for QC
+    assert qc == ["Genus_one"]
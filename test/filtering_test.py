@@ -0,0 +1,85 @@
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from genbankqc import Genbank, Species
+from genbankqc.filtering import MirrorFilter
+
+SIZES = {"Genus_one": 40, "Genus_two": 25, "Genus_three": 12}
+
+
+def stats(rng, n):
+    names = ["GCA_{:09d}.1_x".format(i) for i in rng.choice(10 ** 6, n, replace=False)]
+    stats = pd.DataFrame(
+        {
+            "assembly_size": rng.normal(5e6, 2e5, n).round(),
+            "contigs": rng.choice([1, 3, 8, 11, 15, 40, 90, 400], n),
+            "distance": rng.gamma(2.0, 0.01, n),
+            "unknowns": rng.choice([0, 0, 0, 50, 250], n),
+        },
+        index=names,
+    )
+    stats.iloc[0, 2] = np.nan
+    return stats
+
+
+@pytest.fixture()
+def mirror():
+    rng = np.random.RandomState(1)
+    tmp = Path(tempfile.mkdtemp())
+    for name, n in SIZES.items():
+        species = tmp / "mirror" / name
+        (species / "qc").mkdir(parents=True)
+        species_stats = stats(rng, n)
+        for genome in species_stats.index:
+            (species / (genome + ".fasta")).write_text(">contig\nACGT\n")
+        species_stats.to_csv(species / "qc" / "stats.csv")
+    # Too many unknowns leave this species unfiltered on the other criteria
+    path = tmp / "mirror" / "Genus_three" / "qc" / "stats.csv"
+    few = pd.read_csv(path, index_col=0)
+    few.iloc[:7, 3] = 300
+    few.to_csv(path)
+    # Not a species directory
+    (tmp / "mirror" / "Genus_four" / "qc").mkdir(parents=True)
+    stats(rng, 8).to_csv(tmp / "mirror" / "Genus_four" / "qc" / "stats.csv")
+    shutil.copytree(tmp / "mirror", tmp / "species")
+    yield tmp
+    shutil.rmtree(tmp)
+
+
+@pytest.mark.parametrize("tolerances", [[200, 3.0, 3.0, 3.0], [100, 1.0, 0.5, 1.0]])
+def test_mirror_filter(mirror, tolerances):
+    keys = ["max_unknowns", "contigs", "assembly_size", "mash"]
+    tolerances = dict(zip(keys, tolerances))
+    filtered = Genbank(mirror / "mirror").filter(**tolerances)
+    assert filtered == sorted(SIZES)
+    label = MirrorFilter(**tolerances).label
+    for name in SIZES:
+        species = Species(mirror / "species" / name, **tolerances)
+        species.filter()
+        expected = Path(species.qc_results_dir)
+        actual = mirror / "mirror" / name / "qc" / label
+        for file_ in ["failed.csv", "qc_summary.txt"]:
+            assert (actual / file_).read_text() == (expected / file_).read_text()
+        with (actual / "allowed.p").open("rb") as a, (expected / "allowed.p").open(
+            "rb"
+        ) as e:
+            assert pickle.load(a) == pickle.load(e)
+
+
+def test_mirror_filter_results(mirror):
+    from genbankqc.results import ResultsDB
+
+    genbank = Genbank(mirror / "mirror")
+    genbank.filter(only={"Genus_two"})
+    db = ResultsDB(genbank.paths.metadata / "qc_results.db")
+    rows = db.species("Genus_two")
+    assert len(rows) == SIZES["Genus_two"]
+    assert {i["species"] for i in rows} == {"Genus_two"}
+    assert not (mirror / "mirror" / "Genus_one" / "qc" / "200-3.0-3.0-3.0").exists()
+    db.close()
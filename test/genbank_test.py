@@ -8,6 +8,7 @@ import pandas as pd
 
 from genbankqc import Genbank
 from genbankqc import Species
+from genbankqc.metadata import partition
 
 
 @pytest.fixture()
@@ -23,6 +24,25 @@ def test_genbank_init(genbank):
         assert isinstance(i, Species)
 
 
+def test_accessions_skip_unnamed(genbank_bare):
+    species = genbank_bare.root / "Genus_one"
+    species.mkdir()
+    for i in range(10):
+        (species / "GCA_{:09d}.1_x.fasta".format(i)).write_text(">contig\nACGT\n")
+    (species / "GCA_draft.fasta").write_text(">contig\nACGT\n")
+    accessions = genbank_bare.accessions()
+    assert len(accessions) == 10
+    assert set(accessions.values()) == {species.absolute()}
+
+
+def test_info(genbank_bare):
+    species = genbank_bare.root / "Genus_one"
+    species.mkdir()
+    (species / "GCA_000000001.1_x.fna").write_text(">contig\nACGT\n")
+    info = genbank_bare.info().splitlines()
+    assert info[info.index("*.fna:") + 1].split() == ["1", "existing", "files"]
+
+
 # def test_qc(genbank):
 #     genbank.qc()
 
@@ -34,3 +54,28 @@ def test_species_metadata(genbank):
     for species in genbank.species():
         assert isinstance(species.metadata, pd.DataFrame)
         assert os.path.isfile(species.metadata_path)
+
+
+class JoinedMetadata:
+    def __init__(self, joined):
+        self.joined = joined
+
+    def partition(self, species):
+        return partition(self.joined, species)
+
+
+def test_partition_metadata(genbank):
+    summary = pd.read_csv(
+        "test/resources/metadata/assembly_summary.txt", sep="\t", index_col=0
+    )
+    joined = summary.reset_index()[["biosample", "# assembly_accession", "taxid"]]
+    joined = joined.set_index("biosample")
+    accessions = genbank.accessions()
+    assert len(accessions) == 9
+    written = genbank.species_metadata(JoinedMetadata(joined))
+    aphidicola = genbank.root / "Buchnera_aphidicola"
+    metadata_path = aphidicola / "qc" / "Buchnera_aphidicola_metadata.csv"
+    metadata = pd.read_csv(metadata_path, index_col=0)
+    assert written[aphidicola] == len(metadata)
+    expected = [i for i in joined["# assembly_accession"] if i in accessions]
+    assert sorted(metadata["# assembly_accession"]) == sorted(expected)
@@ -111,3 +111,43 @@ def test_get_stats(genome, aphidicola):
 #     genome, handler = genome
 #     ecoli_genome.get_metadata()
 #     genome.get_metadata()
+
+
+def test_genome_table(aphidicola):
+    from genbankqc.genome import GenomeTable
+
+    table = GenomeTable.from_directory(aphidicola.path)
+    assert len(table) == 10
+    assert sorted(table.index) == sorted(i.name for i in table)
+    assert "missing" in list(table.accessions)
+    for row, path in zip(table, table.paths):
+        genome = Genome(path)
+        assert row.name == genome.name
+        assert row.accession_id == genome.accession_id
+        assert row.sketch_file == genome.sketch_file
+        assert row.stats_file == genome.stats_file
+        assert row.size == os.path.getsize(path)
+    assert not table._genomes
+    genomes = table.genomes
+    assert isinstance(genomes[-1], Genome)
+    assert genomes[-1] is table[9].genome()
+    assert genomes[-1].path == table.paths[-1]
+    assert len(table._genomes) == 1
+    assert len(list(genomes)) == 10
+    with pytest.raises(IndexError):
+        table[10]
+
+
+def test_assembly_summary_object(aphidicola):
+    from types import SimpleNamespace
+
+    from logbook import TestHandler
+
+    path = aphidicola.genomes[0].path
+    handler = TestHandler()
+    with handler:
+        genome = Genome(path, SimpleNamespace(df=assembly_summary))
+        Genome(path, object())
+    expected = assembly_summary.loc[genome.accession_id].biosample
+    assert genome.metadata["biosample_id"] == expected
+    assert not handler.has_errors
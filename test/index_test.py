@@ -0,0 +1,92 @@
+import os
+import json
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+from genbankqc.__main__ import cli
+from genbankqc.index import SketchIndex
+
+# `mash info -d` prints a sketch as JSON, test sketches already are JSON
+FAKE_MASH = """#!/bin/sh
+cat "$3"
+"""
+
+
+def write_sketch(path, hashes):
+    sketch = {"kmer": 21, "sketches": [{"name": path.name, "hashes": hashes}]}
+    path.write_text(json.dumps(sketch))
+
+
+def write_species(root, name, pool, rng, genomes=10, outlier_pool=None):
+    qc_dir = root / name / "qc"
+    qc_dir.mkdir(parents=True)
+    for i in range(genomes):
+        genome = "GCA_{:09d}.1_{}".format(i, name)
+        (root / name / (genome + ".fasta")).write_text(">contig\nACGT\n")
+        source = outlier_pool if outlier_pool is not None and i == 0 else pool
+        hashes = rng.choice(source, 800, replace=False)
+        write_sketch(qc_dir / (genome + ".msh"), sorted(int(h) for h in hashes))
+
+
+@pytest.fixture()
+def mirror(fake_mash):
+    tmp = Path(tempfile.mkdtemp())
+    fake_mash(FAKE_MASH, tmp)
+    root = tmp / "genbank"
+    rng = np.random.RandomState(0)
+    pools = {name: rng.randint(0, 2**62, 1000) for name in "ABC"}
+    write_species(root, "A", pools["A"], rng, outlier_pool=pools["B"])
+    write_species(root, "B", pools["B"], rng)
+    write_species(root, "C", pools["C"], rng)
+    yield root
+    shutil.rmtree(tmp)
+
+
+def test_nearest(mirror):
+    index = SketchIndex(mirror, representatives=2)
+    changes = index.update()
+    assert changes["added"] == ["A", "B", "C"]
+    sketch = mirror / "C" / "qc" / "GCA_000000005.1_C.msh"
+    nearest = index.query(sketch, k=2)
+    assert nearest[0][0] == "C"
+    assert nearest[0][1] > 0.5
+    assert nearest[1][1] < 0.1
+
+
+def test_incremental(mirror):
+    index = SketchIndex(mirror)
+    index.update()
+    assert not any(SketchIndex(mirror).update().values())
+    shutil.rmtree(mirror / "C")
+    sketch = mirror / "B" / "qc" / "GCA_000000009.1_B.msh"
+    write_sketch(sketch, [1, 2, 3])
+    os.utime(sketch, ns=(0, 0))
+    changes = SketchIndex(mirror).update()
+    assert changes == {"added": [], "updated": ["B"], "removed": ["C"]}
+    assert list(SketchIndex(mirror).load().species) == ["A", "B"]
+
+
+def test_mislabeled(mirror):
+    index = SketchIndex(mirror)
+    results = index.query_species(mirror / "A")
+    assert len(results) == 10
+    outlier = "GCA_000000000.1_A"
+    assert results.loc[outlier, "nearest"] == "B"
+    assert results.mislabeled.tolist() == [True] + [False] * 9
+    mislabeled = index.mislabeled()
+    assert mislabeled.index.tolist() == [outlier]
+
+
+def test_cli(mirror):
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ["index", mirror.as_posix(), "-q", (mirror / "A").as_posix(), "--flag"]
+    )
+    assert result.exit_code == 0
+    assert "3 added" in result.output
+    assert (mirror / "metadata" / "mislabeled.csv").is_file()
@@ -0,0 +1,59 @@
+import os
+import multiprocessing
+
+import logbook
+import pytest
+from logbook import Logger, TestHandler
+
+from genbankqc import logs
+
+
+def work(species):
+    with logs.worker(species):
+        Logger("GCA_000000001.1").error(f"From a worker of {species}")
+    return os.getpid()
+
+
+@pytest.fixture()
+def listener():
+    listener = logs.listen()
+    yield listener
+    assert listener.flush()
+
+
+def test_worker_records_are_routed(listener):
+    species_a, species_b, unrouted = TestHandler(), TestHandler(), TestHandler()
+    with unrouted.applicationbound():
+        with logs.route("Genus_a", species_a), logs.route("Genus_b", species_b):
+            pool = multiprocessing.get_context("fork").Pool(2)
+            try:
+                pids = pool.map(work, ["Genus_a", "Genus_b", "Genus_c"] * 3)
+            finally:
+                pool.close()
+                pool.join()
+            logs.flush()
+    assert os.getpid() not in pids
+    assert len(species_a.records) == len(species_b.records) == 3
+    assert {i.extra["species"] for i in species_a.records} == {"Genus_a"}
+    assert species_b.has_error("From a worker of Genus_b", channel="GCA_000000001.1")
+    assert len(unrouted.records) == 3
+    assert unrouted.has_error("From a worker of Genus_c")
+
+
+def test_worker_in_parent(listener):
+    handler = TestHandler()
+    with handler.applicationbound():
+        assert work("Genus_a") == os.getpid()
+    assert handler.has_error("From a worker of Genus_a")
+    assert "species" not in handler.records[0].extra
+
+
+def test_listener_survives_bad_records():
+    listener = logs.Listener().start()
+    handler = TestHandler()
+    with handler.applicationbound():
+        listener.queue.put({"not": "a record"})
+        record = logbook.LogRecord("channel", logbook.INFO, "after")
+        listener.queue.put(record.to_dict(json_safe=True))
+        listener.stop()
+    assert handler.has_info("after")
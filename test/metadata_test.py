@@ -1,11 +1,14 @@
 import os
+import json
 import shutil
 import tempfile
 from pathlib import Path
 
 import pytest
 import pandas as pd
-from genbankqc import AssemblySummary, BioSample
+from genbankqc import AssemblySummary, BioSample, Metadata
+from genbankqc.metadata import SRA
+from genbankqc.entrez import Client
 
 
 def test_existing_assembly_summary():
@@ -41,6 +44,20 @@ def test_biosample(biosample):
     assert biosample.paths.sra_ids.is_file()
 
 
+def test_biosample_efetch(fake_entrez):
+    temp = Path(tempfile.mkdtemp())
+    client = Client(base_url=fake_entrez.url)
+    biosample = BioSample(temp, "inbox.asanchez@gmail.com", client=client)
+    accessions = sorted(fake_entrez.db["biosample"])[:5]
+    biosample._esearch(term=" OR ".join(accessions))
+    biosample._efetch()
+    df = biosample.parser.to_frame()
+    assert sorted(df.index) == accessions
+    assert [i[0] for i in fake_entrez.requests] == ["esearch", "efetch"]
+    assert fake_entrez.requests[1][1]["tool"] == "genbankqc"
+    shutil.rmtree(temp)
+
+
 @pytest.mark.skipif(
     "TRAVIS" in os.environ and os.environ["TRAVIS"] == "true",
     reason="Reading data into pandas directly from URL fails",
@@ -49,7 +66,89 @@ def test_Metadata(metadata):
     assert metadata.biosample.paths.raw.is_file()
     assert metadata.biosample.paths.sra_ids.is_file()
     assert metadata.sra.paths.runs.is_file()
-    assert metadata.sra.id_files
+    assert isinstance(metadata.sra.run_lists, dict)
     assert isinstance(metadata.sra.runs, pd.DataFrame)
     assert metadata.csv.is_file()
     assert isinstance(metadata.joined, pd.DataFrame)
+
+
+@pytest.fixture()
+def sra(fake_entrez):
+    temp = Path(tempfile.mkdtemp())
+    yield SRA(temp, client=Client(base_url=fake_entrez.url), chunk_size=4)
+    shutil.rmtree(temp)
+
+
+def sra_ids(fake_entrez, n):
+    """The SRA IDs of the first `n` BioSamples of `fake_entrez`."""
+    biosamples = list(fake_entrez.db["biosample"])[:n]
+    return pd.Series(["SRS{:06d}".format(i) for i in range(n)], index=biosamples)
+
+
+def test_sra_fetch(sra, fake_entrez):
+    ids = sra_ids(fake_entrez, 10)
+    ids["SAMN_MISSING"] = "SRS999999"
+    run_lists = sra.fetch(ids)
+    assert len(run_lists) == 11
+    assert run_lists["SAMN_MISSING"] == []
+    assert run_lists[ids.index[1]] == ["SRR0000010"]
+    assert sra.malformed == 0
+    assert not sra.paths.progress.exists()
+
+
+def test_sra_fetch_resume(sra, fake_entrez):
+    ids = sra_ids(fake_entrez, 8)
+    # Pretend an interrupted run got the first four BioSamples, chunked differently
+    done = {i: ["SRR_DONE"] for i in ids.index[:4]}
+    with open(sra.paths.progress, "w") as f:
+        f.write(json.dumps({"runs": done, "malformed": 2}) + "\n")
+        f.write('{"runs": {"SAMN_PARTIAL')
+    run_lists = sra.fetch(ids[1:])
+    assert all(run_lists[i] == ["SRR_DONE"] for i in ids.index[1:4])
+    assert ids.index[0] not in run_lists
+    assert sra.malformed == 2
+    # The other four IDs fit in one chunk
+    assert len(fake_entrez.requests) == 2
+
+
+def test_sra_update(sra, fake_entrez):
+    biosamples = list(fake_entrez.db["biosample"])[:6]
+    df = pd.DataFrame(
+        {"SRA": ["SRS{:06d}".format(i) for i in range(6)]},
+        index=pd.Index(biosamples, name="BioSample"),
+    )
+    df.iloc[0, 0] = None
+    sra.update(type("BioSample", (), {"df": df}))
+    assert sra.paths.runs.is_file()
+    assert set(sra.run_lists) == set(biosamples[1:])
+    assert sra.runs.loc[biosamples[2], "runs"] == ",".join(sra.run_lists[biosamples[2]])
+    assert SRA(sra.path).run_lists == sra.run_lists
+
+
+def test_join_duplicates():
+    temp = Path(tempfile.mkdtemp())
+    metadata = object.__new__(Metadata)
+    metadata.csv = temp / "metadata.csv"
+    index = pd.Index(["SAMN1", "SAMN1", "SAMN2"], name="BioSample")
+    biosample = pd.DataFrame({"SRA": ["SRS0", "SRS1", "SRS2"]}, index=index)
+    metadata.biosample = type("BioSample", (), {"df": biosample})
+    runs = pd.DataFrame({"runs": ["SRR1", "SRR1"]}, index=["SAMN1", "SAMN1"])
+    metadata.sra = type("SRA", (), {"runs": runs})
+    summary = pd.DataFrame(
+        {"biosample": ["SAMN1", "SAMN1", "SAMN2", None]},
+        index=pd.Index(["GCA_1.1", "GCA_2.1", "GCA_3.1", "GCA_4.1"]),
+    )
+    summary.index.name = "# assembly_accession"
+    metadata.assembly_summary = type("AssemblySummary", (), {"df": summary})
+    metadata._join()
+    joined = metadata.joined
+    assert sorted(joined["# assembly_accession"]) == ["GCA_1.1", "GCA_2.1", "GCA_3.1"]
+    assert joined.loc["SAMN1", "SRA"].tolist() == ["SRS1", "SRS1"]
+    assert metadata.csv.is_file()
+    species = {"GCA_1.1": temp / "a", "GCA_2.1": temp / "b", "GCA_3.1": temp / "a"}
+    for dir_ in set(species.values()):
+        dir_.mkdir()
+    written = metadata.partition(species)
+    assert written == {temp / "a": 2, temp / "b": 1}
+    assert (temp / "b" / "qc" / "b_metadata.csv").is_file()
+    shutil.rmtree(temp)
@@ -0,0 +1,100 @@
+import gzip
+import time
+import shutil
+import tempfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from genbankqc.ncbi import NCBIError, Session, TokenBucket
+
+
+def echo_path(self):
+    """Fail the first `server.failures` requests with 503 and echo the path of
+    the others, gzipped for clients that accept it."""
+    self.server.requests.append((self.client_address, self.path))
+    if self.server.failures:
+        self.server.failures -= 1
+        self.send_response(503)
+        self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return
+    body = self.path.encode()
+    gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+    if gzipped:
+        body = gzip.compress(body)
+    self.send_response(200)
+    if gzipped:
+        self.send_header("Content-Encoding", "gzip")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+@pytest.fixture()
+def server(http_server):
+    # Keep connections alive
+    server = http_server(do_GET=echo_path, protocol_version="HTTP/1.1")
+    server.requests = []
+    server.failures = 0
+    server.url += "/eutils"
+    return server
+
+
+def test_keep_alive(server):
+    session = Session(api_key="key", email="user@example.com")
+    for i in range(5):
+        body = session.get(server.url, id=i)
+        assert body.decode().startswith("/eutils?id={}&tool=genbankqc".format(i))
+    assert "api_key=key" in body.decode()
+    # All requests reused one connection
+    assert len({i[0] for i in server.requests}) == 1
+    session.close()
+
+
+def test_retry(server):
+    session = Session(backoff=0, retries=3)
+    server.failures = 2
+    assert session.get(server.url)
+    assert len(server.requests) == 3
+    server.failures = 3
+    with pytest.raises(NCBIError) as error:
+        session.get(server.url)
+    assert error.value.status == 503
+
+
+class Clock(object):
+    time = 100.0
+
+    def __call__(self):
+        return self.time
+
+
+def test_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(10, burst=2, clock=clock)
+    assert [bucket.reserve() for i in range(4)] == pytest.approx([0, 0, 0.1, 0.2])
+    clock.time += 1
+    assert bucket.reserve() == 0
+
+
+def test_shared_token_bucket():
+    tmp = Path(tempfile.mkdtemp())
+    clock = Clock()
+    # Buckets of separate processes share their state through the file
+    buckets = [TokenBucket(4, path=tmp / "bucket", clock=clock) for i in range(2)]
+    with ThreadPoolExecutor(4) as executor:
+        waits = sorted(executor.map(lambda i: buckets[i % 2].reserve(), range(8)))
+    assert waits == pytest.approx([i / 4 for i in range(8)])
+    shutil.rmtree(tmp)
+
+
+def test_rate_limit(server):
+    session = Session(rate=20)
+    start = time.time()
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda i: session.get(server.url), range(4)))
+    assert len(server.requests) == 4
+    assert time.time() - start >= 0.15
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+from ete3 import Tree
+from scipy.cluster.hierarchy import weighted
+from scipy.spatial.distance import pdist, squareform
+from skbio.tree import TreeNode
+
+from genbankqc import phylogeny
+
+POSITIONS = {
+    "GCA_000000001.1": 0.0,
+    "GCA_000000002.1": 0.01,
+    "GCA_000000003.1": 0.05,
+    "GCA_000000004.1": 0.3,
+    "GCA_000000005.1": 0.32,
+    "GCA_000000006.1": 0.6,
+    "GCA_000000007.1": 0.61,
+    "GCA_000000008.1": 0.9,
+    "GCA_000000009.1": 0.95,
+    "GCA_000000010.1": 0.97,
+}
+
+
+def distances(names):
+    points = np.array([[POSITIONS[i]] for i in names])
+    return pd.DataFrame(squareform(pdist(points)), index=names, columns=names)
+
+
+def build(dmx):
+    ids = [phylogeny.leaf_name(i) for i in dmx.index]
+    linkage = weighted(squareform(dmx.values, checks=False))
+    return Tree(str(TreeNode.from_linkage_matrix(linkage, ids)).replace("'", ""))
+
+
+def rows(dmx):
+    def rows(names):
+        assert len(names) < len(dmx)
+        return dmx.loc[names]
+
+    return rows
+
+
+@pytest.fixture()
+def tree():
+    return build(distances(sorted(POSITIONS)[:-1]))
+
+
+def test_heights(tree):
+    heights = phylogeny.heights(tree)
+    assert heights[tree] > 0
+    for leaf in tree.get_leaves():
+        assert heights[leaf] == 0
+        assert tree.get_distance(leaf) == pytest.approx(heights[tree])
+
+
+def test_update(tree):
+    names = sorted(POSITIONS)[1:]
+    updated = phylogeny.update(tree, names, rows(distances(names)), 0.5)
+    leaves = [phylogeny.genome_name(i) for i in updated.get_leaf_names()]
+    assert sorted(leaves) == names
+    (leaf,) = updated.get_leaves_by_name(phylogeny.leaf_name(names[-1]))
+    sisters = [phylogeny.genome_name(i) for i in leaf.up.get_leaf_names()]
+    assert "GCA_000000009.1" in sisters
+    assert "GCA_000000004.1" not in sisters
+    # Placed halfway to its nearest leaf
+    assert leaf.dist == pytest.approx(0.01)
+
+
+def test_update_above_root(tree):
+    names = sorted(POSITIONS)[:-1]
+    far = "GCA_000000099.1"
+    dmx = distances(names)
+    dmx.loc[far] = 2.0
+    dmx[far] = 2.0
+    dmx.loc[far, far] = 0.0
+    updated = phylogeny.update(tree, list(dmx.index), rows(dmx), 0.5)
+    assert set(updated.children) & set(updated.get_leaves_by_name(far + ".fasta"))
+    assert len(updated) == len(names) + 1
+
+
+def test_update_rebuild(tree):
+    names = sorted(POSITIONS)[1:]
+    dmx = distances(names)
+    assert phylogeny.update(tree, names, rows(dmx), 0.1) is None
+    assert phylogeny.update(tree, names, rows(dmx), 0) is None
+
+
+def test_genome_name():
+    assert phylogeny.genome_name("GCA_000000001.1_xfasta.fasta") == (
+        "GCA_000000001.1_xfasta"
+    )
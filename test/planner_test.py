@@ -0,0 +1,120 @@
+import gzip
+import json
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from genbankqc import Species
+from genbankqc.planner import COMPRESSION_RATIO, Planner, genome_bytes
+
+GiB = 1024 ** 3
+MB = 1000 ** 2
+
+
+def test_small_species():
+    plan = Planner(4 * GiB, cpus=4).plan([5 * MB] * 20)
+    assert plan.summary() == {
+        "distances": "dense",
+        "stats": "parallel",
+        "tree": "dense",
+        "render": "full",
+    }
+    assert plan["stats"].params["workers"] == 4
+    assert plan.memory <= 4 * GiB
+
+
+def test_large_species():
+    plan = Planner(1 * GiB, cpus=4).plan([5 * MB] * 40000)
+    assert plan["distances"].strategy == "blocked"
+    assert plan["tree"].strategy == "sampled"
+    assert plan["tree"].params["leaves"] < 40000
+    assert plan["render"].strategy == "skip"
+    assert plan.memory <= 1 * GiB
+    # Genomes that barely fit limit the number of stats workers
+    plan = Planner(1 * GiB, cpus=4).plan([100 * MB] * 20)
+    assert plan["stats"].params["workers"] == 2
+
+
+def test_time_budget():
+    planner = Planner(4 * GiB, seconds=60, cpus=1)
+    distances = planner.distances(40000)
+    assert distances.strategy == "sampled"
+    assert distances.params["sample"] == 1500
+    assert distances.seconds <= 60
+    assert planner.distances(1000).strategy == "dense"
+    plan = planner.plan([5 * MB] * 40000)
+    assert plan["tree"].params["leaves"] == 1500
+
+
+def test_genome_bytes():
+    tmp = Path(tempfile.mkdtemp())
+    try:
+        plain = tmp / "genome.fasta"
+        plain.write_text(">contig\n" + "ACGT" * 1000 + "\n")
+        compressed = tmp / "genome.fasta.gz"
+        with gzip.open(str(compressed), "wb") as f:
+            f.write(plain.read_bytes())
+        assert genome_bytes(str(plain)) == plain.stat().st_size
+        expected = int(compressed.stat().st_size * COMPRESSION_RATIO)
+        assert genome_bytes(str(compressed)) == expected
+    finally:
+        shutil.rmtree(tmp)
+
+
+@pytest.fixture()
+def species():
+    tmp = Path(tempfile.mkdtemp())
+    path = tmp / "Species_name"
+    path.mkdir()
+    for i in range(8):
+        (path / "GCA_{:09d}.1_x.fasta".format(i)).write_text(">contig\nACGT\n")
+    yield Species(str(path))
+    shutil.rmtree(tmp)
+
+
+def test_sampled_tree(species):
+    positions = np.random.RandomState(0).random_sample(8)
+    names = [i.name for i in species.genomes]
+    dmx = np.abs(positions[:, None] - positions[None, :])
+    species.dmx = pd.DataFrame(dmx, index=names, columns=names)
+    species.plan["tree"].params["leaves"] = 5
+    species.get_tree()
+    assert len(species.tree.get_leaf_names()) == 5
+    assert Path(species.nw_path).is_file()
+
+
+def test_load_blocked_distances(species):
+    positions = np.random.RandomState(0).random_sample(8)
+    names = [i.name for i in species.genomes]
+    dmx = np.abs(positions[:, None] - positions[None, :]).astype(np.float32)
+    path = Path(species.distance_dir)
+    path.mkdir(parents=True)
+    np.save(str(path / "dmx.npy"), dmx)
+    (path / "manifest.json").write_text(json.dumps({"names": names, "block_size": 8}))
+    (path / "done.txt").write_text("0 0\n")
+    species.load_distances()
+    assert np.allclose(species.dmx_mean[names], dmx.mean(axis=1))
+
+
+def test_tree_update_reads_new_rows(species, monkeypatch):
+    positions = np.random.RandomState(0).random_sample(8)
+    names = [i.name for i in species.genomes]
+    dmx = pd.DataFrame(
+        np.abs(positions[:, None] - positions[None, :]), index=names, columns=names
+    )
+    species.dmx = dmx.iloc[:7, :7]
+    species.get_tree()
+    species.dmx = dmx
+    species.tree_rebuild = 0.5
+    read = []
+    distance_rows = species.distance_rows
+    monkeypatch.setattr(
+        species, "distance_rows", lambda i: read.append(i) or distance_rows(i)
+    )
+    species.get_tree()
+    assert read == [[names[7]]]
+    assert len(species.tree) == 8
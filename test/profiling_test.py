@@ -0,0 +1,79 @@
+import json
+import tempfile
+
+import pytest
+
+from genbankqc import profiling
+
+
+class Stages(object):
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    @profiling.stage
+    def read(self, path):
+        with open(path, "rb") as f:
+            return len(f.read())
+
+    @profiling.stage
+    def fail(self):
+        raise ValueError("broken")
+
+
+@pytest.fixture()
+def profiler():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield profiling.Profiler(tmp, "Species_name")
+
+
+def records(profiler):
+    with profiler.records_path.open() as f:
+        return [json.loads(line) for line in f]
+
+
+def test_stage_outside_run(profiler):
+    stages = Stages(profiler)
+    assert stages.read(__file__)
+    assert not profiler.records_path.exists()
+
+
+def test_run(profiler):
+    stages = Stages(profiler)
+    with profiler.run(genomes=3):
+        size = stages.read(__file__)
+        with pytest.raises(ValueError):
+            stages.fail()
+    (record,) = records(profiler)
+    assert record["species"] == "Species_name"
+    assert record["genomes"] == 3
+    assert record["status"] == "ok"
+    read, fail = record["stages"]
+    assert read["stage"] == "read"
+    assert read["error"] is None
+    assert read["wall"] >= 0
+    assert read["peak_rss_mb"] > 0
+    if read["bytes_read"] is not None:
+        assert read["bytes_read"] >= size
+    assert fail["error"] == "ValueError: broken"
+    assert "profile" not in read
+
+
+def test_run_failed(profiler):
+    with pytest.raises(RuntimeError):
+        with profiler.run():
+            raise RuntimeError("stop")
+    (record,) = records(profiler)
+    assert record["status"] == "failed"
+    assert record["error"] == "RuntimeError: stop"
+
+
+def test_profile_threshold(profiler):
+    profiler.threshold = 0
+    with profiler.run():
+        Stages(profiler).read(__file__)
+    (record,) = records(profiler)
+    path = record["stages"][0]["profile"]
+    assert path.startswith(str(profiler.profiles_dir))
+    import pstats
+
+    assert pstats.Stats(path).total_calls
@@ -0,0 +1,74 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+
+from genbankqc import Species
+from genbankqc.__main__ import cli
+from genbankqc.results import ResultsDB
+
+
+@pytest.fixture()
+def mirror():
+    tmp = Path(tempfile.mkdtemp())
+    species = tmp / "Species_name"
+    (species / "qc").mkdir(parents=True)
+    names = ["GCA_{:09d}.1_x".format(i) for i in range(10)]
+    for name in names:
+        (species / (name + ".fasta")).write_text(">contig\nACGT\n")
+    stats = pd.DataFrame(
+        {
+            "contigs": [20, 21, 22, 23, 24, 25, 26, 27, 28, 29],
+            "assembly_size": [1000] * 10,
+            "unknowns": [0] * 9 + [500],
+            "distance": [0.01] * 8 + [0.5, 0.01],
+        },
+        index=names,
+    )
+    stats.to_csv(species / "qc" / "stats.csv")
+    yield tmp
+    shutil.rmtree(tmp)
+
+
+def test_filter(mirror):
+    db_path = mirror / "metadata" / "qc_results.db"
+    db_path.parent.mkdir()
+    species = Species(str(mirror / "Species_name"), results=db_path)
+    species.filter()
+    db = ResultsDB(db_path)
+    (unknowns,) = db.lookup("GCA_000000009.1")
+    assert unknowns["status"] == "failed"
+    assert unknowns["criterion"] == "unknowns"
+    assert unknowns["unknowns"] == 500
+    (distance,) = db.lookup("GCA_000000008.1_x", label=species.label)
+    assert distance["criterion"] == "distance"
+    assert db.lookup("GCA_000000000.1")[0]["status"] == "passed"
+    counts = {(i["status"], i["criterion"]): i["genomes"] for i in db.counts()}
+    assert counts == {
+        ("failed", "distance"): 1,
+        ("failed", "unknowns"): 1,
+        ("passed", None): 8,
+    }
+    thresholds = {i["criterion"]: i for i in db.thresholds("Species_name")}
+    assert thresholds["unknowns"]["allowed"] == "200"
+    assert thresholds["distance"]["filtered"] == 1
+    # A rerun replaces the results of the species and label
+    species.stats = species.stats.drop("GCA_000000000.1_x")
+    species.filter()
+    assert db.lookup("GCA_000000000.1") == []
+    assert len(db.species("Species_name")) == 9
+    db.close()
+
+
+def test_rebuild(mirror):
+    Species(str(mirror / "Species_name")).filter()
+    runner = CliRunner()
+    result = runner.invoke(cli, ["results", mirror.as_posix(), "--rebuild"])
+    assert result.exit_code == 0
+    assert "Imported 1 species results" in result.output
+    assert "failed (unknowns)" in result.output
+    result = runner.invoke(cli, ["results", mirror.as_posix(), "GCA_000000008.1"])
+    assert result.output.split("\t")[3:] == ["failed", "distance\n"]
@@ -0,0 +1,101 @@
+import os
+import json
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from genbankqc.sketch import CombinedSketch, Sketcher
+
+# Sketches are JSON lists of the names of the FASTAs in them. FASTAs containing
+# "bad" fail like a corrupt file. Every call is logged to calls.txt.
+FAKE_MASH = """#!{python}
+import os, sys, json
+
+args = sys.argv[1:]
+
+def option(name):
+    return args[args.index(name) + 1] if name in args else None
+
+def read_list(path):
+    return open(path).read().split()
+
+with open(os.path.join(os.path.dirname(__file__), "calls.txt"), "a") as f:
+    listed = read_list(args[-1]) if "-l" in args and args[0] == "paste" else None
+    f.write(json.dumps({{"args": args, "list": listed}}) + "\\n")
+
+if args[0] == "sketch":
+    path = args[1]
+    if "bad" in open(path).read():
+        sys.stderr.write("ERROR: Could not parse {{}}\\n".format(path))
+        sys.exit(1)
+    sys.stderr.write("Sketching {{}}...\\n".format(path))
+    json.dump([os.path.basename(path)], open(option("-o") + ".msh", "w"))
+elif args[0] == "paste":
+    names = []
+    for path in read_list(args[3]):
+        names += json.load(open(path))
+    json.dump(names, open(args[2] + ".msh", "w"))
+"""
+
+
+@pytest.fixture()
+def genomes(fake_mash):
+    tmp = Path(tempfile.mkdtemp())
+    fake_mash(FAKE_MASH, tmp)
+    (tmp / "qc").mkdir()
+    paths = []
+    for i in range(4):
+        path = tmp / "GCA_{:09d}.1.fasta".format(i)
+        path.write_text(">contig\n{}\n".format("bad" if i == 3 else "ACGT"))
+        paths.append(path)
+    yield tmp, paths
+    shutil.rmtree(tmp)
+
+
+def calls(tmp):
+    path = tmp / "bin" / "calls.txt"
+    if not path.is_file():
+        return []
+    with path.open() as f:
+        return [json.loads(line) for line in f]
+
+
+def read(path):
+    with open(str(path)) as f:
+        return json.load(f)
+
+
+def test_sketch_each(genomes):
+    tmp, paths = genomes
+    outputs = {i: tmp / "qc" / (i.stem + ".msh") for i in paths}
+    failures = Sketcher(threads=2).sketch_each(outputs)
+    assert list(failures) == [paths[3]]
+    assert failures[paths[3]] == "ERROR: Could not parse {}".format(paths[3])
+    for path in paths[:3]:
+        assert read(outputs[path]) == [path.name]
+    assert sorted(os.listdir(tmp / "qc")) == sorted(i.stem + ".msh" for i in paths[:3])
+
+
+def test_combined(genomes):
+    tmp, paths = genomes
+    outputs = {i: tmp / "qc" / (i.stem + ".msh") for i in paths[:3]}
+    Sketcher().sketch_each(outputs)
+    sketches = {i.stem: outputs[i] for i in paths[:3]}
+    combined = CombinedSketch(tmp / "qc" / "all.msh")
+    assert combined.update(dict(list(sketches.items())[:2])) == {}
+    assert read(combined.path) == [i.name for i in paths[:2]]
+    os.remove(tmp / "bin" / "calls.txt")
+    # Only the new sketch is pasted onto the combined sketch
+    assert combined.update(sketches) == {}
+    assert read(combined.path) == [i.name for i in paths[:3]]
+    (paste,) = calls(tmp)
+    assert paste["list"] == [str(combined.path), str(outputs[paths[2]])]
+    assert combined.update(sketches) == {}
+    assert len(calls(tmp)) == 1
+    # A removed member triggers a rebuild
+    del sketches[paths[0].stem]
+    assert combined.update(sketches) == {}
+    assert read(combined.path) == [i.name for i in paths[1:3]]
+    assert sorted(combined.members) == sorted(sketches)
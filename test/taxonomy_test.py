@@ -0,0 +1,106 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from genbankqc.changes import species_directories
+from genbankqc.fetch import assemblies
+from genbankqc.taxonomy import Taxonomy
+
+NODES = [
+    (1, 1, "no rank"),
+    (2, 1, "superkingdom"),
+    (32199, 2, "genus"),
+    (9, 32199, "species"),
+    (198804, 9, "strain"),
+    (118110, 32199, "species"),
+    (561, 2, "genus"),
+    (562, 561, "species"),
+]
+NAMES = [
+    (1, "root"),
+    (2, "Bacteria"),
+    (32199, "Buchnera"),
+    (9, "Buchnera aphidicola"),
+    (198804, "Buchnera aphidicola str. Sg (Schizaphis graminum)"),
+    (118110, "Buchnera sp."),
+    (561, "Escherichia"),
+    (562, "Escherichia coli"),
+]
+MERGED = [(1637, 562)]
+
+
+def dmp(rows):
+    return "".join("\t|\t".join(map(str, i)) + "\t|\n" for i in rows).encode()
+
+
+@pytest.fixture()
+def taxdump():
+    tmp = Path(tempfile.mkdtemp())
+    path = tmp / "taxdump.tar.gz"
+    names = [(i, name, "", "scientific name") for i, name in NAMES]
+    names.append((562, "Bacillus coli", "", "synonym"))
+    files = {
+        "nodes.dmp": dmp([i + ("", 11) for i in NODES]),
+        "names.dmp": dmp(names),
+        "merged.dmp": dmp(MERGED),
+    }
+    with tarfile.open(str(path), "w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    yield path
+    shutil.rmtree(tmp)
+
+
+def test_taxonomy(taxdump):
+    taxonomy = Taxonomy.load(taxdump)
+    assert len(taxonomy) == len(NODES)
+    assert taxonomy.name(562) == taxonomy.name(1637) == "Escherichia coli"
+    assert taxonomy.name(3) is None
+    assert taxonomy.lineage(198804) == [198804, 9, 32199, 2, 1]
+    assert taxonomy.ancestor([198804, 9, 1637, 2, 3], "genus").tolist() == [
+        32199,
+        32199,
+        561,
+        0,
+        0,
+    ]
+    lca = taxonomy.lca([198804, 198804, 9, 1637, 3], [118110, 9, 198804, 9, 9])
+    assert lca.tolist() == [32199, 9, 9, 2, 0]
+    directories = taxonomy.species_directories([198804, 1637, 2])
+    assert directories.tolist() == ["Buchnera_aphidicola", "Escherichia_coli", None]
+
+
+def test_cache(taxdump):
+    taxonomy = Taxonomy.load(taxdump)
+    cache = taxdump.with_name("taxonomy.npz")
+    assert cache.is_file()
+    os.utime(str(taxdump), (0, 0))
+    cached = Taxonomy.load(taxdump)
+    assert cached.ranks == taxonomy.ranks
+    for name in ["parent", "rank", "names", "offsets", "merged", "depth"]:
+        assert np.array_equal(getattr(cached, name), getattr(taxonomy, name))
+    assert cached.name(198804) == "Buchnera aphidicola str. Sg (Schizaphis graminum)"
+
+
+def test_species_directories(taxdump):
+    taxonomy = Taxonomy.load(taxdump)
+    summary = pd.DataFrame(
+        {
+            "species_taxid": [9, 1637, 12345],
+            "organism_name": ["Buchnera sp. Sg", "E. coli K-12", "Genus new"],
+            "ftp_path": ["/a", "/b", "/c"],
+        },
+        index=["GCA_000000001.1", "GCA_000000002.1", "GCA_000000003.1"],
+    )
+    expected = ["Buchnera_aphidicola", "Escherichia_coli", "Genus_new"]
+    assert species_directories(summary, taxonomy).tolist() == expected
+    assert [i.species for i in assemblies(summary, taxonomy=taxonomy)] == expected